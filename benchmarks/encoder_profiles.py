@@ -0,0 +1,51 @@
+"""
+Benchmark the encode time against the output size of each encoder profile.
+
+Usage: python -m benchmarks.encoder_profiles [image] [width]
+"""
+
+from __future__ import annotations
+
+import sys
+import time
+
+import django
+from django.conf import settings
+
+from easy_images.conf import get_setting
+from easy_images.engine import efficient_load, encoder_options, scale_image
+from easy_images.options import ParsedOptions
+from easy_images.types import format_map
+from pyvips import Image
+
+settings.configure()
+django.setup()
+
+
+def main(path: str | None = None, width: int = 1024, repeat: int = 3):
+    options = ParsedOptions(width=width, ratio="video")
+    if path:
+        source = efficient_load(path, options)
+    else:
+        # Perlin noise has smooth areas and detail, so compresses more like a photo.
+        bands = [Image.perlin(2048, 1536, cell_size=size) for size in (64, 128, 256)]
+        source = ((bands[0].bandjoin(bands[1:]) + 1) * 127.5).cast("uchar")
+        source = source.copy(interpretation="srgb")
+    image = scale_image(source, options.size).copy_memory()
+    print(f"{'format':<6} {'profile':<8} {'ms':>8} {'bytes':>9}")
+    for image_format, mimetype in format_map.items():
+        for profile in [None, *get_setting("PROFILES")]:
+            save_options = encoder_options(mimetype, profile)
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                buffer = image.write_to_buffer(f".{image_format}", Q=80, **save_options)
+                times.append(time.perf_counter() - start)
+            print(
+                f"{image_format:<6} {profile or 'default':<8}"
+                f" {min(times) * 1000:>8.1f} {len(buffer):>9}"
+            )
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:2], *[int(arg) for arg in sys.argv[2:3]])
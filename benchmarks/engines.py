@@ -0,0 +1,59 @@
+"""
+Benchmark the load, scale and encode times of each engine side by side.
+
+Usage: python -m benchmarks.engines [image] [width]
+"""
+
+from __future__ import annotations
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import django
+from django.conf import settings
+
+from easy_images.engine import VipsEngine, encoder_options
+from easy_images.options import ParsedOptions
+from easy_images.pillow_engine import PillowEngine
+from pyvips import Image
+
+settings.configure()
+django.setup()
+
+
+def main(path: str | None = None, width: int = 1024, repeat: int = 3):
+    options = ParsedOptions(width=width, ratio="video", crop=True)
+    if not path:
+        # Perlin noise has smooth areas and detail, so compresses more like a photo.
+        bands = [Image.perlin(4000, 3000, cell_size=size) for size in (64, 128, 256)]
+        source = ((bands[0].bandjoin(bands[1:]) + 1) * 127.5).cast("uchar")
+        path = str(Path(tempfile.mkdtemp()) / "source.jpg")
+        source.copy(interpretation="srgb").write_to_file(path, Q=90)
+    print(
+        f"{'engine':<8} {'format':<6} {'load':>8} {'scale':>8} {'encode':>8} {'bytes':>9}"
+    )
+    for engine in (VipsEngine(), PillowEngine()):
+        for extension, mimetype in [(".jpg", "image/jpeg"), (".webp", "image/webp")]:
+            save_options = encoder_options(mimetype)
+            times: dict[str, list[float]] = {"load": [], "scale": [], "encode": []}
+            for _ in range(repeat):
+                start = time.perf_counter()
+                img = engine.in_memory(engine.load(path, options))
+                loaded = time.perf_counter()
+                img = engine.in_memory(engine.scale(img, options.size, crop=True))
+                scaled = time.perf_counter()
+                file = engine.encode(img, f"test{extension}", **save_options)
+                times["load"].append(loaded - start)
+                times["scale"].append(scaled - loaded)
+                times["encode"].append(time.perf_counter() - scaled)
+            print(
+                f"{engine.name:<8} {extension[1:]:<6}"
+                + "".join(f" {min(t) * 1000:>8.1f}" for t in times.values())
+                + f" {file.size:>9}"
+            )
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:2], *[int(arg) for arg in sys.argv[2:3]])
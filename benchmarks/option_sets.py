@@ -0,0 +1,84 @@
+"""
+Benchmark the size of the EasyImage table before and after moving the options of each
+version into the shared OptionSet table.
+
+Usage: python -m benchmarks.option_sets [rows]
+"""
+
+from __future__ import annotations
+
+import json
+import sys
+import tempfile
+from pathlib import Path
+from uuid import uuid4
+
+import django
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+
+from easy_images.options import ParsedOptions
+
+database = Path(tempfile.mkdtemp()) / "option_sets.sqlite3"
+settings.configure(
+    DATABASES={"default": {"ENGINE": "django.db.backends.sqlite3", "NAME": database}},
+    INSTALLED_APPS=["easy_images"],
+    USE_TZ=True,
+)
+django.setup()
+
+
+def table_sizes() -> dict[str, int]:
+    """
+    The bytes used by each easy images table, including its indexes.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("VACUUM")
+        cursor.execute(
+            "SELECT tbl_name, name FROM sqlite_master"
+            " WHERE tbl_name LIKE 'easy_images_%' AND type IN ('table', 'index')"
+        )
+        objects = cursor.fetchall()
+        sizes: dict[str, int] = {}
+        for table, name in objects:
+            cursor.execute("SELECT SUM(pgsize) FROM dbstat WHERE name = %s", [name])
+            sizes[table] = sizes.get(table, 0) + (cursor.fetchone()[0] or 0)
+    return sizes
+
+
+def main(rows: int = 20000):
+    call_command("migrate", "easy_images", "0008", verbosity=0)
+    # A typical spread of versions: a few widths and densities in three formats.
+    option_sets = [
+        ParsedOptions(width=width, ratio="video", mimetype=mimetype).to_dict()
+        for width in (320, 640, 960, 1280)
+        for mimetype in ("image/jpeg", "image/webp", "image/avif")
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            "INSERT INTO easy_images_easyimage (id, created, status, error_count,"
+            " storage, name, args, image, image_url, placeholder)"
+            " VALUES (%s, '2024-01-01', 0, 0, 'default', %s, %s, '', '', '')",
+            [
+                (
+                    uuid4().hex,
+                    f"uploads/{i // len(option_sets)}.jpg",
+                    json.dumps(option_sets[i % len(option_sets)]),
+                )
+                for i in range(rows)
+            ],
+        )
+    before = table_sizes()
+    call_command("migrate", "easy_images", verbosity=0)
+    after = table_sizes()
+    print(f"{rows} versions, {len(option_sets)} option sets")
+    for label, sizes in (("JSON args", before), ("option sets", after)):
+        total = sum(sizes.values())
+        print(f"{label:<12} {total:>10} bytes {total / rows:>8.1f} bytes per version")
+        for table, size in sorted(sizes.items()):
+            print(f"  {table:<32} {size:>10}")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -7,14 +7,20 @@ class EasyImagesConfig(AppConfig):
     name = "easy_images"
 
     def ready(self):
-        from django.db.models.signals import post_save, pre_save
+        from django.db.models.signals import post_delete, post_save, pre_save
 
-        from easy_images.models import EasyImage
+        from easy_images.cache import evict_cached_image
+        from easy_images.models import EasyImage, probe_saved_source
         from easy_images.signals import (
+            file_post_save,
             find_uncommitted_filefields,
             signal_committed_filefields,
         )
 
+        post_save.connect(evict_cached_image, sender=EasyImage)
+        post_delete.connect(evict_cached_image, sender=EasyImage)
+        file_post_save.connect(probe_saved_source)
+
         # Only connect the signals to (non-EasyImage) models that have FileFields.
         for model in apps.get_models():
             if issubclass(model, EasyImage):
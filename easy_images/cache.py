@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import sys
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import TYPE_CHECKING
+from uuid import UUID
+
+from easy_images.conf import get_setting
+
+if TYPE_CHECKING:
+    from easy_images.models import EasyImage
+
+
+class CachedImage:
+    """
+    The compact details of a built ``EasyImage`` needed to render it.
+    """
+
+    __slots__ = (
+        "status",
+        "image",
+        "width",
+        "height",
+        "image_url",
+        "placeholder",
+        "last_used",
+    )
+
+    def __init__(
+        self,
+        status: int,
+        image: str,
+        width: int,
+        height: int,
+        image_url: str = "",
+        placeholder: str = "",
+        last_used: datetime | None = None,
+    ):
+        self.status = status
+        self.image = image
+        self.width = width
+        self.height = height
+        self.image_url = image_url
+        self.placeholder = placeholder
+        self.last_used = last_used
+
+    @classmethod
+    def from_instance(cls, instance: EasyImage) -> CachedImage:
+        return cls(
+            status=instance.status,
+            image=instance.image.name,
+            width=instance.width,
+            height=instance.height,
+            image_url=instance.image_url,
+            placeholder=instance.placeholder,
+            last_used=instance.last_used,
+        )
+
+    def __sizeof__(self):
+        return (
+            object.__sizeof__(self)
+            + sys.getsizeof(self.image)
+            + sys.getsizeof(self.image_url)
+            + sys.getsizeof(self.placeholder)
+        )
+
+
+class ImageCache:
+    """
+    A bounded least-recently-used cache of built images, keyed by the 16 bytes of
+    their ``EasyImageManager.hash`` UUID.
+
+    The maximum number of entries is the ``CACHE_SIZE`` setting (``0`` disables the
+    cache), and the approximate maximum memory used by them is the
+    ``CACHE_MAX_BYTES`` setting.
+    """
+
+    # How many seconds the closest built version of an unbuilt base is remembered.
+    closest_ttl = 60
+
+    def __init__(self):
+        self.entries: OrderedDict[bytes, CachedImage] = OrderedDict()
+        # The URL of the closest built version (or "" for none) of unbuilt bases,
+        # and when it expires.
+        self.closest: OrderedDict[bytes, tuple[float, str]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def entry_size(key: bytes, record: CachedImage) -> int:
+        return sys.getsizeof(key) + sys.getsizeof(record)
+
+    def get(self, pk: UUID) -> CachedImage | None:
+        if not get_setting("CACHE_SIZE"):
+            return None
+        key = pk.bytes
+        with self.lock:
+            record = self.entries.get(key)
+            if record is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return record
+
+    def set(self, instance: EasyImage):
+        maxsize = get_setting("CACHE_SIZE")
+        if not maxsize or not instance.image:
+            return
+        key = instance.pk.bytes
+        record = CachedImage.from_instance(instance)
+        with self.lock:
+            if old := self.entries.pop(key, None):
+                self.nbytes -= self.entry_size(key, old)
+            self.entries[key] = record
+            self.nbytes += self.entry_size(key, record)
+            max_bytes = get_setting("CACHE_MAX_BYTES")
+            while len(self.entries) > maxsize or (
+                max_bytes and self.nbytes > max_bytes and self.entries
+            ):
+                old_key, old = self.entries.popitem(last=False)
+                self.nbytes -= self.entry_size(old_key, old)
+
+    def get_closest_url(self, pk: UUID) -> str | None:
+        """
+        Get the remembered URL of the closest built version of an unbuilt base.
+        """
+        if not get_setting("CACHE_SIZE"):
+            return None
+        with self.lock:
+            expires, url = self.closest.get(pk.bytes, (0, ""))
+            if expires < time.monotonic():
+                return None
+            return url
+
+    def set_closest_url(self, pk: UUID, url: str):
+        maxsize = get_setting("CACHE_SIZE")
+        if not maxsize:
+            return
+        key = pk.bytes
+        with self.lock:
+            self.closest.pop(key, None)
+            self.closest[key] = (time.monotonic() + self.closest_ttl, url)
+            while len(self.closest) > maxsize:
+                self.closest.popitem(last=False)
+
+    def evict(self, pk: UUID):
+        key = pk.bytes
+        with self.lock:
+            if old := self.entries.pop(key, None):
+                self.nbytes -= self.entry_size(key, old)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.closest.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+
+image_cache = ImageCache()
+
+
+def evict_cached_image(sender, instance: EasyImage, **kwargs):
+    """
+    A post_save / post_delete signal handler which evicts the image from the cache.
+    """
+    image_cache.evict(instance.pk)
@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+from typing import Any
+
+from django.conf import settings
+
+defaults: dict[str, Any] = {
+    # Record the per-stage build timings on each EasyImage row.
+    "RECORD_BUILD_TIMINGS": False,
+    # Share built versions between sources with identical content.
+    "DEDUPLICATE": False,
+    # Store the URL of each version when it is built rather than asking the storage.
+    "STORE_URLS": False,
+    # Build version URLs from their image name, e.g. "https://cdn.example.com/{name}".
+    "URL_TEMPLATE": None,
+    # The number of built images to keep in each process's in-memory cache.
+    "CACHE_SIZE": 0,
+    # The approximate memory (in bytes) that the cache's entries can use, or None
+    # for no limit other than CACHE_SIZE.
+    "CACHE_MAX_BYTES": None,
+    # libvips save options for each format, used by every build.
+    "ENCODER": {},
+    # Named sets of libvips save options for each format, overriding "ENCODER".
+    "PROFILES": {
+        "fast": {
+            "avif": {"effort": 3},
+            "webp": {"effort": 0},
+            "jpeg": {"optimize_coding": False},
+        },
+        "small": {
+            "avif": {"effort": 5, "strip": True},
+            "webp": {"effort": 6, "smart_subsample": True, "strip": True},
+            "jpeg": {
+                "optimize_coding": True,
+                "interlace": True,
+                "trellis_quant": True,
+                "strip": True,
+            },
+        },
+    },
+    # The profile used for images built inline (unless an Img sets its own), e.g.
+    # "fast". None keeps the ENCODER options.
+    "INLINE_PROFILE": None,
+    # The profile used for images built from the queue (unless an Img sets its own),
+    # e.g. "small". None keeps the ENCODER options.
+    "QUEUE_PROFILE": None,
+    # The range of qualities to search for a quality="auto" image.
+    "AUTO_QUALITY_RANGE": (30, 95),
+    # The maximum number of trial encodes for a quality="auto" image.
+    "AUTO_QUALITY_TRIALS": 6,
+    # Build a tiny placeholder for each version, either "lqip" or "color".
+    "PLACEHOLDER": None,
+    # Add an inline onload script that removes the placeholder once the image has
+    # loaded (which a strict Content Security Policy blocks).
+    "PLACEHOLDER_ONLOAD": False,
+    # What to use for the src of an <img> whose base version isn't built yet: one or
+    # more of "build", "closest", "placeholder" or "original" (tried in order).
+    "FALLBACK": "original",
+    # The largest source that the "build" fallback will build inline.
+    "FALLBACK_BUILD_MAX_BYTES": 5 * 1024 * 1024,
+    # Sources over any of these limits (checked before decoding any pixels) aren't
+    # built and are marked as too large. Set a limit to None to turn it off.
+    "MAX_SOURCE_BYTES": 100 * 1024 * 1024,
+    "MAX_SOURCE_PIXELS": 100_000_000,
+    "MAX_SOURCE_FRAMES": 1000,
+    # The import path of the image engine, either the libvips engine or the Pillow
+    # engine ("easy_images.pillow_engine.PillowEngine").
+    "ENGINE": "easy_images.engine.VipsEngine",
+    # libvips options (cache_max, cache_max_mem, cache_max_files, concurrency and
+    # vector) applied before the first image is loaded. A nested dictionary of
+    # options for a process role overrides them, e.g.
+    # {"concurrency": 2, "build": {"concurrency": 0}}.
+    "VIPS": {},
+    # Animated GIF and WebP sources with more frames (or more pixels across all of
+    # their frames) than these budgets are built from just their first frame.
+    "ANIMATION_MAX_FRAMES": 200,
+    "ANIMATION_MAX_PIXELS": 50_000_000,
+    # Record the details of each image saved to a model's FileField (see
+    # SourceImage) when it is saved, rather than when it is first built.
+    "PROBE_ON_SAVE": False,
+    # How many seconds the recorded details of a source are trusted (while its size
+    # is unchanged) before its modified time is checked again, or None to only check
+    # its size.
+    "SOURCE_RECHECK": 24 * 60 * 60,
+    # Build versions larger than their source (by upscaling it). An Img's "upscale"
+    # option overrides this.
+    "UPSCALE": True,
+    # The loading and decoding attributes of each <img> (e.g. "lazy" and "async"),
+    # unless an Img sets its own.
+    "LOADING": None,
+    "DECODING": None,
+    # Render unbuilt versions with URLs to the view that builds them on demand.
+    "ON_DEMAND": False,
+    # How many seconds the on demand view waits for a version being built elsewhere.
+    "ON_DEMAND_WAIT": 10,
+    # How many seconds a version can be marked as building before it's treated as
+    # abandoned (for example, by a worker that was killed) and built again.
+    "BUILD_TIMEOUT": 600,
+}
+
+
+def get_setting(name: str) -> Any:
+    """
+    Get an easy images setting from the ``EASY_IMAGES`` dictionary in the Django
+    settings, falling back to the default value.
+    """
+    return getattr(settings, "EASY_IMAGES", {}).get(name, defaults[name])
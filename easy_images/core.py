@@ -1,6 +1,10 @@
 from __future__ import annotations
 
+import math
 import mimetypes
+import time
+from functools import cached_property
+from itertools import chain
 from typing import TYPE_CHECKING, NamedTuple, cast
 
 from django.db.models import F, FileField, ImageField, Model
@@ -9,15 +13,15 @@ from django.utils import timezone
 from django.utils.html import escape
 from typing_extensions import Unpack
 
+from easy_images.cache import image_cache
+from easy_images.conf import get_setting
 from easy_images.options import ParsedOptions
 from easy_images.signals import file_post_save, queued_img
-from easy_images.types import BuildChoices, ImgOptions, Options
+from easy_images.stats import record_render
+from easy_images.types import BuildChoices, ImgOptions, Options, format_map
 
 if TYPE_CHECKING:
-    from easy_images.models import EasyImage
-
-
-format_map = {"avif": "image/avif", "webp": "image/webp"}
+    from easy_images.models import EasyImage, SourceImage
 
 
 option_defaults: ImgOptions = {
@@ -30,6 +34,9 @@ option_defaults: ImgOptions = {
 
 
 class Img:
+    # Img instances are callable, but can be passed to the {% img %} tag as-is.
+    do_not_call_in_templates = True
+
     def __init__(self, **options: Unpack[ImgOptions]):
         all_options = option_defaults.copy()
         all_options.update(options)
@@ -89,6 +96,12 @@ class Img:
         file_post_save.connect(handle_file, sender=model, weak=False)
 
 
+# A 1x1 transparent GIF.
+transparent_gif = (
+    "data:image/gif;base64,R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7"
+)
+
+
 class SrcSetItem(NamedTuple):
     thumb: EasyImage
     options: Options
@@ -97,7 +110,9 @@ class SrcSetItem(NamedTuple):
 class BoundImg:
     alt: str
     base: EasyImage | None
+    base_options: ParsedOptions | None
     srcset: list[SrcSetItem]
+    sources: dict[str, list[SrcSetItem]]
 
     def __init__(
         self,
@@ -108,39 +123,190 @@ class BoundImg:
         build: BuildChoices = None,
         send_signal: bool,
     ):
-        from . import engine
         from .models import EasyImage, ImageStatus
 
+        record_render("bound_imgs")
         self.file = file
         self.img = img
+        self._base_url: str | None = None
+        # Whether the base_url is the original file (as the fallback).
+        self._base_is_original = False
+        img_options = cast(ImgOptions, img.options.copy())
+        upscale = img_options.get("upscale")
+        img_options["upscale"] = get_setting("UPSCALE") if upscale is None else upscale
 
         queued = False
-        if "width" in img.options and img.options["width"] is not None:
-            base_options = ParsedOptions(file.instance, **img.options)
+        if "width" in img_options and img_options["width"] is not None:
+            base_options = ParsedOptions(file.instance, **img_options)
             base_options.mimetype = "image/jpeg"
+            self.base_options = base_options
             self.base, created = EasyImage.objects.from_file(file, base_options)
             if created and not build:
                 queued = True
             base_width = base_options.width
         else:
             self.base = None
+            self.base_options = None
             base_width = None
 
         densities = img.options.get("densities") or []
+        formats = img.options.get("formats") or [img.options.get("format")]
+
+        # The srcset versions of each format, keyed by mimetype.
+        self.sources: dict[str, list[SrcSetItem]] = {}
+        sizes_attr: list[str] = []
+        for image_format in formats:
+            options = cast(Options, img_options.copy())
+            format_densities = list(densities)
+            if image_format:
+                options["mimetype"] = format_map[image_format]
+                if 1 not in format_densities and options["mimetype"] != "image/jpeg":
+                    format_densities.insert(0, 1)
+            else:
+                source_type = mimetypes.guess_type(file.name)[0]
+                options["mimetype"] = source_type or "image/jpeg"
+            srcset, sizes_attr, format_queued = self._srcset(
+                options, format_densities, base_width, build
+            )
+            self.sources[options["mimetype"]] = srcset
+            if format_queued:
+                queued = True
 
-        options = cast(Options, img.options.copy())
-        if "format" in img.options and img.options["format"]:
-            options["mimetype"] = format_map[img.options["format"]]
-            if 1 not in densities and options["mimetype"] != "image/jpeg":
-                densities.insert(0, 1)
+        if build:
+            build_options: list[tuple[EasyImage, ParsedOptions]] = []
+            if build == "srcset":
+                for srcset_item in chain.from_iterable(self.sources.values()):
+                    if srcset_item.thumb.image:
+                        continue
+                    build_options.append(
+                        (
+                            srcset_item.thumb,
+                            ParsedOptions(file.instance, **srcset_item.options),
+                        )
+                    )
+            if self.base:
+                build_options.append((self.base, base_options))
+            self._build_inline(build_options)
+
+        # Leave out versions skipped for being larger than the source.
+        for mimetype, srcset in self.sources.items():
+            self.sources[mimetype] = [
+                srcset_item
+                for srcset_item in srcset
+                if srcset_item.thumb.status != ImageStatus.SKIPPED
+            ]
+        # Only use the srcset of a format if all of its versions are built (or can be
+        # built on demand).
+        if not get_setting("ON_DEMAND"):
+            for mimetype, srcset in self.sources.items():
+                if not all(srcset_item.thumb.image for srcset_item in srcset):
+                    self.sources[mimetype] = []
+        self.srcset = next(iter(self.sources.values()))
+        self.sizes = ", ".join(sizes_attr)
+
+        if isinstance(alt, str):
+            self.alt = alt
+        elif "alt" in img.options and isinstance(img.options["alt"], str):
+            self.alt = img.options["alt"]
         else:
-            source_type = mimetypes.guess_type(file.name)[0]
-            options["mimetype"] = source_type or "image/jpeg"
+            self.alt = ""
 
+        if queued and send_signal:
+            queued_img.send(sender=img, instance=file)
+
+    def _build_inline(self, build_options: list[tuple[EasyImage, ParsedOptions]]):
+        """
+        Build versions inline, loading the source image once for all of them.
+        """
+        from . import engine
+        from .models import (
+            EasyImage,
+            ImageStatus,
+            SourceImage,
+            content_digest,
+            image_name_and_storage,
+        )
+
+        if not build_options:
+            return
+        start = time.perf_counter()
+        try:
+            name, storage = image_name_and_storage(self.file)
+            info = SourceImage.objects.info_for(
+                self.file, name=name, storage=storage, size=self.file.size
+            )
+            source_img = engine.get_engine().load(
+                file=self.file,
+                options=[opts[1] for opts in build_options],
+                info=info,
+            )
+            source_digest = (
+                content_digest(self.file) if get_setting("DEDUPLICATE") else None
+            )
+        except engine.SourceTooLarge:
+            for im, opts in build_options:
+                EasyImage.objects.filter(
+                    pk=im.pk, status_changed_date=im.status_changed_date
+                ).update(
+                    status=ImageStatus.SOURCE_TOO_LARGE,
+                    status_changed_date=timezone.now(),
+                )
+        except Exception:
+            for im, opts in build_options:
+                EasyImage.objects.filter(
+                    pk=im.pk, status_changed_date=im.status_changed_date
+                ).update(
+                    error_count=F("error_count") + 1,
+                    status=ImageStatus.SOURCE_ERROR,
+                    status_changed_date=timezone.now(),
+                )
+        else:
+            for im, opts in build_options:
+                im.build(
+                    source_img=source_img,
+                    options=opts,
+                    source_digest=source_digest,
+                    profile=get_setting("INLINE_PROFILE"),
+                    source_info=info,
+                )
+        record_render("inline_builds", len(build_options))
+        record_render("inline_build_time", time.perf_counter() - start)
+
+    def _srcset(
+        self,
+        options: Options,
+        densities: list[int | float],
+        base_width: int | None,
+        build: BuildChoices,
+    ) -> tuple[list[SrcSetItem], list[str], bool]:
+        """
+        Get (or queue) the srcset versions for a single format.
+
+        Returns the srcset items, the sizes attribute parts and whether any versions
+        were queued.
+        """
+        from .models import EasyImage
+
+        file = self.file
+        queued = False
         srcset: list[SrcSetItem] = []
         sizes_attr: list[str] = []
-
-        sizes = img.options.get("sizes")
+        # The options of versions left out for being larger than the source.
+        skipped: list[Options] = []
+
+        def add_version(version_options: Options) -> bool:
+            """
+            Add a version to the srcset, returning whether it was queued.
+            """
+            parsed_options = ParsedOptions(file.instance, **version_options)
+            if self._exceeds_source(parsed_options):
+                skipped.append(version_options)
+                return False
+            instance, created = EasyImage.objects.from_file(file, parsed_options)
+            srcset.append(SrcSetItem(instance, version_options))
+            return created and build != "srcset"
+
+        sizes = self.img.options.get("sizes")
         max_width = base_width
         if sizes and max_width:
             img_options = cast(Options, options).copy()
@@ -162,18 +328,9 @@ class BoundImg:
                     max_options = media_options
                     max_width = max_width
                 sizes_attr.append(f"{media} {parsed_options.width}px")
-                instance, created = EasyImage.objects.from_file(
-                    file, ParsedOptions(file.instance, **media_options)
-                )
-
-                srcset.append(SrcSetItem(instance, media_options))
-                if created and build != "srcset":
+                if add_version(media_options):
                     queued = True
-            instance, created = EasyImage.objects.from_file(
-                file, ParsedOptions(file.instance, **img_options)
-            )
-            srcset.append(SrcSetItem(instance, img_options))
-            if created and build != "srcset":
+            if add_version(img_options):
                 queued = True
             sizes_attr.append(f"{max_width}px")
             max_density = max(densities) if densities else 1
@@ -181,79 +338,73 @@ class BoundImg:
                 # Find the max size and multiply it by the max density to get an extra size that should be generated.
                 high_density_options = max_options.copy()
                 high_density_options["width_multiplier"] = max_density
-                instance, created = EasyImage.objects.from_file(
-                    file, ParsedOptions(file.instance, **high_density_options)
-                )
-                srcset.append(SrcSetItem(instance, high_density_options))
-                if created and build != "srcset":
+                if add_version(high_density_options):
                     queued = True
         elif densities:
             for density in densities:
                 alt_options = options.copy()
                 alt_options["width_multiplier"] = density
-                instance, created = EasyImage.objects.from_file(
-                    file, ParsedOptions(file.instance, **alt_options)
-                )
-                srcset.append(SrcSetItem(instance, alt_options))
-                if created and build != "srcset":
+                if add_version(alt_options):
                     queued = True
+        if skipped and (collapsed := self._collapse(skipped, srcset)):
+            if add_version(collapsed):
+                queued = True
+        return srcset, sizes_attr, queued
 
-        if build:
-            build_options: list[tuple[EasyImage, ParsedOptions]] = []
-            if build == "srcset":
-                for srcset_item in srcset:
-                    if srcset_item.thumb.image:
-                        continue
-                    build_options.append(
-                        (
-                            srcset_item.thumb,
-                            ParsedOptions(file.instance, **srcset_item.options),
-                        )
-                    )
-            if self.base:
-                build_options.append((self.base, base_options))
-            if build_options:
-                try:
-                    source_img = engine.efficient_load(
-                        file=self.file,
-                        options=[opts[1] for opts in build_options],
-                    )
-                except Exception:
-                    for im, opts in build_options:
-                        EasyImage.objects.filter(
-                            pk=im.pk, status_changed_date=im.status_changed_date
-                        ).update(
-                            error_count=F("error_count") + 1,
-                            status=ImageStatus.SOURCE_ERROR,
-                            status_changed_date=timezone.now(),
-                        )
-                else:
-                    for im, opts in build_options:
-                        im.build(
-                            source_img=source_img,
-                            options=opts,
-                        )
-
-        if all(srcset_item.thumb.image for srcset_item in srcset):
-            self.srcset = srcset
-        elif srcset:
-            self.srcset = []
-        self.sizes = ", ".join(sizes_attr)
-
-        if isinstance(alt, str):
-            self.alt = alt
-        elif "alt" in img.options and isinstance(img.options["alt"], str):
-            self.alt = img.options["alt"]
+    def _exceeds_source(self, options: ParsedOptions) -> bool:
+        """
+        Whether a version should be left out for being larger than the source (only
+        once the source's dimensions are known and if its ``upscale`` option is off).
+        """
+        if options.upscale is not False:
+            return False
+        source = self.source
+        return bool(source and options.skip_for(source.width, source.height))
+
+    def _collapse(
+        self, skipped: list[Options], srcset: list[SrcSetItem]
+    ) -> Options | None:
+        """
+        Collapse the versions skipped for being larger than the source into a single
+        version at the largest size the source allows, unless the srcset already has
+        a version that large.
+        """
+        source = self.source
+        if not source:
+            return None
+        file = self.file
+        largest = max(skipped, key=lambda o: ParsedOptions(file.instance, **o).width)
+        parsed_options = ParsedOptions(file.instance, **largest)
+        width = source.width
+        if parsed_options.ratio:
+            width = min(width, int(source.height * parsed_options.ratio))
+        srcset_widths = [
+            ParsedOptions(file.instance, **srcset_item.options).width or 0
+            for srcset_item in srcset
+        ]
+        if width <= max(srcset_widths, default=0):
+            return None
+        collapsed = largest.copy()
+        collapsed.pop("width_multiplier", None)
+        if "srcset_width" in collapsed:
+            collapsed["width"] = collapsed["srcset_width"] = width
         else:
-            self.alt = ""
-
-        if queued and send_signal:
-            queued_img.send(sender=img, instance=file)
-
-    def as_html(self):
-        srcset = []
-        for srcset_item in self.srcset:
-            srcset_str = srcset_item.thumb.image.url
+            base_width = ParsedOptions(file.instance, **collapsed).width or width
+            # Round the density down so the version is never larger than the source.
+            collapsed["width_multiplier"] = math.floor(width / base_width * 10) / 10
+            width = ParsedOptions(file.instance, **collapsed).width or 0
+            if width <= max(srcset_widths, default=0):
+                return None
+        return collapsed
+
+    @staticmethod
+    def srcset_attr(srcset: list[SrcSetItem]) -> str:
+        items = []
+        for srcset_item in srcset:
+            thumb = srcset_item.thumb
+            srcset_str = (
+                thumb.get_image_url() if thumb.image else thumb.get_on_demand_url()
+            )
             if w := srcset_item.options.get("srcset_width"):
                 if mult := srcset_item.options.get("width_multiplier"):
                     w *= mult
@@ -261,7 +412,34 @@ class BoundImg:
             elif w := srcset_item.options.get("width_multiplier"):
                 if w != 1:
                     srcset_str += f" {w:g}x"
-            srcset.append(srcset_str)
+            items.append(srcset_str)
+        return ", ".join(items)
+
+    def as_html(self):
+        return self._img_html(self.srcset)
+
+    def as_picture_html(self):
+        """
+        Render a ``<picture>`` element with a ``<source>`` for each built format,
+        falling back to an ``<img>`` of the base image.
+        """
+        sources = []
+        for mimetype, srcset in self.sources.items():
+            if not srcset:
+                continue
+            source_attrs = {"type": mimetype, "srcset": self.srcset_attr(srcset)}
+            if self.sizes:
+                source_attrs["sizes"] = self.sizes
+            sources.append(f"<source {self._attrs(source_attrs)}>")
+        return f"<picture>{''.join(sources)}{self._img_html([])}</picture>"
+
+    @staticmethod
+    def _attrs(attrs: dict) -> str:
+        return " ".join(
+            (f'{k}="{escape(v)}"' if v is not True else k) for k, v in attrs.items()
+        )
+
+    def _img_html(self, srcset: list[SrcSetItem]):
         img_attrs = self.img.options.get("img_attrs")
         if img_attrs:
             img_attrs = img_attrs.copy()
@@ -271,19 +449,194 @@ class BoundImg:
         img_attrs["src"] = self.base_url()
 
         if srcset:
-            img_attrs["srcset"] = ", ".join(srcset)
+            img_attrs["srcset"] = self.srcset_attr(srcset)
             if self.sizes:
                 img_attrs["sizes"] = self.sizes
 
+        if "width" not in img_attrs and "height" not in img_attrs:
+            if dimensions := self.dimensions:
+                img_attrs["width"], img_attrs["height"] = (str(n) for n in dimensions)
+
         img_attrs["alt"] = self.alt
 
-        attrs = " ".join(
-            (f'{k}="{escape(v)}"' if v is not True else k) for k, v in img_attrs.items()
-        )
-        return f"<img {attrs}>"
+        for key in ("loading", "decoding"):
+            value = self.img.options.get(key, get_setting(key.upper()))
+            if value and key not in img_attrs:
+                img_attrs[key] = value
+
+        if placeholder := self.placeholder:
+            if placeholder.startswith("data:"):
+                style = f"background-image:url({placeholder});background-size:cover"
+            else:
+                style = f"background-color:{placeholder}"
+            if existing_style := img_attrs.get("style"):
+                style = f"{existing_style.rstrip(';')};{style}"
+            img_attrs["style"] = style
+            if get_setting("PLACEHOLDER_ONLOAD"):
+                # Remove the placeholder once loaded, so it doesn't show behind
+                # transparent images.
+                img_attrs.setdefault("onload", "this.style.background=null")
+
+        return f"<img {self._attrs(img_attrs)}>"
+
+    @property
+    def placeholder(self) -> str:
+        """
+        The placeholder (see the ``PLACEHOLDER`` setting) of the first built version,
+        otherwise the placeholder recorded for the source by any of its versions.
+        """
+        versions = [self.base] if self.base else []
+        for srcset in self.sources.values():
+            versions.extend(srcset_item.thumb for srcset_item in srcset)
+        for version in versions:
+            if version.placeholder:
+                return version.placeholder
+        if get_setting("PLACEHOLDER") and self.source:
+            return self.source.placeholder
+        return ""
+
+    @property
+    def dimensions(self) -> tuple[int, int] | None:
+        """
+        The intrinsic ``(width, height)`` of the base image's ``src``.
+
+        This comes from the built version's stored dimensions or, before it is built,
+        from the size of a cropped version. If the original file is used instead, the
+        base width is used with the aspect ratio of the source (if it is recorded).
+        """
+        from .models import ImageStatus
+
+        base = self.base
+        if not base or base.status == ImageStatus.SKIPPED:
+            return None
+        # Work out the src first, which may build the base version.
+        self.base_url()
+        if base.image:
+            if base.width and base.height:
+                return base.width, base.height
+            return None
+        if self._base_is_original:
+            return self._original_dimensions()
+        # Only a cropped version is known to be exactly its target size.
+        if self.base_options and self.base_options.crop:
+            return self.base_options.size
+        return None
+
+    def _original_dimensions(self) -> tuple[int, int] | None:
+        """
+        The base width, with the height from the aspect ratio of the original file.
+        """
+        width = self.base_options.width if self.base_options else None
+        source = self.source
+        if not width or not source or not source.width or not source.height:
+            return None
+        source_width, source_height = source.width, source.height
+        # Browsers display the original file rotated by its EXIF orientation.
+        if source.orientation and source.orientation >= 5:
+            source_width, source_height = source_height, source_width
+        return width, max(1, round(width * source_height / source_width))
+
+    @cached_property
+    def source(self) -> SourceImage | None:
+        """
+        The recorded details of the source image, or ``None`` if it hasn't been
+        probed yet (by a build, or when saved if ``PROBE_ON_SAVE`` is on).
+        """
+        from .models import SourceImage
+
+        return SourceImage.objects.for_file(self.file)
 
     def base_url(self):
-        return self.base.image.url if self.base and self.base.image else self.file.url
+        if self._base_url is None:
+            self._base_url = self._get_base_url()
+        return self._base_url
+
+    def _get_base_url(self) -> str:
+        if self.base and self.base.image:
+            return self.base.get_image_url()
+        if self.base and get_setting("ON_DEMAND"):
+            return self.base.get_on_demand_url()
+        if self.base:
+            policies = get_setting("FALLBACK")
+            if isinstance(policies, str):
+                policies = [policies]
+            for policy in policies:
+                if policy == "original":
+                    break
+                if policy == "build":
+                    if self._fallback_build():
+                        return self.base.get_image_url()
+                elif policy == "closest":
+                    if closest_url := self._closest_url():
+                        return closest_url
+                elif policy == "placeholder":
+                    placeholder = self.placeholder
+                    if placeholder.startswith("data:"):
+                        return placeholder
+                    return transparent_gif
+                else:
+                    raise ValueError(f"Unknown fallback policy {policy}")
+        record_render("fallbacks")
+        self._base_is_original = True
+        return self.file.url
+
+    def _fallback_build(self) -> bool:
+        """
+        Build the base version inline, if the source is within the
+        ``FALLBACK_BUILD_MAX_BYTES`` budget.
+        """
+        if not self.base or not self.base_options:
+            return False
+        try:
+            if self.file.size > get_setting("FALLBACK_BUILD_MAX_BYTES"):
+                return False
+        except Exception:
+            return False
+        self._build_inline([(self.base, self.base_options)])
+        return bool(self.base.image)
+
+    def _closest_url(self) -> str:
+        """
+        Get the URL of the closest built version (see ``_closest_version``), cached
+        for a short time in the ``CACHE_SIZE`` in-process cache.
+        """
+        if not self.base:
+            return ""
+        url = image_cache.get_closest_url(self.base.pk)
+        if url is None:
+            closest = self._closest_version()
+            url = closest.get_image_url() if closest else ""
+            image_cache.set_closest_url(self.base.pk, url)
+        return url
+
+    def _closest_version(self) -> EasyImage | None:
+        """
+        Find the already built JPEG version of the source (which all browsers
+        support) with the same shape as the base that is closest to the base width,
+        preferring larger versions.
+        """
+        from .models import EasyImage
+
+        base_options = self.base_options
+        width = base_options.width if base_options else None
+        if not base_options or not width:
+            return None
+        versions = []
+        for version in EasyImage.objects.all_for_file(self.file).exclude(image=""):
+            options = ParsedOptions(**version.args)
+            if (
+                options.mimetype in (None, "image/jpeg")
+                and options.ratio == base_options.ratio
+                and options.crop == base_options.crop
+                and options.window == base_options.window
+            ):
+                versions.append(version)
+
+        def distance(version: EasyImage):
+            smaller = (version.width or 0) < width
+            return (smaller, abs((version.width or 0) - width))
+
+        return min(versions, key=distance, default=None)
 
     def __str__(self):
         return self.base_url()
@@ -1,17 +1,24 @@
 from __future__ import annotations
 
+import base64
 import io
 import math
 import os
+import sys
+import warnings
 from mimetypes import guess_type
 from pathlib import Path
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any, Callable, NamedTuple, Protocol
 
 from django.core.files import File
 from django.core.files.uploadedfile import InMemoryUploadedFile, TemporaryUploadedFile
 from django.db.models.fields.files import FieldFile
+from django.utils.module_loading import import_string
 
+from easy_images.conf import get_setting
 from easy_images.core import ParsedOptions
+from easy_images.geometry import round_half_up, scale_geometry
+from easy_images.types import format_map
 
 if TYPE_CHECKING:
     from pyvips import Image
@@ -26,77 +33,251 @@ def scale_image(
 ):
     """
     Scale an image to cover the given dimensions, optionally cropping it around a focal
-    point or a focal window.
-    """
-    w, h = img.width, img.height
-
-    # Size image down to cover the dimensions
-    scale = max(target[0] / w, target[1] / h)
-
-    # Focal window scaling
-    if focal_window:
-        f_left = focal_window[0] * w
-        f_right = focal_window[2] * w
-        f_top = focal_window[1] * h
-        f_bottom = focal_window[3] * h
-        # If the focal window is larger than the target, crop the image to the focal
-        # window and scale it down to the target size.
-        if f_right - f_left > target[0] and f_bottom - f_top > target[1]:
-            img = img.extract_area(f_left, f_top, f_right - f_left, f_bottom - f_top)
-            w, h = img.width, h
-            scale = max(target[0] / w, target[1] / h)
-            focal_window = None
-        # Otherwise, if cropping then set the crop focal point to the center of the
-        # focal window.
-        elif crop is True:
-            crop = (
-                (f_left + f_right) / 2,
-                (f_top + f_bottom) / 2,
-            )
+    point or a focal window (see ``geometry.scale_geometry``).
+    """
+    source = (img.width, page_height(img))
+    geometry = scale_geometry(source, target, crop=crop, focal_window=focal_window)
+    if geometry.window != (0, 0, *source):
+        img = _crop(img, *geometry.window)
+    img = _resize(img, geometry.scale)
+    if geometry.box != (0, 0, *geometry.resized):
+        img = _crop(img, *geometry.box)
+    return img
+
+
+def page_height(img: Image) -> int:
+    """
+    The height of each page (or animation frame) of an image.
+
+    Multi-page images are loaded as a single tall strip of pages.
+    """
+    if img.get_typeof("page-height"):
+        height = img.get("page-height")
+        if 0 < height < img.height and img.height % height == 0:
+            return height
+    return img.height
 
-    img = img.resize(scale)
-    w, h = img.width, img.height
 
-    if not crop:
+def first_page(img: Image) -> Image:
+    """
+    Get the first page of a multi-page image (or the image itself).
+    """
+    height = page_height(img)
+    if height == img.height:
         return img
+    return _with_page_height(img.crop(0, 0, img.width, height), height)
 
-    if crop is True:
-        crop = (0.5, 0.5)
 
-    # Calculate the coordinates of the cropping box
-    if focal_window:
-        focal_point = (
-            int(focal_window[0] + crop[0] * (focal_window[2] - focal_window[0]) / 2),
-            int(focal_window[1] + crop[1] * (focal_window[3] - focal_window[1]) / 2),
-        )
-    else:
-        focal_point = (
-            int(crop[0] * w),
-            int(crop[1] * h),
-        )
-    left = focal_point[0] - target[0] // 2
-    top = focal_point[1] - target[1] // 2
-    right = left + target[0]
-    bottom = top + target[1]
-
-    # Make sure the cropping box is within the image, otherwise move it.
-    if left < 0:
-        right -= left
-        left = 0
-    elif right > w:
-        left -= right - w
-        right = w
-    if top < 0:
-        bottom -= top
-        top = 0
-    elif bottom > h:
-        top -= bottom - h
-        bottom = h
-    return img.extract_area(left, top, right - left, bottom - top)
+def _with_page_height(img: Image, height: int) -> Image:
+    img = img.copy()
+    img.set("page-height", height)
+    return img
+
+
+def _resize(img: Image, scale: float) -> Image:
+    """
+    Resize an image, keeping each page of a multi-page image the same height.
+    """
+    height = page_height(img)
+    if height == img.height:
+        return img.resize(scale)
+    new_height = round_half_up(height * scale)
+    img = img.resize(scale, vscale=new_height / height)
+    return _with_page_height(img, new_height)
+
+
+def _crop(img: Image, left, top, width, height) -> Image:
+    """
+    Crop an image, cropping each page of a multi-page image separately.
+    """
+    from pyvips import Image
+
+    pages = img.height // page_height(img)
+    if pages == 1:
+        return img.extract_area(left, top, width, height)
+    step = img.height // pages
+    cropped = [
+        img.extract_area(left, top + page * step, width, height)
+        for page in range(pages)
+    ]
+    return _with_page_height(Image.arrayjoin(cropped, across=1), int(height))
+
+
+class SourceInfo(NamedTuple):
+    """
+    The details of a source image read from its header.
+    """
+
+    width: int
+    # The height of the first page (or animation frame).
+    height: int
+    # The format, from the name of the libvips loader (e.g. "jpeg" or "png").
+    format: str
+    # The EXIF orientation.
+    orientation: int | None
+    frames: int
+
+
+def source_info(img: Image) -> SourceInfo:
+    """
+    Get the details of a source image that has just been loaded (so that only its
+    header has been read).
+    """
+    loader = img.get("vips-loader")
+    return SourceInfo(
+        width=img.width,
+        height=page_height(img),
+        format=loader.split("load")[0],
+        orientation=(img.get("orientation") if img.get_typeof("orientation") else None),
+        frames=img.get("n-pages") if img.get_typeof("n-pages") else 1,
+    )
+
+
+def probe(file: str | Path | File) -> SourceInfo:
+    """
+    Read the details of a source image from its header.
+    """
+    return source_info(_new_image(file, access="sequential"))
+
+
+def _animated_pages(info: SourceInfo) -> int:
+    """
+    The number of frames of an animated image to load, or ``1`` if it isn't animated
+    or is over the ``ANIMATION_MAX_FRAMES`` or ``ANIMATION_MAX_PIXELS`` budgets (in
+    which case just the first frame is used).
+    """
+    if info.frames < 2 or info.format not in animated_formats:
+        return 1
+    if info.frames > get_setting("ANIMATION_MAX_FRAMES"):
+        return 1
+    if info.width * info.height * info.frames > get_setting("ANIMATION_MAX_PIXELS"):
+        return 1
+    return info.frames
+
+
+# The formats that can be animated.
+animated_formats = ("gif", "webp")
+
+
+class SourceTooLarge(Exception):
+    """
+    The source image is over the ``MAX_SOURCE_BYTES``, ``MAX_SOURCE_PIXELS`` or
+    ``MAX_SOURCE_FRAMES`` limits.
+    """
+
+
+def check_source(info: SourceInfo, source_bytes: int | None = None):
+    """
+    Check a source image against the source limits using just its header details,
+    raising ``SourceTooLarge`` if it is over any of them.
+    """
+    max_bytes = get_setting("MAX_SOURCE_BYTES")
+    if max_bytes and source_bytes and source_bytes > max_bytes:
+        raise SourceTooLarge(f"{source_bytes} bytes is over the {max_bytes} limit")
+    max_pixels = get_setting("MAX_SOURCE_PIXELS")
+    pixels = info.width * info.height
+    if max_pixels and pixels > max_pixels:
+        raise SourceTooLarge(f"{pixels} pixels is over the {max_pixels} limit")
+    max_frames = get_setting("MAX_SOURCE_FRAMES")
+    if max_frames and info.frames > max_frames:
+        raise SourceTooLarge(f"{info.frames} frames is over the {max_frames} limit")
+
+
+def configure_vips(
+    cache_max: int | None = None,
+    cache_max_mem: int | None = None,
+    cache_max_files: int | None = None,
+    concurrency: int | None = None,
+    vector: bool | None = None,
+):
+    """
+    Configure the libvips operation cache, worker threads and SIMD (vector) code for
+    this process.
+
+    Options left as ``None`` are not changed. libvips only reads the vector option
+    when it starts, so it must be set before pyvips is imported.
+    """
+    if vector is not None:
+        if "pyvips" in sys.modules:
+            warnings.warn(
+                "libvips has already started, so its vector option can't be changed"
+            )
+        elif vector:
+            os.environ.pop("VIPS_NOVECTOR", None)
+        else:
+            os.environ["VIPS_NOVECTOR"] = "1"
+
+    import pyvips
+
+    if cache_max is not None:
+        pyvips.cache_set_max(cache_max)
+    if cache_max_mem is not None:
+        pyvips.cache_set_max_mem(cache_max_mem)
+    if cache_max_files is not None:
+        pyvips.cache_set_max_files(cache_max_files)
+    if concurrency is not None:
+        pyvips.concurrency_set(concurrency)
+
+
+def vips_options(role: str | None = None) -> dict:
+    """
+    Get the libvips options from the ``VIPS`` setting, overridden by the options for
+    the given process role (e.g. ``"build"``).
+    """
+    setting = get_setting("VIPS")
+    options = {k: v for k, v in setting.items() if not isinstance(v, dict)}
+    if role:
+        options.update(setting.get(role, {}))
+    return options
+
+
+def apply_vips_settings(role: str | None = None, **overrides) -> dict:
+    """
+    Configure libvips from the ``VIPS`` setting for a process role, with any
+    overrides that aren't ``None``.
+
+    Returns the effective libvips settings.
+    """
+    global _vips_configured
+    _vips_configured = True
+    options = vips_options(role)
+    options.update({k: v for k, v in overrides.items() if v is not None})
+    configure_vips(**options)
+    return effective_vips_settings()
+
+
+# Whether libvips has been configured for this process yet.
+_vips_configured = False
+
+
+def _start_vips():
+    """
+    Configure libvips from the ``VIPS`` setting before the first image is loaded, so
+    that only processes which actually build images import pyvips.
+    """
+    if not _vips_configured:
+        apply_vips_settings()
+
+
+def effective_vips_settings() -> dict:
+    """
+    Get the settings libvips is actually using.
+    """
+    import pyvips
+
+    return {
+        "cache_max": pyvips.cache_get_max(),
+        "cache_max_mem": pyvips.cache_get_max_mem(),
+        "cache_max_files": pyvips.cache_get_max_files(),
+        "concurrency": pyvips.concurrency_get(),
+        "vector": not os.environ.get("VIPS_NOVECTOR"),
+    }
 
 
 def efficient_load(
-    file: str | Path | File, options: list[ParsedOptions] | ParsedOptions | None
+    file: str | Path | File,
+    options: list[ParsedOptions] | ParsedOptions | None,
+    info: SourceInfo | None = None,
 ) -> Image:
     """
     Load an image from a file, using the most efficient method available.
@@ -104,25 +285,64 @@ def efficient_load(
     Pass a list of target sizes as tuples of ``(width, height)`` or ``(width_ratio,
     height_ratio)`` and the image will be loaded (optimally shrunk to at least 3x the
     largest target size if possible).
+
+    All the frames of an animated GIF or WebP are loaded (as a single tall strip,
+    see ``page_height``) unless the animation is over the frame or pixel budgets.
+
+    Pass the already known ``info`` of the source to avoid reading its header before
+    loading it.
+
+    Raises ``SourceTooLarge`` (before any pixels are decoded) if the source is over
+    the source limits.
     """
     if options and not isinstance(options, list):
         options = [options]
     # Use random access if there are multiple target sizes, since the source image will
     # be used multiple times.
     access = "random" if options and len(options) > 1 else "sequential"
-    img = _new_image(file, access=access)
-    if not options:
+    img = None
+    if not info:
+        img = _new_image(file, access=access)
+        info = source_info(img)
+    check_source(info, _file_size(file))
+    load_args = {}
+    if _animated_pages(info) > 1:
+        load_args["n"] = -1
+    if options and (shrink := load_shrink(info, options)) > 1:
+        # Only some loaders can shrink while decoding.
+        if info.format == "jpeg":
+            load_args["shrink"] = shrink
+        elif info.format == "webp":
+            load_args["scale"] = 1 / shrink
+    if img and not load_args:
         return img
-    x_scale = img.width / max(opt.source_x(img.width) for opt in options)
-    y_scale = img.height / max(opt.source_y(img.height) for opt in options)
+    return _new_image(file, access=access, **load_args)
+
+
+def load_shrink(info: SourceInfo, options: list[ParsedOptions]) -> int:
+    """
+    The factor (a power of two, up to 8) that a source can be shrunk by while it is
+    loaded, keeping it at least 3x the largest target size.
+    """
+    x_scale = info.width / max(opt.source_x(info.width) for opt in options)
+    y_scale = info.height / max(opt.source_y(info.height) for opt in options)
     min_scale = min(x_scale, y_scale) / 3  # At least 3x of the target size
     if min_scale < 2:
-        return img
-    shrink = min(2 ** (math.floor(math.log(min_scale, 2))), 8)
-    return _new_image(file, shrink=shrink, access=access)
+        return 1
+    return min(2 ** (math.floor(math.log(min_scale, 2))), 8)
+
+
+def _file_size(file: str | Path | File) -> int | None:
+    try:
+        if isinstance(file, File):
+            return file.size
+        return os.path.getsize(file)
+    except (OSError, AttributeError):
+        return None
 
 
 def _new_image(file: str | Path | File, access, **kwargs):
+    _start_vips()
     from pyvips import Image
 
     path = None
@@ -146,11 +366,51 @@ def _new_image(file: str | Path | File, access, **kwargs):
     return Image.new_from_file(path, access=access, **kwargs)
 
 
+def encoder_options(mimetype: str | None, profile: str | None = None) -> dict:
+    """
+    Get the libvips save options for a format, from the ``ENCODER`` setting overridden
+    by the options of the named encoder profile.
+    """
+    image_format = {v: k for k, v in format_map.items()}.get(mimetype or "", "jpeg")
+    options = dict(get_setting("ENCODER").get(image_format, {}))
+    if profile:
+        try:
+            profile_options = get_setting("PROFILES")[profile]
+        except KeyError:
+            raise ValueError(f"Unknown encoder profile {profile}")
+        options.update(profile_options.get(image_format, {}))
+    return options
+
+
+def placeholder(vips_image: Image, kind: str) -> str:
+    """
+    Build a tiny placeholder for an image.
+
+    :param kind: Either ``"lqip"`` for a ~32px WebP data URI, or ``"color"`` for the
+        average colour as a CSS hex colour
+    """
+    vips_image = first_page(vips_image)
+    if vips_image.interpretation != "srgb":
+        vips_image = vips_image.colourspace("srgb")
+    if vips_image.bands > 3:
+        vips_image = vips_image.extract_band(0, n=3)
+    if kind == "lqip":
+        small = vips_image.thumbnail_image(32)
+        buffer = small.write_to_buffer(".webp", Q=40, strip=True)
+        return f"data:image/webp;base64,{base64.b64encode(buffer).decode()}"
+    if kind == "color":
+        small = vips_image.thumbnail_image(8)
+        return "#" + "".join(f"{round(small[i].avg()):02x}" for i in range(3))
+    raise ValueError(f"Unknown placeholder kind {kind}")
+
+
 def vips_to_django(
-    vips_image: Image, name: str, quality: int = 80
+    vips_image: Image, name: str, quality: int = 80, **save_options
 ) -> TemporaryUploadedFile | InMemoryUploadedFile:
     """
     Convert a PyVips image to a Django file.
+
+    Any extra keyword arguments are passed to the libvips saver.
     """
     try:
         temp_file = TemporaryUploadedFile(
@@ -164,41 +424,245 @@ def vips_to_django(
         temp_file = None
     if temp_file:
         path = temp_file.temporary_file_path()
-        vips_image.write_to_file(path, Q=quality)
+        vips_image.write_to_file(path, Q=quality, **save_options)
         temp_file.size = os.path.getsize(path)  # type: ignore
         return temp_file
     # Since file couldn't be created, try to write directly to memory instead.
     vips_image = vips_image.copy_memory()
     extension = os.path.splitext(name)[1]
-    buffer = vips_image.write_to_buffer(extension, Q=quality)
+    buffer = vips_image.write_to_buffer(extension, Q=quality, **save_options)
+    return buffer_to_django(buffer, name)
+
+
+def buffer_to_django(buffer: bytes, name: str) -> InMemoryUploadedFile:
+    """
+    Convert an encoded image buffer to a Django file.
+    """
     return InMemoryUploadedFile(
         file=io.BytesIO(buffer),
         field_name=None,
         name=name,
-        content_type=guess_type(extension)[0],
+        content_type=guess_type(name)[0],
         size=len(buffer),
         charset=None,
     )
 
 
-if __name__ == "__main__":
-    import sys
+def search_quality(
+    vips_image: Image, extension: str, max_bytes: int, **save_options
+) -> tuple[int, bytes]:
+    """
+    Binary search for the highest encoder quality that fits within ``max_bytes``.
+
+    The search is limited to the ``AUTO_QUALITY_RANGE`` setting, using no more than
+    ``AUTO_QUALITY_TRIALS`` trial encodes. If no quality fits, the image is encoded
+    at the lowest quality.
+
+    Returns the chosen quality and the encoded image.
+    """
+    # Render the pixels once rather than for every trial encode.
+    vips_image = vips_image.copy_memory()
+    return fit_quality(
+        lambda quality: vips_image.write_to_buffer(
+            extension, Q=quality, **save_options
+        ),
+        max_bytes,
+    )
+
+
+def fit_quality(encode: Callable[[int], bytes], max_bytes: int) -> tuple[int, bytes]:
+    """
+    Binary search for the highest quality that ``encode`` fits within ``max_bytes``
+    (see ``search_quality``).
+    """
+    low, high = get_setting("AUTO_QUALITY_RANGE")
+    best: tuple[int, bytes] | None = None
+    lowest: tuple[int, bytes] | None = None
+    for _ in range(get_setting("AUTO_QUALITY_TRIALS")):
+        if low > high:
+            break
+        quality = (low + high) // 2
+        buffer = encode(quality)
+        if len(buffer) <= max_bytes:
+            best = (quality, buffer)
+            low = quality + 1
+        else:
+            if not lowest or quality < lowest[0]:
+                lowest = (quality, buffer)
+            high = quality - 1
+    if best:
+        return best
+    quality = get_setting("AUTO_QUALITY_RANGE")[0]
+    if lowest and lowest[0] == quality:
+        return lowest
+    return quality, encode(quality)
+
+
+class Engine(Protocol):
+    """
+    An image processing backend, selected with the ``ENGINE`` setting.
+
+    The images that an engine loads and returns are its own image objects.
+    """
+
+    # The name of the engine, used when reporting its settings.
+    name: str
+
+    @property
+    def decode_errors(self) -> tuple[type[Exception], ...]:
+        """
+        The exceptions raised when a file can't be read as an image.
+        """
+        ...
 
-    image = Image.new_from_file("example.jpg")
-    print(f"Original image size: {image.width}x{image.height}")
+    def configure(self, role: str | None = None, **overrides) -> dict:
+        """
+        Configure the engine for a process role (e.g. ``"build"``), returning its
+        effective settings.
+        """
+        ...
 
-    image = efficient_load("example.jpg", [ParsedOptions(width=100, ratio="video")])
-    print(f"Efficiently loaded image size: {image.width}x{image.height}")
+    def probe(self, file: str | Path | File) -> SourceInfo:
+        """
+        Read the details of a source image from its header.
+        """
+        ...
 
-    sys.exit()
+    def load(
+        self,
+        file: str | Path | File,
+        options: list[ParsedOptions] | ParsedOptions | None,
+        info: SourceInfo | None = None,
+    ) -> Any:
+        """
+        Load a source image, reducing it while decoding if the target sizes allow.
 
-    from PIL import Image as PILImage
+        Raises ``SourceTooLarge`` if the source is over the source limits.
+        """
+        ...
 
-    image = Image.new_from_file("example.jpg")
-    image = scale_image(image, (700, 500), focal_window=(0.2, 0, 0.8, 0.5))
+    def scale(
+        self,
+        img: Any,
+        target: tuple[int, int],
+        crop: tuple[float, float] | bool | None = None,
+        focal_window: tuple[float, float, float, float] | None = None,
+    ) -> Any:
+        """
+        Scale an image to cover the target size, optionally cropping it (see
+        ``scale_image``).
+        """
+        ...
 
-    buffer = image.write_to_buffer(".jpg[Q=90]")
+    def first_page(self, img: Any) -> Any:
+        """
+        Get just the first frame of an animated image.
+        """
+        ...
+
+    def size(self, img: Any) -> tuple[int, int]:
+        """
+        The width and (first frame) height of an image.
+        """
+        ...
+
+    def in_memory(self, img: Any) -> Any:
+        """
+        Render an image's pixels to memory, so they aren't computed more than once.
+        """
+        ...
+
+    def placeholder(self, img: Any, kind: str) -> str:
+        """
+        Build a tiny placeholder for an image (see ``placeholder``).
+        """
+        ...
+
+    def encode(self, img: Any, name: str, quality: int = 80, **save_options) -> File:
+        """
+        Encode an image to a Django file, in the format of the name's extension.
+        """
+        ...
+
+    def encode_to_fit(
+        self, img: Any, name: str, max_bytes: int, **save_options
+    ) -> tuple[int, File]:
+        """
+        Encode an image at the highest quality that fits within ``max_bytes`` (see
+        ``search_quality``), returning the quality and the Django file.
+        """
+        ...
+
+
+class VipsEngine:
+    """
+    The default engine, using libvips.
+    """
 
-    # Convert buffer to PIL image
-    pil_image = PILImage.open(io.BytesIO(buffer))
-    pil_image.show()
+    name = "libvips"
+
+    @property
+    def decode_errors(self) -> tuple[type[Exception], ...]:
+        import pyvips
+
+        return (pyvips.Error, OSError)
+
+    def configure(self, role: str | None = None, **overrides) -> dict:
+        return apply_vips_settings(role, **overrides)
+
+    def probe(self, file: str | Path | File) -> SourceInfo:
+        return probe(file)
+
+    def load(
+        self,
+        file: str | Path | File,
+        options: list[ParsedOptions] | ParsedOptions | None,
+        info: SourceInfo | None = None,
+    ) -> Image:
+        return efficient_load(file, options, info=info)
+
+    def scale(
+        self,
+        img: Image,
+        target: tuple[int, int],
+        crop: tuple[float, float] | bool | None = None,
+        focal_window: tuple[float, float, float, float] | None = None,
+    ) -> Image:
+        return scale_image(img, target, crop=crop, focal_window=focal_window)
+
+    def first_page(self, img: Image) -> Image:
+        return first_page(img)
+
+    def size(self, img: Image) -> tuple[int, int]:
+        return img.width, page_height(img)
+
+    def in_memory(self, img: Image) -> Image:
+        return img.copy_memory()
+
+    def placeholder(self, img: Image, kind: str) -> str:
+        return placeholder(img, kind)
+
+    def encode(self, img: Image, name: str, quality: int = 80, **save_options) -> File:
+        return vips_to_django(img, name, quality=quality, **save_options)
+
+    def encode_to_fit(
+        self, img: Image, name: str, max_bytes: int, **save_options
+    ) -> tuple[int, File]:
+        extension = os.path.splitext(name)[1]
+        quality, buffer = search_quality(img, extension, max_bytes, **save_options)
+        return quality, buffer_to_django(buffer, name)
+
+
+# The engine instances by import path.
+_engines: dict[str, Engine] = {}
+
+
+def get_engine() -> Engine:
+    """
+    Get the engine selected by the ``ENGINE`` setting (the import path of an
+    ``Engine`` class).
+    """
+    path = get_setting("ENGINE")
+    if path not in _engines:
+        _engines[path] = import_string(path)()
+    return _engines[path]
@@ -0,0 +1,257 @@
+"""
+The output geometry of scaling and cropping an image, without touching any pixels.
+
+``scale_geometry`` is what ``engine.scale_image`` (and the other engines) use to
+scale an image, so it can also be used to plan builds cheaply. For planning many
+sources at once, ``scale_geometry_batch`` does the same with NumPy arrays.
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, NamedTuple
+
+if TYPE_CHECKING:
+    import numpy as np
+
+
+class ScaleGeometry(NamedTuple):
+    """
+    How an image is scaled to cover a target size.
+
+    Boxes are ``(left, top, width, height)``.
+    """
+
+    # The area of the source used (cropped to the focal window, or the whole source).
+    window: tuple[int, int, int, int]
+    # The resize factor of the window (over 1 means upscaling).
+    scale: float
+    # The size of the window once resized.
+    resized: tuple[int, int]
+    # The area of the resized window kept (cropped, or the whole of it).
+    box: tuple[int, int, int, int]
+
+    @property
+    def size(self) -> tuple[int, int]:
+        """
+        The size of the scaled image.
+        """
+        return self.box[2], self.box[3]
+
+
+def scale_geometry(
+    source: tuple[int, int],
+    target: tuple[int, int],
+    /,
+    crop: tuple[float, float] | bool | None = None,
+    focal_window: tuple[float, float, float, float] | None = None,
+) -> ScaleGeometry:
+    """
+    Work out how to scale a source of a size (the height of a single page for
+    multi-page images) to cover the target size, optionally cropping it around a
+    focal point or a focal window.
+    """
+    w, h = source
+    window = (0, 0, w, h)
+
+    # Size image down to cover the dimensions
+    scale = max(target[0] / w, target[1] / h)
+
+    # Focal window scaling
+    if focal_window:
+        f_left = focal_window[0] * w
+        f_right = focal_window[2] * w
+        f_top = focal_window[1] * h
+        f_bottom = focal_window[3] * h
+        # If the focal window is larger than the target, crop the image to the focal
+        # window and scale it down to the target size.
+        if f_right - f_left > target[0] and f_bottom - f_top > target[1]:
+            window = (
+                int(f_left),
+                int(f_top),
+                int(f_right - f_left),
+                int(f_bottom - f_top),
+            )
+            scale = max(target[0] / window[2], target[1] / window[3])
+            focal_window = None
+        # Otherwise, if cropping then set the crop focal point to the center of the
+        # focal window.
+        elif crop is True:
+            crop = (
+                (f_left + f_right) / 2,
+                (f_top + f_bottom) / 2,
+            )
+
+    resized = (round_half_up(window[2] * scale), round_half_up(window[3] * scale))
+    w, h = resized
+
+    if not crop:
+        return ScaleGeometry(window, scale, resized, (0, 0, w, h))
+
+    if crop is True:
+        crop = (0.5, 0.5)
+
+    # Calculate the coordinates of the cropping box
+    if focal_window:
+        focal_point = (
+            int(focal_window[0] + crop[0] * (focal_window[2] - focal_window[0]) / 2),
+            int(focal_window[1] + crop[1] * (focal_window[3] - focal_window[1]) / 2),
+        )
+    else:
+        focal_point = (
+            int(crop[0] * w),
+            int(crop[1] * h),
+        )
+    left = focal_point[0] - target[0] // 2
+    top = focal_point[1] - target[1] // 2
+    right = left + target[0]
+    bottom = top + target[1]
+
+    # Make sure the cropping box is within the image, otherwise move it.
+    if left < 0:
+        right -= left
+        left = 0
+    elif right > w:
+        left -= right - w
+        right = w
+    if top < 0:
+        bottom -= top
+        top = 0
+    elif bottom > h:
+        top -= bottom - h
+        bottom = h
+    return ScaleGeometry(
+        window, scale, resized, (left, top, right - left, bottom - top)
+    )
+
+
+class ScaleGeometryBatch(NamedTuple):
+    """
+    The ``ScaleGeometry`` of many sources, as NumPy arrays with a row per source.
+    """
+
+    window: np.ndarray
+    scale: np.ndarray
+    resized: np.ndarray
+    box: np.ndarray
+
+
+def scale_geometry_batch(
+    sources: np.ndarray,
+    targets: np.ndarray,
+    crops: np.ndarray | None = None,
+    focal_windows: np.ndarray | None = None,
+) -> ScaleGeometryBatch:
+    """
+    The same as ``scale_geometry``, for arrays of sources and options (requires
+    NumPy).
+
+    :param sources: The ``(width, height)`` of each source, shape ``(n, 2)``
+    :param targets: The ``(width, height)`` of each target, shape ``(n, 2)``
+    :param crops: The crop focal point of each source as fractions (like
+        ``ParsedOptions.crop``), shape ``(n, 2)``. Rows of NaN aren't cropped.
+    :param focal_windows: The focal window of each source, shape ``(n, 4)``. Rows of
+        NaN don't have one.
+    """
+    import numpy as np
+
+    sources = np.asarray(sources, dtype=np.int64)
+    targets = np.asarray(targets, dtype=np.int64)
+    n = len(sources)
+    if crops is None:
+        crops = np.full((n, 2), np.nan)
+    if focal_windows is None:
+        focal_windows = np.full((n, 4), np.nan)
+    crops = np.asarray(crops, dtype=np.float64)
+    focal_windows = np.asarray(focal_windows, dtype=np.float64)
+
+    w, h = sources[:, 0], sources[:, 1]
+    tw, th = targets[:, 0], targets[:, 1]
+    scale = np.maximum(tw / w, th / h)
+
+    has_window = ~np.isnan(focal_windows).any(axis=1)
+    f_left = focal_windows[:, 0] * w
+    f_right = focal_windows[:, 2] * w
+    f_top = focal_windows[:, 1] * h
+    f_bottom = focal_windows[:, 3] * h
+    with np.errstate(invalid="ignore"):
+        to_window = has_window & (f_right - f_left > tw) & (f_bottom - f_top > th)
+    window = np.stack(
+        [
+            np.where(to_window, _trunc(f_left), 0),
+            np.where(to_window, _trunc(f_top), 0),
+            np.where(to_window, _trunc(f_right - f_left), w),
+            np.where(to_window, _trunc(f_bottom - f_top), h),
+        ],
+        axis=1,
+    )
+    scale = np.where(to_window, np.maximum(tw / window[:, 2], th / window[:, 3]), scale)
+    resized = np.stack(
+        [
+            np.maximum(np.floor(window[:, 2] * scale + 0.5), 1).astype(np.int64),
+            np.maximum(np.floor(window[:, 3] * scale + 0.5), 1).astype(np.int64),
+        ],
+        axis=1,
+    )
+    rw, rh = resized[:, 0], resized[:, 1]
+
+    cropped = ~np.isnan(crops).any(axis=1)
+    in_window = has_window & ~to_window
+    focal_x = np.where(
+        in_window,
+        _trunc(
+            focal_windows[:, 0]
+            + crops[:, 0] * (focal_windows[:, 2] - focal_windows[:, 0]) / 2
+        ),
+        _trunc(crops[:, 0] * rw),
+    )
+    focal_y = np.where(
+        in_window,
+        _trunc(
+            focal_windows[:, 1]
+            + crops[:, 1] * (focal_windows[:, 3] - focal_windows[:, 1]) / 2
+        ),
+        _trunc(crops[:, 1] * rh),
+    )
+    left, right = _fit(focal_x - tw // 2, tw, rw)
+    top, bottom = _fit(focal_y - th // 2, th, rh)
+    box = np.stack(
+        [
+            np.where(cropped, left, 0),
+            np.where(cropped, top, 0),
+            np.where(cropped, right - left, rw),
+            np.where(cropped, bottom - top, rh),
+        ],
+        axis=1,
+    )
+    return ScaleGeometryBatch(window, scale, resized, box)
+
+
+def round_half_up(n: float) -> int:
+    """
+    Round a resized dimension the same way as libvips (halves up, and at least 1).
+    """
+    return max(1, int(n + 0.5))
+
+
+def _trunc(values: np.ndarray) -> np.ndarray:
+    # The same as int() (NaN becomes 0, for rows that don't use the value).
+    import numpy as np
+
+    return np.nan_to_num(np.trunc(values)).astype(np.int64)
+
+
+def _fit(start: np.ndarray, length: np.ndarray, limit: np.ndarray):
+    """
+    Move ranges within ``0`` and ``limit`` the same way as ``scale_geometry``,
+    returning the starts and ends.
+    """
+    import numpy as np
+
+    end = start + length
+    before = start < 0
+    end = np.where(before, end - start, end)
+    start = np.where(before, 0, start)
+    after = ~before & (end > limit)
+    start = np.where(after, start - (end - limit), start)
+    end = np.where(after, limit, end)
+    return start, end
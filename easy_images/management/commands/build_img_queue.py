@@ -1,8 +1,13 @@
+import logging
+
 from django.core.management.base import BaseCommand
-from django.db.models import Count, Q
 
+from easy_images import engine
 from easy_images.management.process_queue import process_queue
-from easy_images.models import EasyImage, ImageStatus
+from easy_images.models import EasyImage
+from easy_images.stats import BuildStats
+
+logger = logging.getLogger("easy_images")
 
 
 class Command(BaseCommand):
@@ -17,6 +22,27 @@ class Command(BaseCommand):
             type=int,
             help="Retry builds with errors with no more than this many failures",
         )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="The number of images to claim from the queue at a time",
+        )
+        parser.add_argument(
+            "--approximate-count",
+            action="store_true",
+            help="Estimate the queue size for the progress bar (PostgreSQL only)",
+        )
+        parser.add_argument(
+            "--vips-cache-max-mem",
+            type=int,
+            help="Limit the memory of the libvips operation cache (in bytes)",
+        )
+        parser.add_argument(
+            "--vips-concurrency",
+            type=int,
+            help="The number of libvips worker threads to use for each image",
+        )
         parser.add_argument(
             "--count-only",
             action="store_true",
@@ -27,13 +53,9 @@ class Command(BaseCommand):
 
     def handle(self, *, verbosity, retry=None, force=None, count_only=False, **options):
         if count_only:
-            count = EasyImage.objects.filter(image="").count()
+            counts = EasyImage.objects.queue_counts()
+            count = counts.pop("total")
             self.stdout.write(f"{count} <img> thumbnails need building")
-            counts = EasyImage.objects.filter(image="").aggregate(
-                building=Count("pk", filter=Q(status=ImageStatus.BUILDING)),
-                source_errors=Count("pk", filter=Q(status=ImageStatus.SOURCE_ERROR)),
-                build_errors=Count("pk", filter=Q(status=ImageStatus.BUILD_ERROR)),
-            )
             if any(counts.values()):
                 self.stdout.write("of which:")
                 if counts["building"]:
@@ -44,41 +66,39 @@ class Command(BaseCommand):
                     self.stdout.write(f"  {counts['source_errors']} had source errors")
                 if counts["build_errors"]:
                     self.stdout.write(f"  {counts['build_errors']} had build errors")
+                if counts["too_large"]:
+                    self.stdout.write(f"  {counts['too_large']} had sources too large")
             return
+        image_engine = engine.get_engine()
+        engine_settings = image_engine.configure(
+            "build",
+            cache_max_mem=options.get("vips_cache_max_mem"),
+            concurrency=options.get("vips_concurrency"),
+        )
+        logger.info("%s settings: %s", image_engine.name, engine_settings)
+        if verbosity > 1 and engine_settings:
+            self.stdout.write(
+                f"{image_engine.name} settings: "
+                + ", ".join(f"{k}={v}" for k, v in engine_settings.items())
+            )
         if verbosity:
             self.stdout.write("Building queued <img> thumbnails...")
         if not force and verbosity:
-            counts = EasyImage.objects.filter(image="").aggregate(
-                building=Count("pk", filter=Q(status=ImageStatus.BUILDING)),
-                source_errors=Count("pk", filter=Q(status=ImageStatus.SOURCE_ERROR)),
-                build_errors=Count("pk", filter=Q(status=ImageStatus.BUILD_ERROR)),
-            )
-            if retry:
-                if retry:
-                    retry_counts = EasyImage.objects.filter(
-                        image="", error_count__lte=retry
-                    ).aggregate(
-                        source_errors=Count(
-                            "pk", filter=Q(status=ImageStatus.SOURCE_ERROR)
-                        ),
-                        build_errors=Count(
-                            "pk", filter=Q(status=ImageStatus.BUILD_ERROR)
-                        ),
-                    )
+            counts = EasyImage.objects.queue_counts(retry=retry)
             if counts["building"]:
                 self.stdout.write(
                     f"Skipping {counts['building']} marked as already building..."
                 )
             if counts["source_errors"]:
                 if retry:
-                    skip = counts["source_errors"] - retry_counts["source_errors"]
+                    skip = counts["source_errors"] - counts["retry_source_errors"]
                     if skip:
                         self.stdout.write(
-                            f"Retrying {retry_counts['source_errors']} with source errors ({skip} with more than {retry} retries skipped)..."
+                            f"Retrying {counts['retry_source_errors']} with source errors ({skip} with more than {retry} retries skipped)..."
                         )
                     else:
                         self.stdout.write(
-                            f"Retrying {retry_counts['source_errors']} with source errors..."
+                            f"Retrying {counts['retry_source_errors']} with source errors..."
                         )
                 else:
                     self.stdout.write(
@@ -86,22 +106,33 @@ class Command(BaseCommand):
                     )
             if counts["build_errors"]:
                 if retry:
-                    skip = counts["build_errors"] - retry_counts["build_errors"]
+                    skip = counts["build_errors"] - counts["retry_build_errors"]
                     if skip:
                         self.stdout.write(
-                            f"Retrying {retry_counts['build_errors']} with build errors ({skip} with more than {retry} retries skipped)..."
+                            f"Retrying {counts['retry_build_errors']} with build errors ({skip} with more than {retry} retries skipped)..."
                         )
                     else:
                         self.stdout.write(
-                            f"Retrying {retry_counts['build_errors']} with build errors..."
+                            f"Retrying {counts['retry_build_errors']} with build errors..."
                         )
                 else:
                     self.stdout.write(
                         f"Skipping {counts['build_errors']} with build errors..."
                     )
+            if counts["too_large"]:
+                self.stdout.write(
+                    f"Skipping {counts['too_large']} with sources too large..."
+                )
         if verbosity:
             self.stdout.flush()
-        built = process_queue(force=bool(force), retry=retry)
+        stats = BuildStats()
+        built = process_queue(
+            force=bool(force),
+            retry=retry,
+            stats=stats,
+            batch_size=options.get("batch_size") or 100,
+            approximate_count=options.get("approximate_count", False),
+        )
         if not built:
             if verbosity:
                 self.stdout.write("No <img> thumbnails required building")
@@ -112,3 +143,6 @@ class Command(BaseCommand):
                 f" thumbnail{'' if built == 1 else 's'}"
             )
         )
+        if verbosity and stats.count:
+            for line in stats.summary():
+                self.stdout.write(line)
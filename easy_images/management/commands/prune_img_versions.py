@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand
+
+from easy_images.management.prune import (
+    DirectoryListings,
+    archive_built,
+    prune_errors,
+    prune_missing_sources,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete EasyImage versions of source files that no longer exist, and"
+        " optionally old errors and archive old versions"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--errors",
+            type=int,
+            metavar="DAYS",
+            help=(
+                "Also delete versions that failed to build more than this many days ago"
+            ),
+        )
+        parser.add_argument(
+            "--archive",
+            type=int,
+            metavar="DAYS",
+            help=(
+                "Move versions not used (or built) for more than this many days to the"
+                " archive table (they are restored when next requested)"
+            ),
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="The number of versions to delete or archive at a time",
+        )
+
+    def handle(
+        self, *, verbosity, errors=None, archive=None, batch_size=500, **options
+    ):
+        listings = DirectoryListings()
+        deleted = prune_missing_sources(batch_size=batch_size, listings=listings)
+        if verbosity:
+            self.stdout.write(f"Deleted {deleted} <img> versions of missing sources")
+        for storage_name, directory in sorted(listings.unlisted):
+            self.stderr.write(
+                f"Skipped {directory or '.'} in the {storage_name} storage,"
+                " which couldn't be listed"
+            )
+        if errors is not None:
+            deleted = prune_errors(errors, batch_size=batch_size)
+            if verbosity:
+                self.stdout.write(f"Deleted {deleted} <img> versions with errors")
+        if archive is not None:
+            archived = archive_built(archive, batch_size=batch_size)
+            if verbosity:
+                self.stdout.write(f"Archived {archived} <img> versions")
@@ -0,0 +1,47 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from easy_images.management.prune import sweep_orphans
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete built <img> files that no EasyImage uses. Local storages are listed a"
+        " batch at a time, but Django's storage API can only list other storages in"
+        " full, so their whole listing is held in memory."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--min-age",
+            type=float,
+            default=24,
+            metavar="HOURS",
+            help="Only delete files older than this many hours (default 24)",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="The number of files to check against the database at a time",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="List the orphaned files without deleting them",
+        )
+
+    def handle(
+        self, *, verbosity, min_age=24, batch_size=1000, dry_run=False, **options
+    ):
+        count = 0
+        for name in sweep_orphans(
+            min_age=timedelta(hours=min_age), batch_size=batch_size, dry_run=dry_run
+        ):
+            count += 1
+            if verbosity > 1 or dry_run:
+                self.stdout.write(name)
+        if verbosity:
+            action = "Found" if dry_run else "Deleted"
+            self.stdout.write(f"{action} {count} orphaned <img> files")
@@ -1,31 +1,162 @@
-from django.db.models import Q
+from __future__ import annotations
+
+import json
+from datetime import datetime
+from functools import reduce
+from operator import or_
+from uuid import UUID
+
+from django.db import connection, transaction
+from django.db.models import Q, QuerySet
+from django.utils import timezone
 from tqdm import tqdm
 
 from easy_images.models import EasyImage, ImageStatus
+from easy_images.signals import image_build_finished
+from easy_images.stats import BuildStats
 
 
-def process_queue(force=False, retry: int | None = None):
+def process_queue(
+    force=False,
+    retry: int | None = None,
+    stats: BuildStats | None = None,
+    batch_size: int = 100,
+    approximate_count=False,
+):
     """
     Process the image queue, building images that need building.
 
+    The queue is worked through in batches, in the order the images were created.
+    Each batch is claimed (marked as building) in a short transaction so other
+    workers skip it, rather than holding a cursor open for the whole queue. If
+    processing stops part way through a batch, the rest of it is queued again.
+
     :param bool force: Force building images, even those that are marked as already building
         or that had errors
     :param int retry: Also retry images with errors with no more than this many failures
+    :param BuildStats stats: Aggregate the timings of each build into this object
+    :param int batch_size: The number of images to claim at a time
+    :param bool approximate_count: Use the database's estimate of the queue size
+        for the progress bar rather than counting it (only PostgreSQL can estimate)
     """
-    easy_images = EasyImage.objects.filter(image="")
-    if not force:
-        queued = Q(status=ImageStatus.QUEUED)
-        if retry:
-            retry_errors = Q(
-                error_count__lte=retry,
-                status__in=[ImageStatus.SOURCE_ERROR, ImageStatus.BUILD_ERROR],
-            )
-            easy_images = easy_images.filter(queued | retry_errors)
-        else:
-            easy_images = easy_images.filter(queued)
+    easy_images = EasyImage.objects.queue(force=force, retry=retry)
+    total = estimate_count(easy_images) if approximate_count else easy_images.count()
+    queues = EasyImage.objects.queue_by_status(force=force, retry=retry)
 
+    if stats:
+        image_build_finished.connect(stats.record)
     built = 0
-    for easy_image in tqdm(easy_images.iterator(), total=easy_images.count()):
-        if easy_image.build(force=force):
-            built += 1
+    last = None
+    unbuilt: list[EasyImage] = []
+    try:
+        with tqdm(total=total) as progress:
+            while True:
+                batch, last = claim_batch(queues, after=last, size=batch_size)
+                if not last:
+                    break
+                unbuilt = list(reversed(batch))
+                while unbuilt:
+                    # The batch is already claimed, so force the build (unless
+                    # another worker took the image over while it waited its turn).
+                    if renew_claim(unbuilt[-1]) and unbuilt[-1].build(force=True):
+                        built += 1
+                    unbuilt.pop()
+                    progress.update()
+    finally:
+        if stats:
+            image_build_finished.disconnect(stats.record)
+        if unbuilt:
+            # Release the rest of the claimed batch, so it isn't left marked as
+            # building if the worker is stopped.
+            release(unbuilt)
     return built
+
+
+def claim_batch(
+    queues: list[QuerySet[EasyImage]],
+    after: tuple[datetime, UUID] | None = None,
+    size: int = 100,
+) -> tuple[list[EasyImage], tuple[datetime, UUID] | None]:
+    """
+    Claim the next batch of images from the queue by marking them as building.
+
+    The queue (as a queryset for each status, see
+    ``EasyImage.objects.queue_by_status()``) is ordered by ``(created, id)``,
+    continuing after the ``after`` key. Each status is read separately so its rows
+    are found through the queue index in order rather than by sorting the queue.
+    Images claimed by another worker in the meantime are left out of the batch.
+
+    Returns the claimed images and the key to continue from (``None`` once the end
+    of the queue is reached).
+    """
+    if after:
+        created, pk = after
+        queues = [
+            queue.filter(created__gte=created).exclude(created=created, id__lte=pk)
+            for queue in queues
+        ]
+    with transaction.atomic():
+        keys: list[tuple[datetime, UUID]] = []
+        for queue in queues:
+            candidates = queue.order_by("created", "id")
+            if connection.features.has_select_for_update_skip_locked:
+                candidates = candidates.select_for_update(skip_locked=True)
+            keys.extend(candidates.values_list("created", "pk")[:size])
+        if not keys:
+            return [], None
+        keys = sorted(keys)[:size]
+        pks = [pk for _, pk in keys]
+        # The claim time identifies the rows claimed by this worker.
+        now = timezone.now()
+        reduce(or_, queues).filter(pk__in=pks).update(
+            status=ImageStatus.BUILDING, status_changed_date=now
+        )
+    claimed = EasyImage.objects.filter(
+        pk__in=pks, status=ImageStatus.BUILDING, status_changed_date=now
+    ).order_by("created", "id")
+    return list(claimed), keys[-1]
+
+
+def renew_claim(image: EasyImage) -> bool:
+    """
+    Mark a claimed image as building from now, just before it's built, so it isn't
+    treated as abandoned while it waits for the rest of its batch.
+
+    Returns whether the image was still claimed by this worker, since an image that
+    waited longer than the ``BUILD_TIMEOUT`` setting may have been taken over.
+    """
+    now = timezone.now()
+    renewed = EasyImage.objects.filter(
+        pk=image.pk,
+        status=ImageStatus.BUILDING,
+        status_changed_date=image.status_changed_date,
+    ).update(status_changed_date=now)
+    if not renewed:
+        return False
+    image.status_changed_date = now
+    return True
+
+
+def release(images: list[EasyImage]):
+    """
+    Queue claimed images again, unless they have since been built or taken over by
+    another worker (which marks them as building at a different time).
+    """
+    claims = [
+        Q(pk=image.pk, status_changed_date=image.status_changed_date)
+        for image in images
+    ]
+    EasyImage.objects.filter(
+        reduce(or_, claims), image="", status=ImageStatus.BUILDING
+    ).update(status=ImageStatus.QUEUED, status_changed_date=timezone.now())
+
+
+def estimate_count(queryset: QuerySet) -> int:
+    """
+    Estimate the number of rows of a queryset from the query planner on PostgreSQL,
+    otherwise count them.
+    """
+    if connection.vendor != "postgresql":
+        return queryset.count()
+    plan = json.loads(queryset.explain(format="json"))
+    return int(plan[0]["Plan"]["Plan Rows"])
@@ -0,0 +1,310 @@
+from __future__ import annotations
+
+import os
+import posixpath
+from collections import OrderedDict
+from datetime import timedelta
+from itertools import islice
+from typing import Iterator
+
+from django.core.files.storage import (
+    Storage,
+    storages,  # type: ignore (storages isn't in the stubs)
+)
+from django.core.files.storage.handler import InvalidStorageError
+from django.db import transaction
+from django.db.models import Q, QuerySet
+from django.utils import timezone
+
+from easy_images.models import (
+    ArchivedImage,
+    EasyImage,
+    ImageStatus,
+    SourceImage,
+    pick_image_storage,
+)
+
+
+class DirectoryListings:
+    """
+    Check whether files exist using one ``storage.listdir()`` per directory rather
+    than one ``storage.exists()`` per file.
+
+    Only the most recent ``maxsize`` directory listings are kept. Directories that
+    can't be listed (other than ones that don't exist) are recorded in ``unlisted``
+    and their files are treated as existing.
+    """
+
+    def __init__(self, maxsize: int = 100):
+        self.maxsize = maxsize
+        self.listings: OrderedDict[tuple[str, str], set[str] | None] = OrderedDict()
+        self.unlisted: set[tuple[str, str]] = set()
+
+    def exists(self, storage_name: str, name: str) -> bool:
+        directory, filename = posixpath.split(name)
+        key = (storage_name, directory)
+        if key in self.listings:
+            self.listings.move_to_end(key)
+            files = self.listings[key]
+        else:
+            files = self.listings[key] = self.list(storage_name, directory)
+            if files is None:
+                self.unlisted.add(key)
+            if len(self.listings) > self.maxsize:
+                self.listings.popitem(last=False)
+        return files is None or filename in files
+
+    @staticmethod
+    def list(storage_name: str, directory: str) -> set[str] | None:
+        """
+        List the files in a directory, or return ``None`` if it can't be listed.
+        """
+        try:
+            storage: Storage = storages[storage_name]
+            return set(storage.listdir(directory)[1])
+        except FileNotFoundError:
+            return set()
+        except (InvalidStorageError, OSError):
+            return None
+
+
+def missing_sources(
+    model=EasyImage,
+    listings: DirectoryListings | None = None,
+    batch_size: int = 500,
+) -> Iterator[tuple[str, str]]:
+    """
+    Find the ``(storage, name)`` of each source file that versions exist for but that
+    is no longer in its storage.
+
+    Sources are read a page at a time (rather than streamed) so that they can be
+    deleted while iterating.
+    """
+    if listings is None:
+        listings = DirectoryListings()
+    sources = (
+        model.objects.values_list("storage", "name").order_by("storage", "name")
+    ).distinct()
+    page = list(sources[:batch_size])
+    while page:
+        for storage_name, name in page:
+            if not listings.exists(storage_name, name):
+                yield storage_name, name
+        last_storage, last_name = page[-1]
+        page = list(
+            sources.filter(
+                Q(storage__gt=last_storage)
+                | Q(storage=last_storage, name__gt=last_name)
+            )[:batch_size]
+        )
+
+
+def prune_missing_sources(
+    batch_size: int = 500, listings: DirectoryListings | None = None
+) -> int:
+    """
+    Delete the versions (and archived versions) of source files that no longer exist,
+    along with their recorded source details.
+
+    Directories that can't be listed are skipped (pass ``listings`` to find out which
+    ones).
+
+    Returns the number of versions deleted.
+    """
+    if listings is None:
+        listings = DirectoryListings()
+    deleted = 0
+    batch: list[tuple[str, str]] = []
+    for storage_name, name in missing_sources(SourceImage, listings, batch_size):
+        batch.append((storage_name, name))
+        if len(batch) >= batch_size:
+            _delete_source_images(batch)
+            batch = []
+    if batch:
+        _delete_source_images(batch)
+    for model in (EasyImage, ArchivedImage):
+        batch = []
+        for source in missing_sources(model, listings, batch_size):
+            batch.append(source)
+            if len(batch) >= batch_size:
+                deleted += _delete_sources(model, batch, batch_size)
+                batch = []
+        if batch:
+            deleted += _delete_sources(model, batch, batch_size)
+    return deleted
+
+
+def _delete_sources(model, sources: list[tuple[str, str]], batch_size: int) -> int:
+    deleted = 0
+    for storage_name, name in sources:
+        deleted += delete_versions(
+            model.objects.filter(storage=storage_name, name=name), batch_size
+        )
+    return deleted
+
+
+def _delete_source_images(sources: list[tuple[str, str]]):
+    SourceImage.objects.filter(
+        pk__in=[
+            SourceImage.objects.key(name=name, storage=storage_name)
+            for storage_name, name in sources
+        ]
+    ).delete()
+
+
+def prune_errors(days: int, batch_size: int = 500) -> int:
+    """
+    Delete unbuilt versions that failed to build more than ``days`` days ago.
+
+    Returns the number of versions deleted.
+    """
+    errors = EasyImage.objects.filter(
+        image="",
+        status__in=[
+            ImageStatus.SOURCE_ERROR,
+            ImageStatus.BUILD_ERROR,
+            ImageStatus.SOURCE_TOO_LARGE,
+        ],
+        status_changed_date__lt=timezone.now() - timedelta(days=days),
+    )
+    return delete_versions(errors, batch_size)
+
+
+def delete_versions(queryset: QuerySet, batch_size: int = 500) -> int:
+    """
+    Delete versions (or archived versions) in batches, along with their built image
+    files unless another version shares them.
+
+    Returns the number of versions deleted.
+    """
+    storage = pick_image_storage()
+    model = queryset.model
+    deleted = 0
+    while pks := list(queryset.values_list("pk", flat=True)[:batch_size]):
+        batch = model.objects.filter(pk__in=pks)
+        images = set(batch.exclude(image="").values_list("image", flat=True))
+        batch.delete()
+        shared = set(
+            EasyImage.objects.filter(image__in=images).values_list("image", flat=True)
+        ) | set(
+            ArchivedImage.objects.filter(image__in=images).values_list(
+                "image", flat=True
+            )
+        )
+        for name in images - shared:
+            storage.delete(name)
+        deleted += len(pks)
+    return deleted
+
+
+def archive_built(days: int, batch_size: int = 500) -> int:
+    """
+    Move versions that haven't been used (or built, if they were never used) for more
+    than ``days`` days to the ``ArchivedImage`` table.
+
+    Returns the number of versions archived.
+    """
+    cutoff = timezone.now() - timedelta(days=days)
+    built = (
+        EasyImage.objects.filter(
+            Q(last_used__lt=cutoff) | Q(last_used=None, status_changed_date__lt=cutoff),
+            status=ImageStatus.BUILT,
+        )
+        .exclude(image="")
+        .order_by("pk")
+    )
+    fields = [
+        "storage",
+        "name",
+        "image",
+        "width",
+        "height",
+        "content_hash",
+        "image_url",
+        "quality",
+        "placeholder",
+    ]
+    archived = 0
+    while rows := list(built.values("pk", *fields)[:batch_size]):
+        with transaction.atomic():
+            ArchivedImage.objects.bulk_create(
+                [
+                    ArchivedImage(
+                        id=row["pk"], **{field: row[field] for field in fields}
+                    )
+                    for row in rows
+                ],
+                ignore_conflicts=True,
+            )
+            EasyImage.objects.filter(pk__in=[row["pk"] for row in rows]).delete()
+        archived += len(rows)
+    return archived
+
+
+def sweep_orphans(
+    min_age: timedelta = timedelta(hours=24),
+    batch_size: int = 1000,
+    dry_run=False,
+) -> Iterator[str]:
+    """
+    Delete built image files that no version (or archived version) uses.
+
+    The files of the thumbnail directory are checked against the database in
+    batches as they are listed (see ``iter_filenames()``). Files newer than
+    ``min_age`` are left alone, since their version may not be saved yet.
+
+    Yields the name of each orphaned file as it is deleted, rather than collecting
+    them.
+    """
+    storage = pick_image_storage()
+    directory = EasyImage._meta.get_field("image").upload_to
+    cutoff = timezone.now() - min_age
+    filenames = iter_filenames(storage, directory)
+    while batch := list(islice(filenames, batch_size)):
+        names = {posixpath.join(directory, filename) for filename in batch}
+        used = set(
+            EasyImage.objects.filter(image__in=names).values_list("image", flat=True)
+        ) | set(
+            ArchivedImage.objects.filter(image__in=names).values_list(
+                "image", flat=True
+            )
+        )
+        for name in sorted(names - used):
+            if min_age and _modified_time(storage, name) > cutoff:
+                continue
+            if not dry_run:
+                storage.delete(name)
+            yield name
+
+
+def iter_filenames(storage: Storage, directory: str) -> Iterator[str]:
+    """
+    Iterate over the names of the files in a storage directory (yielding nothing if
+    it doesn't exist).
+
+    Local storages are read a directory entry at a time. Django's storage API has no
+    way to page through other storages, so their whole listing is read first.
+    """
+    try:
+        path = storage.path(directory)
+    except NotImplementedError:
+        try:
+            yield from storage.listdir(directory)[1]
+        except FileNotFoundError:
+            pass
+        return
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    yield entry.name
+    except FileNotFoundError:
+        pass
+
+
+def _modified_time(storage: Storage, name: str):
+    try:
+        return storage.get_modified_time(name)
+    except (NotImplementedError, OSError):
+        # Without a modified time, treat the file as new so it's never deleted.
+        return timezone.now()
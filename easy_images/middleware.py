@@ -0,0 +1,30 @@
+import logging
+
+from django.conf import settings
+
+from easy_images.stats import track_renders
+
+logger = logging.getLogger("easy_images")
+
+
+class RenderStatsMiddleware:
+    """
+    Count the work done rendering ``<img>`` elements for each request.
+
+    The counts are logged to the ``easy_images`` logger (at debug level) and, when
+    ``DEBUG`` is on, added to the response as an ``X-Easy-Images`` header.
+    """
+
+    header = "X-Easy-Images"
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with track_renders() as stats:
+            response = self.get_response(request)
+        if stats.bound_imgs:
+            logger.debug("%s %s: %s", request.method, request.path, stats)
+            if settings.DEBUG:
+                response[self.header] = str(stats)
+        return response
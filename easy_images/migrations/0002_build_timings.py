@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("easy_images", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="easyimage",
+            name="build_timings",
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("easy_images", "0002_build_timings"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="easyimage",
+            name="content_hash",
+            field=models.UUIDField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="easyimage",
+            index=models.Index(
+                fields=["content_hash"], name="easy_images_content_hash"
+            ),
+        ),
+    ]
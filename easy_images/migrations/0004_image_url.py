@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("easy_images", "0003_content_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="easyimage",
+            name="image_url",
+            field=models.CharField(blank=True, max_length=2048),
+        ),
+    ]
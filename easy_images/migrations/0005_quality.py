@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("easy_images", "0004_image_url"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="easyimage",
+            name="quality",
+            field=models.PositiveSmallIntegerField(null=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("easy_images", "0006_placeholder"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="easyimage",
+            index=models.Index(
+                condition=models.Q(("image", "")),
+                fields=["status", "error_count", "created"],
+                name="easy_images_queue",
+            ),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("easy_images", "0007_queue_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArchivedImage",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(editable=False, primary_key=True, serialize=False),
+                ),
+                ("storage", models.CharField(max_length=512)),
+                ("name", models.CharField(max_length=512)),
+                ("image", models.CharField(max_length=100)),
+                ("width", models.IntegerField(null=True)),
+                ("height", models.IntegerField(null=True)),
+                ("archived", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["storage", "name"], name="easy_images_archived_source"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,108 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:24
+
+import json
+from hashlib import sha256
+from uuid import UUID
+
+import django.db.models.deletion
+from django.db import migrations, models, transaction
+
+BATCH_SIZE = 1000
+
+
+def option_set_key(args: dict) -> UUID:
+    # The same as OptionSetManager.key()
+    digest = sha256(
+        json.dumps(args, sort_keys=True).encode(), usedforsecurity=False
+    ).digest()
+    return UUID(bytes=digest[:16])
+
+
+def move_args_to_option_sets(apps, schema_editor):
+    EasyImage = apps.get_model("easy_images", "EasyImage")
+    OptionSet = apps.get_model("easy_images", "OptionSet")
+    known: set[UUID] = set()
+    images = EasyImage.objects.filter(option_set=None).only("pk", "args")
+    last = None
+    # Walk the table by primary key (rather than re-querying the unindexed
+    # option_set column), committing each batch as it goes.
+    while True:
+        page = images.order_by("pk")
+        if last:
+            page = page.filter(pk__gt=last)
+        batch = list(page[:BATCH_SIZE])
+        if not batch:
+            break
+        new_option_sets = []
+        for image in batch:
+            key = option_set_key(image.args)
+            if key not in known:
+                known.add(key)
+                new_option_sets.append(OptionSet(id=key, args=image.args))
+            image.option_set_id = key
+        with transaction.atomic(using=schema_editor.connection.alias):
+            OptionSet.objects.bulk_create(new_option_sets, ignore_conflicts=True)
+            EasyImage.objects.bulk_update(batch, ["option_set"])
+        last = batch[-1].pk
+
+
+def move_option_sets_to_args(apps, schema_editor):
+    EasyImage = apps.get_model("easy_images", "EasyImage")
+    OptionSet = apps.get_model("easy_images", "OptionSet")
+    for option_set in OptionSet.objects.iterator():
+        EasyImage.objects.filter(option_set=option_set).update(args=option_set.args)
+
+
+class Migration(migrations.Migration):
+    # Large tables are copied in a transaction per batch rather than in one.
+    atomic = False
+
+    dependencies = [
+        ("easy_images", "0008_archived_image"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OptionSet",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(editable=False, primary_key=True, serialize=False),
+                ),
+                ("args", models.JSONField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name="easyimage",
+            name="option_set",
+            field=models.ForeignKey(
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="+",
+                to="easy_images.optionset",
+            ),
+        ),
+        # Keep the args column until it has been copied, so the migration can be
+        # reversed.
+        migrations.AlterField(
+            model_name="easyimage",
+            name="args",
+            field=models.JSONField(null=True),
+        ),
+        migrations.RunPython(move_args_to_option_sets, move_option_sets_to_args),
+        migrations.RemoveField(
+            model_name="easyimage",
+            name="args",
+        ),
+        migrations.AlterField(
+            model_name="easyimage",
+            name="option_set",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="+",
+                to="easy_images.optionset",
+            ),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("easy_images", "0009_option_set"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SourceImage",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(editable=False, primary_key=True, serialize=False),
+                ),
+                ("storage", models.CharField(max_length=512)),
+                ("name", models.CharField(max_length=512)),
+                ("width", models.PositiveIntegerField()),
+                ("height", models.PositiveIntegerField()),
+                ("format", models.CharField(max_length=16)),
+                ("orientation", models.PositiveSmallIntegerField(null=True)),
+                ("frames", models.PositiveIntegerField(default=1)),
+                ("size", models.BigIntegerField(null=True)),
+                ("mtime", models.DateTimeField(null=True)),
+                ("probed", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("easy_images", "0010_source_image"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="sourceimage",
+            name="placeholder",
+            field=models.TextField(blank=True),
+        ),
+    ]
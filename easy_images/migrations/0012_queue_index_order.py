@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("easy_images", "0011_source_placeholder"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="easyimage",
+            name="easy_images_queue",
+        ),
+        migrations.AddIndex(
+            model_name="easyimage",
+            index=models.Index(
+                condition=models.Q(("image", "")),
+                fields=["status", "created", "id"],
+                name="easy_images_queue",
+            ),
+        ),
+    ]
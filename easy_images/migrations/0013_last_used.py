@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("easy_images", "0012_queue_index_order"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="archivedimage",
+            name="content_hash",
+            field=models.UUIDField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="archivedimage",
+            name="image_url",
+            field=models.CharField(blank=True, max_length=2048),
+        ),
+        migrations.AddField(
+            model_name="archivedimage",
+            name="placeholder",
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name="archivedimage",
+            name="quality",
+            field=models.PositiveSmallIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name="easyimage",
+            name="last_used",
+            field=models.DateTimeField(null=True),
+        ),
+    ]
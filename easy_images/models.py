@@ -1,21 +1,32 @@
 from __future__ import annotations
 
-from typing import cast
+import json
+from datetime import datetime, timedelta
+from functools import partial, reduce
+from hashlib import sha256
+from operator import or_
+from typing import Any, cast
 from uuid import UUID
 
 import django_stubs_ext
+from django.core.files import File
 from django.core.files.storage import (
     Storage,
     storages,  # type: ignore (storages isn't in the stubs)
 )
 from django.core.files.storage.handler import InvalidStorageError
-from django.db import models
+from django.db import models, transaction
 from django.db.models.fields.files import FieldFile, ImageFieldFile
+from django.urls import reverse
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from easy_images import engine
+from easy_images.cache import image_cache
+from easy_images.conf import get_setting
 from easy_images.options import ParsedOptions
+from easy_images.signals import image_build_finished
+from easy_images.stats import record_render, timed
 
 django_stubs_ext.monkeypatch()
 
@@ -38,16 +49,66 @@ def get_storage_name(storage: Storage) -> str:
     raise ValueError(f"Unknown storage: {storages}")
 
 
+def content_digest(file: File) -> str:
+    """
+    Get a hex digest of the contents of a file, leaving the file at its start.
+    """
+    digest = sha256(usedforsecurity=False)
+    for chunk in file.chunks():
+        digest.update(chunk)
+    if file.seekable():
+        file.seek(0)
+    return digest.hexdigest()
+
+
 class EasyImageManager(models.Manager["EasyImage"]):
     def hash(self, *, name: str, storage: str, options: ParsedOptions) -> UUID:
         hash = options.hash()
         hash.update(f":{storage}:{name}".encode())
         return UUID(bytes=hash.digest()[:16])
 
+    def content_hash(self, *, digest: str, options: ParsedOptions) -> UUID:
+        """
+        Hash a version by the content of its source rather than its name, so that
+        identical sources saved under different names can share built images.
+        """
+        hash = options.hash()
+        hash.update(f":content:{digest}".encode())
+        return UUID(bytes=hash.digest()[:16])
+
     def from_file(self, file: FieldFile, options: ParsedOptions):
         name, storage = image_name_and_storage(file)
         pk = self.hash(name=name, storage=storage, options=options)
-        return self.get_or_create(
+        if cached := image_cache.get(pk):
+            record_render("hits")
+            if self.mark_used(pk, cached.last_used):
+                cached.last_used = timezone.now()
+            args = options.to_dict()
+            fields = {
+                "id": pk,
+                "storage": storage,
+                "name": name,
+                "option_set_id": OptionSet.objects.key(args),
+                "status": cached.status,
+                "width": cached.width,
+                "height": cached.height,
+                "image": cached.image,
+                "image_url": cached.image_url,
+                "placeholder": cached.placeholder,
+            }
+            # The other fields are deferred, so they are fetched if used and a save
+            # only writes the fields that were loaded or changed.
+            names = [
+                field.attname
+                for field in self.model._meta.concrete_fields
+                if field.attname in fields
+            ]
+            instance = self.model.from_db(
+                self.db, names, [fields[name] for name in names]
+            )
+            instance._args = args
+            return instance, False
+        instance, created = self.get_or_create(
             pk=pk,
             defaults=dict(
                 storage=storage,
@@ -55,11 +116,157 @@ class EasyImageManager(models.Manager["EasyImage"]):
                 args=options.to_dict(),
             ),
         )
+        record_render("lookups")
+        if created:
+            if self.restore_archived(instance):
+                created = False
+            else:
+                record_render("created")
+        elif instance.status == ImageStatus.SKIPPED and options.upscale is not False:
+            # Versions are shared whatever their upscale option, so queue a version
+            # skipped for another Img again for one that allows upscaling.
+            instance.args = options.to_dict()
+            instance.status = ImageStatus.QUEUED
+            instance.status_changed_date = timezone.now()
+            instance.save()
+            created = True
+        if instance.image:
+            record_render("hits")
+            if self.mark_used(pk, instance.last_used):
+                instance.last_used = timezone.now()
+            image_cache.set(instance)
+        else:
+            record_render("misses")
+        return instance, created
+
+    def mark_used(self, pk: UUID, last_used: datetime | None) -> bool:
+        """
+        Record that a built version was rendered, unless it already was within the
+        last ``USED_INTERVAL`` (so renders don't write to the database every time).
+
+        Returns whether it was recorded.
+        """
+        now = timezone.now()
+        if last_used and last_used > now - USED_INTERVAL:
+            return False
+        self.filter(pk=pk).update(last_used=now)
+        return True
+
+    def restore_archived(self, instance: EasyImage) -> bool:
+        """
+        Restore a newly created version from the archive, if it was archived.
+        """
+        archived = ArchivedImage.objects.filter(pk=instance.pk).first()
+        if not archived:
+            return False
+        instance.set_stored_image(archived.image, archived.width, archived.height)
+        instance.status = ImageStatus.BUILT
+        instance.status_changed_date = instance.last_used = timezone.now()
+        instance.content_hash = archived.content_hash
+        instance.image_url = archived.image_url
+        instance.quality = archived.quality
+        instance.placeholder = archived.placeholder
+        instance.save(
+            update_fields=[
+                "width",
+                "height",
+                "image",
+                "status",
+                "status_changed_date",
+                "last_used",
+                "content_hash",
+                "image_url",
+                "quality",
+                "placeholder",
+            ]
+        )
+        archived.delete()
+        return True
 
     def all_for_file(self, file: FieldFile):
         name, storage = image_name_and_storage(file)
         return self.filter(name=name, storage=storage)
 
+    def queue(self, force=False, retry: int | None = None):
+        """
+        Get the unbuilt images that need building.
+
+        Images marked as building for longer than the ``BUILD_TIMEOUT`` setting are
+        included, since whatever was building them must have stopped.
+
+        :param force: Include images marked as already building or that had errors
+            (but not those skipped for being larger than their source)
+        :param retry: Also include images with errors with no more than this many
+            failures
+        """
+        return reduce(or_, self.queue_by_status(force=force, retry=retry))
+
+    def queue_by_status(
+        self, force=False, retry: int | None = None
+    ) -> list[models.QuerySet[EasyImage]]:
+        """
+        Get the queue (see ``queue()``) as a queryset for each status, so that each
+        can be walked in ``(created, id)`` order through the ``easy_images_queue``
+        partial index rather than sorting the whole queue.
+        """
+        unbuilt = self.filter(image="")
+        if force:
+            # Versions skipped for being larger than their source are never built.
+            return [
+                unbuilt.filter(status=status)
+                for status in ImageStatus
+                if status != ImageStatus.SKIPPED
+            ]
+        queues = [unbuilt.filter(status=ImageStatus.QUEUED)]
+        if get_setting("BUILD_TIMEOUT"):
+            queues.append(unbuilt.filter(stale_building()))
+        if retry:
+            queues.extend(
+                unbuilt.filter(status=status, error_count__lte=retry)
+                for status in (ImageStatus.SOURCE_ERROR, ImageStatus.BUILD_ERROR)
+            )
+        return queues
+
+    def queue_counts(self, retry: int | None = None) -> dict[str, int]:
+        """
+        Count the unbuilt images by status in a single query.
+
+        With ``retry``, also count the images with errors that would be retried (as
+        ``retry_source_errors`` and ``retry_build_errors``).
+        """
+        statuses = {
+            "building": ImageStatus.BUILDING,
+            "source_errors": ImageStatus.SOURCE_ERROR,
+            "build_errors": ImageStatus.BUILD_ERROR,
+            "too_large": ImageStatus.SOURCE_TOO_LARGE,
+        }
+        counts = {"total": models.Count("pk")}
+        for key, status in statuses.items():
+            counts[key] = models.Count("pk", filter=models.Q(status=status))
+            if retry and key.endswith("_errors"):
+                counts[f"retry_{key}"] = models.Count(
+                    "pk", filter=models.Q(status=status, error_count__lte=retry)
+                )
+        unbuilt = self.filter(image="").exclude(status=ImageStatus.SKIPPED)
+        return unbuilt.aggregate(**counts)
+
+
+# How often a rendered version records that it was used (see EasyImage.last_used).
+USED_INTERVAL = timedelta(days=1)
+
+
+def stale_building() -> models.Q:
+    """
+    Match images marked as building for longer than the ``BUILD_TIMEOUT`` setting.
+    """
+    timeout = get_setting("BUILD_TIMEOUT")
+    if not timeout:
+        return models.Q(pk__in=[])
+    return models.Q(
+        status=ImageStatus.BUILDING,
+        status_changed_date__lt=timezone.now() - timedelta(seconds=timeout),
+    )
+
 
 class ImageStatus(models.IntegerChoices):
     QUEUED = 0, _("Queued")
@@ -67,6 +274,206 @@ class ImageStatus(models.IntegerChoices):
     BUILT = 2, _("Built")
     SOURCE_ERROR = 3, _("Source error")
     BUILD_ERROR = 4, _("Build error")
+    SOURCE_TOO_LARGE = 5, _("Source too large")
+    SKIPPED = 6, _("Skipped (larger than the source)")
+
+
+class SourceImageManager(models.Manager["SourceImage"]):
+    def key(self, *, name: str, storage: str) -> UUID:
+        digest = sha256(f"{storage}:{name}".encode(), usedforsecurity=False).digest()
+        return UUID(bytes=digest[:16])
+
+    def for_file(self, file: FieldFile) -> SourceImage | None:
+        """
+        Get the recorded details of a source file (or ``None`` if it hasn't been
+        probed yet).
+        """
+        name, storage = image_name_and_storage(file)
+        return self.filter(pk=self.key(name=name, storage=storage)).first()
+
+    def probe(
+        self,
+        file: File,
+        *,
+        name: str,
+        storage: str,
+        size: int | None = None,
+        mtime: datetime | None = None,
+    ) -> SourceImage:
+        """
+        Read the details of a source file from its header and record them.
+        """
+        info = engine.get_engine().probe(file)
+        if mtime is None:
+            mtime = modified_time(storage, name)
+        pk = self.key(name=name, storage=storage)
+        defaults: dict[str, Any] = dict(
+            storage=storage,
+            name=name,
+            width=info.width,
+            height=info.height,
+            format=info.format,
+            orientation=info.orientation,
+            frames=info.frames,
+            size=size,
+            mtime=mtime,
+        )
+        previous = self.filter(pk=pk).first()
+        if previous and previous.changed(size=size, mtime=mtime):
+            # The placeholder of the old file is out of date.
+            defaults["placeholder"] = ""
+        source, _ = self.update_or_create(pk=pk, defaults=defaults)
+        return source
+
+    def info_for(
+        self,
+        file: File,
+        *,
+        name: str,
+        storage: str,
+        size: int | None = None,
+        recheck=False,
+    ) -> engine.SourceInfo:
+        """
+        Get the details of a source file, probing it if it hasn't been recorded yet
+        or if it has changed since it was.
+
+        The recorded details are trusted while the file's size is unchanged. Its
+        modified time (a request to remote storages) is only checked with
+        ``recheck`` or once the details are older than the ``SOURCE_RECHECK``
+        setting.
+
+        :param recheck: Check the modified time even if the details are recent
+        """
+        source = self.filter(pk=self.key(name=name, storage=storage)).first()
+        if not source or source.changed(size=size):
+            return self.probe(file, name=name, storage=storage, size=size).info
+        max_age = get_setting("SOURCE_RECHECK")
+        if recheck or (
+            max_age is not None
+            and source.probed < timezone.now() - timedelta(seconds=max_age)
+        ):
+            mtime = modified_time(storage, name)
+            if source.changed(mtime=mtime):
+                return self.probe(
+                    file, name=name, storage=storage, size=size, mtime=mtime
+                ).info
+            # Unchanged, so trust the details for a while longer.
+            self.filter(pk=source.pk).update(
+                mtime=mtime or source.mtime, probed=timezone.now()
+            )
+        return source.info
+
+
+def modified_time(storage: str, name: str) -> datetime | None:
+    """
+    Get the modified time of a file, or ``None`` if the storage can't tell.
+    """
+    try:
+        return storages[storage].get_modified_time(name)
+    except (NotImplementedError, OSError, InvalidStorageError):
+        return None
+
+
+class SourceImage(models.Model):
+    """
+    The details of a source image, so that builds and renders don't need to read the
+    original file to find them.
+    """
+
+    id = models.UUIDField(primary_key=True, editable=False)
+    storage = models.CharField(max_length=512)
+    name = models.CharField(max_length=512)
+    width = models.PositiveIntegerField()
+    # The height of the first page (or animation frame).
+    height = models.PositiveIntegerField()
+    format = models.CharField(max_length=16)
+    orientation = models.PositiveSmallIntegerField(null=True)
+    frames = models.PositiveIntegerField(default=1)
+    size = models.BigIntegerField(null=True)
+    mtime = models.DateTimeField(null=True)
+    probed = models.DateTimeField(auto_now=True)
+    # The placeholder of the first version built (see the PLACEHOLDER setting).
+    placeholder = models.TextField(blank=True)
+
+    objects: SourceImageManager = SourceImageManager()
+
+    def changed(
+        self, *, size: int | None = None, mtime: datetime | None = None
+    ) -> bool:
+        """
+        Whether the file has changed since it was probed, going by its size and
+        modified time (either of which is ignored if it isn't known).
+        """
+        if size is not None and self.size is not None and size != self.size:
+            return True
+        return bool(mtime and self.mtime and mtime != self.mtime)
+
+    @property
+    def info(self) -> engine.SourceInfo:
+        return engine.SourceInfo(
+            width=self.width,
+            height=self.height,
+            format=self.format,
+            orientation=self.orientation,
+            frames=self.frames,
+        )
+
+
+def probe_saved_source(sender, fieldfile: FieldFile, **kwargs):
+    """
+    A ``file_post_save`` signal handler which records the details of saved images
+    when the ``PROBE_ON_SAVE`` setting is on.
+    """
+    if not get_setting("PROBE_ON_SAVE"):
+        return
+    name, storage = image_name_and_storage(fieldfile)
+    try:
+        SourceImage.objects.probe(
+            fieldfile, name=name, storage=storage, size=fieldfile.size
+        )
+    except engine.get_engine().decode_errors:
+        # Not an image (or not readable), so there's nothing to record.
+        pass
+
+
+# The args of each option set by id. Option sets never change and there are few of
+# them, so they are kept for the life of the process.
+option_set_args: dict[UUID, dict] = {}
+# The option sets this process has saved, so they aren't looked up again for every
+# new image (only once committed, since a rolled back option set is gone).
+committed_option_sets: set[UUID] = set()
+
+
+class OptionSetManager(models.Manager["OptionSet"]):
+    def key(self, args: dict) -> UUID:
+        """
+        Hash a set of options (including hint options such as the profile) to its id.
+        """
+        digest = sha256(
+            json.dumps(args, sort_keys=True).encode(), usedforsecurity=False
+        ).digest()
+        return UUID(bytes=digest[:16])
+
+    def args_for(self, pk: UUID) -> dict:
+        """
+        Get the args of an option set, from memory if it has already been fetched.
+        """
+        args = option_set_args.get(pk)
+        if args is None:
+            args = option_set_args[pk] = self.get(pk=pk).args
+        return args
+
+
+class OptionSet(models.Model):
+    """
+    A distinct set of options, shared by every ``EasyImage`` built with them.
+    """
+
+    id = models.UUIDField(primary_key=True, editable=False)
+    args = models.JSONField[dict[str, str]]()
+
+    objects: OptionSetManager = OptionSetManager()
 
 
 class EasyImage(models.Model):
@@ -77,7 +484,10 @@ class EasyImage(models.Model):
     status_changed_date = models.DateTimeField(null=True)
     storage = models.CharField(max_length=512)
     name = models.CharField(max_length=512)
-    args = models.JSONField[dict[str, str]]()
+    # Not indexed, since versions are never looked up by their option set.
+    option_set = models.ForeignKey(
+        OptionSet, on_delete=models.PROTECT, related_name="+", db_index=False
+    )
     image = models.ImageField(
         storage=pick_image_storage,
         upload_to="img/thumbs",
@@ -87,9 +497,38 @@ class EasyImage(models.Model):
     )
     height = models.IntegerField(null=True)
     width = models.IntegerField(null=True)
+    build_timings = models.JSONField[dict[str, float]](null=True, blank=True)
+    content_hash = models.UUIDField(null=True, blank=True)
+    image_url = models.CharField(max_length=2048, blank=True)
+    quality = models.PositiveSmallIntegerField(null=True)
+    placeholder = models.TextField(blank=True)
+    # When the version was last rendered (updated at most once every USED_INTERVAL),
+    # so prune_img_versions only archives versions that aren't being used.
+    last_used = models.DateTimeField(null=True)
 
     objects: EasyImageManager = EasyImageManager()
 
+    _args: dict | None = None
+    _unsaved_args: dict | None = None
+
+    @property
+    def args(self) -> dict:
+        """
+        The options of this version (stored in its ``OptionSet``).
+        """
+        if self._args is None:
+            self._args = (
+                OptionSet.objects.args_for(self.option_set_id)
+                if self.option_set_id
+                else {}
+            )
+        return self._args
+
+    @args.setter
+    def args(self, value: dict):
+        self._args = self._unsaved_args = value
+        self.option_set_id = OptionSet.objects.key(value)
+
     def save(self, *args, **kwargs):
         if not self.id:
             self.id = EasyImage.objects.hash(
@@ -97,64 +536,179 @@ class EasyImage(models.Model):
                 storage=self.storage,
                 options=ParsedOptions(**self.args),
             )
+        if self._unsaved_args is not None:
+            if self.option_set_id not in committed_option_sets:
+                OptionSet.objects.get_or_create(
+                    pk=self.option_set_id, defaults={"args": self._unsaved_args}
+                )
+                transaction.on_commit(
+                    partial(committed_option_sets.add, self.option_set_id)
+                )
+            self._unsaved_args = None
         super().save(*args, **kwargs)
 
+    def get_image_url(self) -> str:
+        """
+        Get the URL of the built image, avoiding a ``storage.url()`` call when the
+        ``URL_TEMPLATE`` or ``STORE_URLS`` settings are used.
+        """
+        if template := get_setting("URL_TEMPLATE"):
+            return template.format(name=self.image.name)
+        if self.image_url and get_setting("STORE_URLS"):
+            return self.image_url
+        return self.image.url
+
+    def get_on_demand_url(self) -> str:
+        """
+        Get the URL of the view which serves this image, building it on demand.
+        """
+        return reverse("easy_images:image", args=[self.pk])
+
     def build(
         self,
-        source_img: engine.Image | None = None,
+        source_img: Any = None,
         options: ParsedOptions | None = None,
         force=False,
+        source_bytes: int | None = None,
+        source_digest: str | None = None,
+        profile: str | None = None,
+        source_info: engine.SourceInfo | None = None,
     ):
+        """
+        Build the image.
+
+        :param source_img: The already loaded source image, loaded by the ``ENGINE``
+            (otherwise the source is loaded from storage)
+        :param options: The parsed options (otherwise parsed from ``args``)
+        :param force: Build even if the image is already built or being built
+            (images marked as building for longer than ``BUILD_TIMEOUT`` are built
+            either way)
+        :param source_bytes: The size of the already loaded source image
+        :param source_digest: The content digest of the already loaded source image
+        :param profile: The encoder profile to use if the options don't specify one
+            (defaults to the ``QUEUE_PROFILE`` setting)
+        :param source_info: The details of the already loaded source image
+        """
         now = timezone.now()
         if force:
             EasyImage.objects.filter(pk=self.pk).update(
                 status=ImageStatus.BUILDING, status_changed_date=now
             )
         elif self.image or not EasyImage.objects.filter(
-            pk=self.pk, status=ImageStatus.QUEUED
+            models.Q(status=ImageStatus.QUEUED) | stale_building(), pk=self.pk
         ).update(status=ImageStatus.BUILDING, status_changed_date=now):
             # Already built (or being generated elsewhere).
             return False
         self.status = ImageStatus.BUILDING
         self.status_changed_date = now
+        image_engine = engine.get_engine()
+        timings: dict[str, float] = {}
+        # libvips is lazy, so render the pixels at the end of each stage when the
+        # timings are used, otherwise the decoding and scaling are timed as encoding.
+        measure = get_setting("RECORD_BUILD_TIMINGS") or (
+            image_build_finished.has_listeners(EasyImage)
+        )
+        output_bytes = None
         if not source_img:
             try:
-                storage = storages[self.storage]
-                file = storage.open(self.name)
-                source_img = engine.efficient_load(file, options)
+                with timed(timings, "fetch"):
+                    storage = storages[self.storage]
+                    file = storage.open(self.name)
+                    source_bytes = file.size
+                # Only the header is read here, so the source limits are checked
+                # before reading the whole file for the digest.
+                with timed(timings, "load"):
+                    source_info = SourceImage.objects.info_for(
+                        file, name=self.name, storage=self.storage, size=source_bytes
+                    )
+                    if self._skip_upscale(options, source_info, timings, source_bytes):
+                        return False
+                    source_img = image_engine.load(file, options, info=source_info)
+                    if measure:
+                        source_img = image_engine.in_memory(source_img)
+                if get_setting("DEDUPLICATE"):
+                    with timed(timings, "fetch"):
+                        source_digest = content_digest(file)
+                if source_digest and self._share_duplicate(
+                    source_digest, options, timings
+                ):
+                    return True
+            except engine.SourceTooLarge:
+                self.status = ImageStatus.SOURCE_TOO_LARGE
+                self.status_changed_date = timezone.now()
+                self._finish_build(timings, source_bytes=source_bytes)
+                return False
             except Exception:
                 self.error_count += 1
                 self.status = ImageStatus.SOURCE_ERROR
                 self.status_changed_date = timezone.now()
-                self.save()
+                self._finish_build(timings, source_bytes=source_bytes)
                 return False
+        elif source_info and self._skip_upscale(
+            options, source_info, timings, source_bytes
+        ):
+            return False
+        elif source_digest and self._share_duplicate(source_digest, options, timings):
+            return True
         try:
             if not options:
                 options = ParsedOptions(**self.args)
-            if size := options.size:
-                scale_args = {}
-                if options.window:
-                    scale_args["focal_window"] = options.window
-                if options.crop:
-                    scale_args["crop"] = options.crop
-                img = engine.scale_image(source_img, size, **scale_args)
-            else:
-                img = source_img
-            self.height = img.height
-            self.width = img.width
+            with timed(timings, "scale"):
+                if size := options.size:
+                    scale_args = {}
+                    if options.window:
+                        scale_args["focal_window"] = options.window
+                    if options.crop:
+                        scale_args["crop"] = options.crop
+                    img = image_engine.scale(source_img, size, **scale_args)
+                else:
+                    img = source_img
+                # Only render scaled images, since rendering an unscaled one would
+                # hold the whole source in memory.
+                placeholder = get_setting("PLACEHOLDER")
+                if (placeholder or measure) and options.size:
+                    # Render the pixels once for the placeholder, the timings and the
+                    # image.
+                    img = image_engine.in_memory(img)
+            if placeholder and options.size:
+                with timed(timings, "scale"):
+                    self.placeholder = image_engine.placeholder(img, placeholder)
+                # Also record it for the source, for its versions that aren't built.
+                SourceImage.objects.filter(
+                    pk=SourceImage.objects.key(name=self.name, storage=self.storage),
+                    placeholder="",
+                ).update(placeholder=self.placeholder)
             extension = {
                 "image/jpeg": ".jpg",
                 "image/webp": ".webp",
                 "image/avif": ".avif",
             }.get(options.mimetype or "", ".jpg")
-            file = engine.vips_to_django(
-                img, f"{self.id.hex}{extension}", quality=options.quality
+            if extension != ".webp":
+                # Only WebP versions are animated (libvips saves the frames of an
+                # AVIF as separate still images).
+                img = image_engine.first_page(img)
+            self.width, self.height = image_engine.size(img)
+            save_options = engine.encoder_options(
+                options.mimetype,
+                options.profile or profile or get_setting("QUEUE_PROFILE"),
             )
+            with timed(timings, "encode"):
+                name = f"{self.id.hex}{extension}"
+                if options.quality == "auto" and options.max_bytes:
+                    self.quality, file = image_engine.encode_to_fit(
+                        img, name, options.max_bytes, **save_options
+                    )
+                else:
+                    self.quality = options.quality
+                    file = image_engine.encode(
+                        img, name, quality=options.quality, **save_options
+                    )
+            output_bytes = file.size
         except Exception:
             self.error_count += 1
             self.status = ImageStatus.BUILD_ERROR
             self.status_changed_date = timezone.now()
-            self.save()
+            self._finish_build(timings, source_img, source_bytes)
             return False
         self.image = cast(
             ImageFieldFile,  # Avoid some typing issues
@@ -162,13 +716,139 @@ class EasyImage(models.Model):
         )
         self.status = ImageStatus.BUILT
         self.status_changed_date = timezone.now()
-        self.save()
+        self._finish_build(timings, source_img, source_bytes, output_bytes)
         file.close()
         return True
 
+    def set_stored_image(self, name: str, width: int | None, height: int | None):
+        """
+        Set the image to a file that is already in storage, with known dimensions.
+
+        Assigning to ``image`` would make the ``ImageField`` read the dimensions
+        from the file in storage, so the name is set directly instead.
+        """
+        self.__dict__["image"] = name
+        self.width = width
+        self.height = height
+
+    def _share_duplicate(
+        self,
+        source_digest: str,
+        options: ParsedOptions | None,
+        timings: dict[str, float],
+    ) -> bool:
+        """
+        Record the content hash of this version and, if an identical version of an
+        identical source has already been built, share its image instead of building.
+        """
+        self.content_hash = EasyImage.objects.content_hash(
+            digest=source_digest, options=options or ParsedOptions(**self.args)
+        )
+        duplicate = (
+            EasyImage.objects.filter(
+                content_hash=self.content_hash, status=ImageStatus.BUILT
+            )
+            .exclude(image="")
+            .exclude(pk=self.pk)
+            .only("image", "width", "height")
+            .first()
+        )
+        if not duplicate:
+            return False
+        self.set_stored_image(duplicate.image.name, duplicate.width, duplicate.height)
+        self.status = ImageStatus.BUILT
+        self.status_changed_date = timezone.now()
+        self._finish_build(timings)
+        return True
+
+    def _skip_upscale(
+        self,
+        options: ParsedOptions | None,
+        source_info: engine.SourceInfo,
+        timings: dict[str, float],
+        source_bytes: int | None,
+    ) -> bool:
+        """
+        Skip building a version larger than its source when its ``upscale`` option
+        is off, marking it as skipped so it isn't queued again.
+        """
+        if not options:
+            options = ParsedOptions(**self.args)
+        if not options.skip_for(source_info.width, source_info.height):
+            return False
+        self.status = ImageStatus.SKIPPED
+        self.status_changed_date = timezone.now()
+        self._finish_build(timings, source_bytes=source_bytes)
+        return True
+
+    def _finish_build(
+        self,
+        timings: dict[str, float],
+        source_img: Any = None,
+        source_bytes: int | None = None,
+        output_bytes: int | None = None,
+    ):
+        """
+        Save the result of a build and send the ``image_build_finished`` signal.
+        """
+        with timed(timings, "save"):
+            if get_setting("RECORD_BUILD_TIMINGS"):
+                self.build_timings = timings.copy()
+            self.save()
+            if self.image and get_setting("STORE_URLS"):
+                # The URL is only known once the image has been saved to storage.
+                self.image_url = self.image.url
+                EasyImage.objects.filter(pk=self.pk).update(image_url=self.image_url)
+        try:
+            loader = source_img.get("vips-loader") if source_img else None
+        except Exception:
+            loader = None
+        image_build_finished.send(
+            sender=EasyImage,
+            instance=self,
+            timings=timings,
+            source_bytes=source_bytes,
+            output_bytes=output_bytes,
+            loader=loader,
+        )
+
     class Meta:
         indexes = [
             models.Index(
                 fields=["storage", "name"], name="easy_images_storage_and_name"
             ),
+            models.Index(fields=["content_hash"], name="easy_images_content_hash"),
+            # The queue of unbuilt images (see ``EasyImage.objects.queue()``).
+            models.Index(
+                fields=["status", "created", "id"],
+                condition=models.Q(image=""),
+                name="easy_images_queue",
+            ),
+        ]
+
+
+class ArchivedImage(models.Model):
+    """
+    A compact record of a built ``EasyImage`` that was moved out of the main table by
+    the ``prune_img_versions`` command. It is restored the next time the version is
+    requested.
+    """
+
+    id = models.UUIDField(primary_key=True, editable=False)
+    storage = models.CharField(max_length=512)
+    name = models.CharField(max_length=512)
+    image = models.CharField(max_length=100)
+    width = models.IntegerField(null=True)
+    height = models.IntegerField(null=True)
+    content_hash = models.UUIDField(null=True, blank=True)
+    image_url = models.CharField(max_length=2048, blank=True)
+    quality = models.PositiveSmallIntegerField(null=True)
+    placeholder = models.TextField(blank=True)
+    archived = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["storage", "name"], name="easy_images_archived_source"
+            ),
         ]
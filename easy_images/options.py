@@ -1,6 +1,6 @@
 import json
 from hashlib import sha256
-from typing import cast
+from typing import Literal, cast
 
 from django.template import Context, Variable
 from django.utils.text import smart_split
@@ -39,14 +39,34 @@ ratio_options: dict[str, float] = {
 
 
 class ParsedOptions:
-    __slots__ = ("quality", "crop", "window", "width", "ratio", "mimetype")
-
-    quality: int
+    __slots__ = (
+        "quality",
+        "crop",
+        "window",
+        "width",
+        "ratio",
+        "mimetype",
+        "profile",
+        "max_bytes",
+        "upscale",
+    )
+    # Newer options are only serialized when set, so existing hashes don't change.
+    optional_keys = ("profile", "max_bytes", "upscale")
+    # Options that are on by default, so are only kept (as False) when turned off.
+    flag_keys = ("upscale",)
+    # Options that only decide whether a version is built rather than what it is.
+    # These are left out of the hash.
+    hint_keys = ("upscale",)
+
+    quality: int | Literal["auto"]
     crop: tuple[float, float] | None
     window: tuple[float, float, float, float] | None
     width: int | None
     ratio: float | None
     mimetype: str | None
+    profile: str | None
+    max_bytes: int | None
+    upscale: Literal[False] | None
 
     def __init__(self, bound=None, string="", /, **options):
         if string:
@@ -62,7 +82,9 @@ class ParsedOptions:
             value = options.get(key)
             if isinstance(value, Variable):
                 value = value.resolve(context)
-            if value and value != 0:
+            if key in self.flag_keys and value is not None:
+                setattr(self, key, None if self.parse_flag(value) else False)
+            elif value and value != 0:
                 parse_func = getattr(self, f"parse_{key}")
                 setattr(self, key, parse_func(value, **options))
             else:
@@ -77,9 +99,13 @@ class ParsedOptions:
         return cls(**str_options)
 
     @staticmethod
-    def parse_quality(value, **options) -> int:
+    def parse_quality(value, **options) -> int | Literal["auto"]:
         if not value:
             return 80
+        if value == "auto":
+            if not options.get("max_bytes"):
+                raise ValueError("An auto quality requires max_bytes")
+            return value
         try:
             return int(value)
         except (ValueError, TypeError):
@@ -153,8 +179,30 @@ class ParsedOptions:
     def parse_mimetype(value, **options) -> str:
         return str(value)
 
+    @staticmethod
+    def parse_profile(value, **options) -> str:
+        return str(value)
+
+    @staticmethod
+    def parse_max_bytes(value, **options) -> int:
+        try:
+            return int(value)
+        except (ValueError, TypeError):
+            raise ValueError(f"Invalid max_bytes value {value}")
+
+    @staticmethod
+    def parse_flag(value, **options) -> bool:
+        if isinstance(value, str):
+            return value.lower() not in ("", "0", "false", "no", "off")
+        return bool(value)
+
     def __str__(self):
-        return json.dumps(self.to_dict(), sort_keys=True)
+        options = {
+            key: value
+            for key, value in self.to_dict().items()
+            if key not in self.hint_keys
+        }
+        return json.dumps(options, sort_keys=True)
 
     def hash(self):
         return sha256(str(self).encode(), usedforsecurity=False)
@@ -165,8 +213,31 @@ class ParsedOptions:
             return None
         return self.width, int(self.width / self.ratio)
 
+    def exceeds(self, source_width: int, source_height: int) -> bool:
+        """
+        Whether this version is larger than a source of the given size (so building
+        it would upscale the source).
+        """
+        if not self.width:
+            return False
+        if self.width > source_width:
+            return True
+        size = self.size
+        return bool(size and size[1] > source_height)
+
+    def skip_for(self, source_width: int, source_height: int) -> bool:
+        """
+        Whether this version should be skipped for a source of the given size, since
+        it would need upscaling and its ``upscale`` option is off.
+        """
+        return self.upscale is False and self.exceeds(source_width, source_height)
+
     def to_dict(self):
-        return {key: getattr(self, key) for key in self.__slots__}
+        return {
+            key: getattr(self, key)
+            for key in self.__slots__
+            if key not in self.optional_keys or getattr(self, key) is not None
+        }
 
     def source_x(self, source_x: int):
         if self.window:
@@ -0,0 +1,199 @@
+"""
+An image engine using Pillow, for processes that don't have libvips.
+
+Select it with ``"ENGINE": "easy_images.pillow_engine.PillowEngine"``.
+"""
+
+from __future__ import annotations
+
+import base64
+import io
+import os
+from pathlib import Path
+
+from django.core.files import File
+from PIL import ExifTags, Image
+
+from easy_images.engine import (
+    SourceInfo,
+    _file_size,
+    buffer_to_django,
+    check_source,
+    fit_quality,
+    load_shrink,
+)
+from easy_images.geometry import round_half_up, scale_geometry
+from easy_images.options import ParsedOptions
+
+# The Pillow format of each version file extension.
+image_formats = {".jpg": "JPEG", ".webp": "WEBP", ".avif": "AVIF"}
+
+# The Pillow save option for each libvips save option (from the ``ENCODER`` and
+# ``PROFILES`` settings) that has an equivalent, by format.
+save_option_names = {
+    "JPEG": {"optimize_coding": "optimize", "interlace": "progressive"},
+    "WEBP": {"effort": "method", "lossless": "lossless"},
+    "AVIF": {"lossless": "lossless"},
+}
+
+
+class PillowEngine:
+    """
+    An engine using Pillow.
+
+    JPEG sources are reduced while decoding (using ``Image.draft()``). Only the first
+    frame of animated sources is used, and libvips save options without a Pillow
+    equivalent are ignored.
+    """
+
+    name = "Pillow"
+    # UnidentifiedImageError is an OSError.
+    decode_errors = (OSError, Image.DecompressionBombError)
+
+    def configure(self, role: str | None = None, **overrides) -> dict:
+        # There's nothing to configure.
+        return {}
+
+    def probe(self, file: str | Path | File) -> SourceInfo:
+        return source_info(_open(file))
+
+    def load(
+        self,
+        file: str | Path | File,
+        options: list[ParsedOptions] | ParsedOptions | None,
+        info: SourceInfo | None = None,
+    ) -> Image.Image:
+        if options and not isinstance(options, list):
+            options = [options]
+        img = _open(file)
+        if not info:
+            info = source_info(img)
+        check_source(info, _file_size(file))
+        if options and (shrink := load_shrink(info, options)) > 1:
+            # Only JPEGs can be reduced while decoding (other formats ignore this).
+            img.draft(None, (img.width // shrink, img.height // shrink))
+        img.load()
+        return normalise_mode(img)
+
+    def scale(
+        self,
+        img: Image.Image,
+        target: tuple[int, int],
+        crop: tuple[float, float] | bool | None = None,
+        focal_window: tuple[float, float, float, float] | None = None,
+    ) -> Image.Image:
+        geometry = scale_geometry(
+            img.size, target, crop=crop, focal_window=focal_window
+        )
+        if geometry.window != (0, 0, *img.size):
+            img = _crop(img, *geometry.window)
+        img = img.resize(geometry.resized, Image.Resampling.LANCZOS, reducing_gap=3)
+        if geometry.box != (0, 0, *geometry.resized):
+            img = _crop(img, *geometry.box)
+        return img
+
+    def first_page(self, img: Image.Image) -> Image.Image:
+        # Only the first frame is ever loaded.
+        return img
+
+    def size(self, img: Image.Image) -> tuple[int, int]:
+        return img.size
+
+    def in_memory(self, img: Image.Image) -> Image.Image:
+        # Pillow images are always in memory.
+        return img
+
+    def placeholder(self, img: Image.Image, kind: str) -> str:
+        img = img.convert("RGB")
+        if kind == "lqip":
+            small = img.resize((32, round_half_up(32 * img.height / img.width)))
+            buffer = io.BytesIO()
+            small.save(buffer, "WEBP", quality=40)
+            return (
+                f"data:image/webp;base64,{base64.b64encode(buffer.getvalue()).decode()}"
+            )
+        if kind == "color":
+            pixel = img.resize((1, 1), Image.Resampling.BOX).getpixel((0, 0))
+            return "#" + "".join(f"{n:02x}" for n in pixel)  # type: ignore
+        raise ValueError(f"Unknown placeholder kind {kind}")
+
+    def encode(
+        self, img: Image.Image, name: str, quality: int = 80, **save_options
+    ) -> File:
+        extension = os.path.splitext(name)[1]
+        return buffer_to_django(encode(img, extension, quality, **save_options), name)
+
+    def encode_to_fit(
+        self, img: Image.Image, name: str, max_bytes: int, **save_options
+    ) -> tuple[int, File]:
+        extension = os.path.splitext(name)[1]
+        quality, buffer = fit_quality(
+            lambda quality: encode(img, extension, quality, **save_options), max_bytes
+        )
+        return quality, buffer_to_django(buffer, name)
+
+
+def source_info(img: Image.Image) -> SourceInfo:
+    """
+    Get the details of a source image that has just been opened (so that only its
+    header has been read).
+    """
+    return SourceInfo(
+        width=img.width,
+        height=img.height,
+        format=(img.format or "").lower(),
+        orientation=img.getexif().get(ExifTags.Base.Orientation),
+        frames=getattr(img, "n_frames", 1),
+    )
+
+
+def normalise_mode(img: Image.Image) -> Image.Image:
+    """
+    Convert an image to RGB (or RGBA if it has transparency) if its mode can't be
+    scaled smoothly or encoded directly.
+
+    Pillow only resizes palette and bilevel images with nearest neighbour, and
+    converting 16-bit greyscale straight to RGB clips it, so its values are scaled
+    down to 8 bits first.
+    """
+    if img.mode.startswith("I"):
+        if img.mode != "I":
+            img = img.convert("I")
+        return img.point(lambda value: value / 257 + 0.5).convert("L").convert("RGB")
+    if img.mode in ("P", "PA", "1", "LA"):
+        has_alpha = "A" in img.getbands() or "transparency" in img.info
+        return img.convert("RGBA" if has_alpha else "RGB")
+    return img
+
+
+def encode(img: Image.Image, extension: str, quality: int, **save_options) -> bytes:
+    """
+    Encode an image in the format of a file extension.
+
+    The libvips save options are translated to Pillow ones where possible.
+    """
+    image_format = image_formats.get(extension, "JPEG")
+    if image_format == "JPEG":
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+    elif img.mode not in ("RGB", "RGBA"):
+        has_alpha = "A" in img.getbands() or "transparency" in img.info
+        img = img.convert("RGBA" if has_alpha else "RGB")
+    names = save_option_names.get(image_format, {})
+    options = {names[k]: v for k, v in save_options.items() if k in names}
+    if image_format == "AVIF" and "effort" in save_options:
+        # libvips' effort (0 to 9) is the reverse of Pillow's speed (0 to 10).
+        options["speed"] = max(0, min(10, 9 - save_options["effort"]))
+    buffer = io.BytesIO()
+    img.save(buffer, image_format, quality=quality, **options)
+    return buffer.getvalue()
+
+
+def _open(file: str | Path | File) -> Image.Image:
+    if isinstance(file, File) and file.seekable():
+        file.seek(0)
+    return Image.open(file)
+
+
+def _crop(img: Image.Image, left, top, width, height) -> Image.Image:
+    return img.crop((left, top, left + width, top + height))
@@ -18,6 +18,23 @@ A signal sent when an ``Img`` queues images for building.
 * The ``instance`` argument will be the instance of the field's file.
 """
 
+image_build_finished = django.dispatch.Signal()
+"""
+A signal sent when an ``EasyImage`` has finished building (successfully or not).
+
+* The ``sender`` argument will be the ``EasyImage`` class.
+* The ``instance`` argument will be the ``EasyImage`` instance, its ``status`` showing
+  whether the build succeeded.
+* The ``timings`` argument will be a dictionary of the seconds spent in each build
+  stage that ran: ``fetch`` (opening the source from storage), ``load`` (reading the
+  source image header), ``scale``, ``encode`` and ``save`` (writing to storage). libvips
+  evaluates lazily, so most of the decoding and resizing cost shows up in ``encode``.
+* The ``source_bytes`` and ``output_bytes`` arguments will be the size of the source
+  and built files (``None`` if unknown).
+* The ``loader`` argument will be the name of the libvips loader used for the source
+  (``None`` if unknown).
+"""
+
 
 def find_uncommitted_filefields(sender, instance, **kwargs):
     """
@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+import math
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from easy_images.models import EasyImage
+
+build_stages = ("fetch", "load", "scale", "encode", "save")
+
+
+@contextmanager
+def timed(timings: dict[str, float], stage: str):
+    """
+    Add the time spent within the context to the ``stage`` key of ``timings``.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0) + time.perf_counter() - start
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """
+    Return the nearest-rank percentile of a list of values.
+    """
+    if not values:
+        return 0
+    ordered = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+class BuildStats:
+    """
+    Aggregate the ``image_build_finished`` signals of a run of builds.
+    """
+
+    percentiles = (50, 90, 99)
+
+    def __init__(self):
+        self.built = 0
+        self.errors = 0
+        self.source_bytes = 0
+        self.output_bytes = 0
+        self.stages: dict[str, list[float]] = {}
+        self.loaders: dict[str, int] = {}
+        self.started = time.perf_counter()
+
+    def record(
+        self,
+        instance: EasyImage,
+        timings: dict[str, float],
+        source_bytes: int | None = None,
+        output_bytes: int | None = None,
+        loader: str | None = None,
+        **kwargs,
+    ):
+        from easy_images.models import ImageStatus
+
+        if instance.status == ImageStatus.BUILT:
+            self.built += 1
+        else:
+            self.errors += 1
+        self.source_bytes += source_bytes or 0
+        self.output_bytes += output_bytes or 0
+        for stage, seconds in timings.items():
+            self.stages.setdefault(stage, []).append(seconds)
+        if loader:
+            self.loaders[loader] = self.loaders.get(loader, 0) + 1
+
+    @property
+    def count(self) -> int:
+        return self.built + self.errors
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def as_dict(self) -> dict:
+        """
+        The aggregate statistics as a dictionary, useful for exporting as metrics.
+        """
+        elapsed = self.elapsed
+        return {
+            "built": self.built,
+            "errors": self.errors,
+            "elapsed": elapsed,
+            "images_per_second": self.count / elapsed if elapsed else 0,
+            "source_bytes": self.source_bytes,
+            "output_bytes": self.output_bytes,
+            "loaders": self.loaders.copy(),
+            "stages": {
+                stage: {
+                    "total": sum(self.stages[stage]),
+                    **{
+                        f"p{p}": percentile(self.stages[stage], p)
+                        for p in self.percentiles
+                    },
+                }
+                for stage in build_stages
+                if stage in self.stages
+            },
+        }
+
+    def summary(self) -> list[str]:
+        """
+        A human readable summary of the statistics, one line per item.
+        """
+        stats = self.as_dict()
+        lines = [
+            f"{self.count} builds in {stats['elapsed']:.1f}s"
+            f" ({stats['images_per_second']:.1f}/s),"
+            f" {self.source_bytes / 1024 / 1024:.1f}MB read,"
+            f" {self.output_bytes / 1024 / 1024:.1f}MB written"
+        ]
+        for stage, stage_stats in stats["stages"].items():
+            percentiles = ", ".join(
+                f"p{p} {stage_stats[f'p{p}'] * 1000:.0f}ms" for p in self.percentiles
+            )
+            lines.append(f"  {stage}: {percentiles}")
+        return lines
+
+
+class RenderStats:
+    """
+    Counters of the work done rendering ``<img>`` elements.
+    """
+
+    __slots__ = (
+        "bound_imgs",
+        "lookups",
+        "created",
+        "hits",
+        "misses",
+        "inline_builds",
+        "inline_build_time",
+        "fallbacks",
+    )
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+    def as_dict(self) -> dict[str, int | float]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __str__(self):
+        return ", ".join(
+            f"{name}={value:.3f}" if isinstance(value, float) else f"{name}={value}"
+            for name, value in self.as_dict().items()
+        )
+
+
+_render_stats: ContextVar[RenderStats | None] = ContextVar(
+    "easy_images_render_stats", default=None
+)
+
+
+@contextmanager
+def track_renders():
+    """
+    Count the work done rendering ``<img>`` elements within the context.
+
+    Yields a :class:`RenderStats` instance which is updated as images are rendered::
+
+        with track_renders() as stats:
+            html = template.render(context)
+        print(stats.lookups, stats.inline_build_time)
+    """
+    stats = RenderStats()
+    token = _render_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _render_stats.reset(token)
+
+
+def record_render(name: str, value: int | float = 1):
+    """
+    Add to a render counter, if renders are currently being tracked.
+    """
+    stats = _render_stats.get()
+    if stats is not None:
+        setattr(stats, name, getattr(stats, name) + value)
@@ -11,27 +11,32 @@ register = template.Library()
 
 
 class ImgNode(template.Node):
-    def __init__(self, file, img_instance, options, as_var):
+    def __init__(self, file, img_instance, options, as_var, picture=False):
         self.file = file
         self.img_instance = img_instance
         self.options = options
         self.as_var = as_var
+        self.picture = picture
 
     def render(self, context):
         file = self.file.resolve(context)
-        resolved_options = {key: value.resolve(context) for key, value in self.options}
+        resolved_options = {
+            key: value.resolve(context) for key, value in self.options.items()
+        }
         base_opts = ParsedOptions(**resolved_options)
         options = cast(
             ImgOptions,
             {
                 key: getattr(base_opts, key)
                 for key in ParsedOptions.__slots__
-                if getattr(base_opts, key) is not None
+                if key in resolved_options and getattr(base_opts, key) is not None
             },
         )
         img_attrs = {}
         for key, value in resolved_options.items():
-            if key.startswith("img_"):
+            if key in options or key == "alt":
+                continue
+            elif key.startswith("img_"):
                 img_attrs[key[4:]] = value
             elif key == "densities":
                 options["densities"] = (
@@ -49,12 +54,25 @@ class ImgNode(template.Node):
                 if size_key.isdigit():
                     size_key = int(size_key)
                 sizes[size_key] = int(value)
+            elif key in ("loading", "decoding"):
+                options[key] = value
+            elif key == "upscale":
+                options["upscale"] = ParsedOptions.parse_flag(value)
             elif key == "format":
                 options["format"] = value
+            elif key == "formats":
+                options["formats"] = (
+                    value.split(",") if isinstance(value, str) else list(value)
+                )
             else:
                 raise ValueError(f"Invalid option {key}")
         options["img_attrs"] = img_attrs
-        output = Img(**options)(file, alt=resolved_options["alt"]).as_html()
+        if self.img_instance:
+            img = self.img_instance.resolve(context).extend(**options)
+        else:
+            img = Img(**options)
+        bound = img(file, alt=resolved_options["alt"])
+        output = bound.as_picture_html() if self.picture else bound.as_html()
         if self.as_var:
             context[self.as_var] = output
             return ""
@@ -63,6 +81,15 @@ class ImgNode(template.Node):
 
 @register.tag
 def img(parser, token):
+    return _img_node(parser, token)
+
+
+@register.tag
+def picture(parser, token):
+    return _img_node(parser, token, picture=True)
+
+
+def _img_node(parser, token, picture=False):
     bits = token.split_contents()
     if len(bits) < 2:
         raise template.TemplateSyntaxError(f"{bits[0]} tag requires a field file")
@@ -72,6 +99,7 @@ def img(parser, token):
             f"{bits[0]} tag requires an Img instance or options"
         )
     options = bits[2:]
+    img_instance = None
     if "=" not in options[0]:
         img_instance = parser.compile_filter(options[0])
         options = options[1:]
@@ -83,4 +111,4 @@ def img(parser, token):
     if "alt" not in options:
         raise template.TemplateSyntaxError(f"{bits[0]} tag requires an alt attribute")
 
-    return ImgNode(file, img_instance, options, as_var)
+    return ImgNode(file, img_instance, options, as_var, picture=picture)
@@ -41,11 +41,14 @@ format_map = {"avif": "image/avif", "webp": "image/webp", "jpeg": "image/jpeg"}
 
 
 class Options(TypedDict, total=False):
-    quality: int
+    quality: int | Literal["auto"]
     crop: tuple[float, float] | CropChoices | bool
     window: tuple[float, float, float, float] | None
     width: int | WidthChoices | None
     ratio: float | tuple[float, float] | RatioChoices | None
+    profile: str | None
+    max_bytes: int | None
+    upscale: bool
     # Meta options:
     alt: str | None
     width_multiplier: float
@@ -55,6 +58,9 @@ class Options(TypedDict, total=False):
 
 class ImgOptions(Options, total=False):
     format: str
+    formats: list[str]
     densities: list[int | float]
     sizes: dict[str | int, int | str | Options]
     img_attrs: dict[str, str]
+    loading: Literal["lazy", "eager"] | None
+    decoding: Literal["async", "sync", "auto"] | None
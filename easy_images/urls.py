@@ -0,0 +1,9 @@
+from django.urls import path
+
+from easy_images import views
+
+app_name = "easy_images"
+
+urlpatterns = [
+    path("<uuid:pk>/", views.image, name="image"),
+]
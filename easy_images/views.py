@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import threading
+import time
+from datetime import timedelta
+from mimetypes import guess_type
+from uuid import UUID
+
+from django.core.files.storage import storages  # type: ignore
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    HttpResponseNotModified,
+    HttpResponseRedirect,
+)
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+
+from easy_images.conf import get_setting
+from easy_images.models import EasyImage, ImageStatus
+
+# Striped locks, so concurrent requests for the same image in this process coalesce
+# onto a single build without keeping a lock around for every image.
+build_locks = [threading.Lock() for _ in range(64)]
+
+
+def build_lock(pk: UUID) -> threading.Lock:
+    return build_locks[pk.int % len(build_locks)]
+
+
+def image(request, pk: UUID):
+    """
+    Serve a built image version, building it first if needed.
+
+    Concurrent requests for the same version wait for a single build (in this process
+    via a lock, or in other processes by waiting for the ``BUILDING`` status to
+    change). If the version can't be built, see ``unbuilt_response()``.
+    """
+    easy_image = get_object_or_404(EasyImage, pk=pk)
+    if not easy_image.image:
+        with build_lock(pk):
+            easy_image.refresh_from_db()
+            built = easy_image.image or easy_image.build(
+                profile=get_setting("INLINE_PROFILE")
+            )
+        # Wait outside the lock, so requests for other images sharing it aren't
+        # held up.
+        if not built:
+            wait_for_build(easy_image)
+        if not easy_image.image:
+            return unbuilt_response(easy_image)
+    etag = f'"{easy_image.pk.hex}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "public, max-age=31536000, immutable",
+    }
+    if etag in request.headers.get("If-None-Match", ""):
+        return HttpResponseNotModified(headers=headers)
+    response = FileResponse(
+        easy_image.image.open("rb"), content_type=guess_type(easy_image.image.name)[0]
+    )
+    for key, value in headers.items():
+        response[key] = value
+    return response
+
+
+def unbuilt_response(easy_image: EasyImage) -> HttpResponse:
+    """
+    Respond for a version that couldn't be built (or is still being built elsewhere).
+
+    Sources that are too large or couldn't be read are never served. Otherwise,
+    redirect to the original source if the ``FALLBACK`` setting would use it,
+    or respond that the version isn't available (yet).
+    """
+    if easy_image.status in (ImageStatus.SOURCE_TOO_LARGE, ImageStatus.SOURCE_ERROR):
+        raise Http404("The image's source can't be built")
+    policies = get_setting("FALLBACK")
+    if isinstance(policies, str):
+        policies = [policies]
+    # The original is used if every policy before it fails, and only the
+    # placeholder policy always succeeds.
+    if "original" in policies or "placeholder" not in policies:
+        storage = storages[easy_image.storage]
+        return HttpResponseRedirect(storage.url(easy_image.name))
+    if easy_image.status == ImageStatus.BUILDING:
+        return HttpResponse(status=503, headers={"Retry-After": "10"})
+    raise Http404("The image couldn't be built")
+
+
+def wait_for_build(easy_image: EasyImage):
+    """
+    Wait (up to the ``ON_DEMAND_WAIT`` setting) for an image being built elsewhere.
+
+    Images marked as building for longer than the ``BUILD_TIMEOUT`` setting were
+    abandoned, so aren't waited for.
+    """
+    deadline = time.monotonic() + get_setting("ON_DEMAND_WAIT")
+    while (
+        easy_image.status == ImageStatus.BUILDING
+        and not is_stale(easy_image)
+        and time.monotonic() < deadline
+    ):
+        time.sleep(0.1)
+        easy_image.refresh_from_db()
+
+
+def is_stale(easy_image: EasyImage) -> bool:
+    timeout = get_setting("BUILD_TIMEOUT")
+    return bool(
+        timeout
+        and easy_image.status_changed_date
+        and easy_image.status_changed_date < timezone.now() - timedelta(seconds=timeout)
+    )
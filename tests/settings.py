@@ -21,3 +21,12 @@ STORAGES = {
 
 USE_TZ = True
 SECRET_KEY = "test"
+
+TEMPLATES = [
+    {
+        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        "APP_DIRS": True,
+    }
+]
+
+ROOT_URLCONF = "tests.urls"
@@ -0,0 +1,104 @@
+import uuid
+
+import pytest
+from django.db.models import FileField
+from django.db.models.fields.files import FieldFile
+from django.test import override_settings
+
+from easy_images.cache import CachedImage, ImageCache, image_cache
+from easy_images.models import EasyImage, ImageStatus
+from easy_images.options import ParsedOptions
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    image_cache.clear()
+    yield
+    image_cache.clear()
+
+
+def _built(name="thumb.jpg"):
+    return EasyImage(
+        id=uuid.uuid4(),
+        status=ImageStatus.BUILT,
+        image=name,
+        width=10,
+        height=10,
+    )
+
+
+@override_settings(EASY_IMAGES={"CACHE_SIZE": 2})
+def test_lru():
+    cache = ImageCache()
+    first, second, third = _built(), _built(), _built()
+    cache.set(first)
+    cache.set(second)
+    assert cache.get(first.pk).image == "thumb.jpg"
+    # The least recently used entry is evicted.
+    cache.set(third)
+    assert len(cache) == 2
+    assert cache.get(second.pk) is None
+    assert cache.get(first.pk)
+    assert (cache.hits, cache.misses) == (2, 1)
+    assert cache.nbytes > 0
+    cache.evict(first.pk)
+    cache.evict(third.pk)
+    assert (len(cache), cache.nbytes) == (0, 0)
+
+
+def test_max_bytes():
+    images = [_built(), _built(), _built("a-much-longer-thumbnail-name.jpg")]
+    entry_size = ImageCache.entry_size(
+        images[0].pk.bytes, CachedImage.from_instance(images[0])
+    )
+    cache = ImageCache()
+    with override_settings(
+        EASY_IMAGES={"CACHE_SIZE": 10, "CACHE_MAX_BYTES": entry_size * 2}
+    ):
+        cache.set(images[0])
+        cache.set(images[1])
+        assert len(cache) == 2
+        # The larger entry only fits once both of the others are evicted.
+        cache.set(images[2])
+    assert list(cache.entries) == [images[2].pk.bytes]
+    assert cache.nbytes <= entry_size * 2
+
+
+def test_disabled():
+    cache = ImageCache()
+    image = _built()
+    cache.set(image)
+    assert cache.get(image.pk) is None
+    assert (len(cache), cache.misses) == (0, 0)
+
+
+@pytest.mark.django_db
+@override_settings(EASY_IMAGES={"CACHE_SIZE": 10})
+def test_from_file(django_assert_num_queries):
+    source = FieldFile(instance=EasyImage(), field=FileField(), name="test.jpg")
+    options = ParsedOptions(width=100)
+    image, created = EasyImage.objects.from_file(source, options)
+    # Unbuilt images aren't cached.
+    assert len(image_cache) == 0
+    EasyImage.objects.filter(pk=image.pk).update(
+        image="built.jpg", width=100, height=100
+    )
+    EasyImage.objects.from_file(source, options)
+    assert len(image_cache) == 1
+    with django_assert_num_queries(0):
+        cached, created = EasyImage.objects.from_file(source, options)
+    assert not created
+    assert (cached.pk, cached.image.name, cached.width) == (image.pk, "built.jpg", 100)
+    # The fields that aren't cached are fetched if used, and aren't overwritten
+    # when saved.
+    EasyImage.objects.filter(pk=image.pk).update(error_count=2)
+    cached.image_url = "/built.jpg"
+    cached.save()
+    saved = EasyImage.objects.get(pk=image.pk)
+    assert (saved.error_count, saved.created) == (2, image.created)
+    assert saved.image_url == "/built.jpg"
+    assert cached.error_count == 2
+    # Saving the image evicts it from the cache.
+    image_cache.set(saved)
+    image.save()
+    assert len(image_cache) == 0
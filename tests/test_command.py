@@ -1,3 +1,4 @@
+from datetime import timedelta
 from io import StringIO
 from unittest import mock
 
@@ -6,8 +7,11 @@ from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import InMemoryUploadedFile, TemporaryUploadedFile
 from django.core.management import call_command
 from django.test import override_settings
+from django.utils import timezone
 
+import pyvips
 from easy_images.engine import vips_to_django
+from easy_images.management.process_queue import claim_batch, renew_claim
 from easy_images.models import EasyImage, ImageStatus, get_storage_name
 from pyvips import Image
 
@@ -109,6 +113,22 @@ Successfully built 4 <img> thumbnails
     )
 
 
+@pytest.mark.django_db
+def test_count_only():
+    EasyImage.objects.create(args={}, name="1")
+    EasyImage.objects.create(status=ImageStatus.SOURCE_ERROR, args={}, name="2")
+    EasyImage.objects.create(status=ImageStatus.SOURCE_TOO_LARGE, args={}, name="3")
+    test_output = StringIO()
+    call_command("build_img_queue", stdout=test_output, count_only=True)
+    assert test_output.getvalue() == (
+        """3 <img> thumbnails need building
+of which:
+  1 had source errors
+  1 had sources too large
+"""
+    )
+
+
 def _create_easyimage():
     image = Image.black(1000, 1000)
     file = vips_to_django(image, "test.jpg")
@@ -139,3 +159,152 @@ def test_build_via_memory():
     img.build()
     assert img.image
     assert (img.width, img.height) == (200, 200)
+
+
+@pytest.mark.django_db
+def test_build_stats():
+    _, file = _create_easyimage()
+    file.close()
+    test_output = StringIO()
+    call_command("build_img_queue", stdout=test_output)
+    lines = test_output.getvalue().splitlines()
+    assert lines[1] == "Successfully built 1 <img> thumbnail"
+    assert lines[2].startswith("1 builds in ")
+    assert [line.split(":")[0] for line in lines[3:]] == [
+        "  fetch",
+        "  load",
+        "  scale",
+        "  encode",
+        "  save",
+    ]
+
+
+@pytest.mark.django_db
+@override_settings(EASY_IMAGES={"VIPS": {"concurrency": 1, "build": {"cache_max": 50}}})
+def test_vips_settings():
+    cache_max, concurrency = pyvips.cache_get_max(), pyvips.concurrency_get()
+    test_output = StringIO()
+    try:
+        call_command("build_img_queue", stdout=test_output, verbosity=2)
+        assert pyvips.cache_get_max() == 50
+        assert pyvips.concurrency_get() == 1
+    finally:
+        pyvips.cache_set_max(cache_max)
+        pyvips.concurrency_set(concurrency)
+    assert test_output.getvalue().startswith(
+        "libvips settings: cache_max=50, cache_max_mem="
+    )
+
+
+@pytest.mark.django_db
+def test_batches():
+    for name in "1234":
+        EasyImage.objects.create(args={}, name=name)
+    test_output = StringIO()
+    with mock.patch(
+        "easy_images.models.EasyImage.build", autospec=True, return_value=True
+    ) as build:
+        call_command("build_img_queue", stdout=test_output, batch_size=3)
+    assert [call.args[0].name for call in build.call_args_list] == list("1234")
+    assert "Successfully built 4 <img> thumbnails" in test_output.getvalue()
+
+
+@pytest.mark.django_db
+def test_claim_batch():
+    first = EasyImage.objects.create(args={}, name="1")
+    EasyImage.objects.create(args={}, name="2")
+    third = EasyImage.objects.create(args={}, name="3")
+    queue = EasyImage.objects.queue_by_status()
+    batch, last = claim_batch(queue, size=1)
+    assert [image.name for image in batch] == ["1"]
+    assert last == (first.created, first.pk)
+    assert EasyImage.objects.get(pk=first.pk).status == ImageStatus.BUILDING
+    # Another worker claims the next image between selecting and claiming.
+    with mock.patch(
+        "easy_images.management.process_queue.QuerySet.update", return_value=0
+    ):
+        batch, last = claim_batch(queue, after=last, size=1)
+    assert batch == []
+    batch, last = claim_batch(queue, after=last, size=5)
+    assert [image.name for image in batch] == ["3"]
+    assert last == (third.created, third.pk)
+    assert claim_batch(queue, after=last) == ([], None)
+
+
+@pytest.mark.django_db
+def test_stopped_worker_releases_batch():
+    for name in "123":
+        EasyImage.objects.create(args={}, name=name)
+
+    def build(easy_image, force=False):
+        if easy_image.name == "2":
+            raise KeyboardInterrupt
+        EasyImage.objects.filter(pk=easy_image.pk).update(
+            image="built.jpg", status=ImageStatus.BUILT
+        )
+        return True
+
+    with mock.patch("easy_images.models.EasyImage.build", autospec=True) as patched:
+        patched.side_effect = build
+        with pytest.raises(KeyboardInterrupt):
+            call_command("build_img_queue", stdout=StringIO())
+    # The unbuilt images of the claimed batch are queued again.
+    assert dict(EasyImage.objects.values_list("name", "status")) == {
+        "1": ImageStatus.BUILT,
+        "2": ImageStatus.QUEUED,
+        "3": ImageStatus.QUEUED,
+    }
+
+
+@pytest.mark.django_db
+def test_taken_over_images_skipped():
+    for name in "123":
+        EasyImage.objects.create(args={}, name=name)
+    taken_over = timezone.now() + timedelta(seconds=1)
+
+    def build(easy_image, force=False):
+        if easy_image.name == "1":
+            # Another worker takes over the rest of the batch as abandoned, then
+            # this worker is stopped.
+            EasyImage.objects.filter(name="2").update(status_changed_date=taken_over)
+            raise KeyboardInterrupt
+        return True
+
+    with mock.patch("easy_images.models.EasyImage.build", autospec=True) as patched:
+        patched.side_effect = build
+        with pytest.raises(KeyboardInterrupt):
+            call_command("build_img_queue", stdout=StringIO())
+    # Only the images still claimed by this worker are queued again.
+    assert dict(EasyImage.objects.values_list("name", "status")) == {
+        "1": ImageStatus.QUEUED,
+        "2": ImageStatus.BUILDING,
+        "3": ImageStatus.QUEUED,
+    }
+
+    # Each image is marked as building again just before it's built, unless it was
+    # taken over while it waited.
+    EasyImage.objects.filter(name="2").update(status=ImageStatus.QUEUED)
+    batch, _ = claim_batch(EasyImage.objects.queue_by_status())
+    EasyImage.objects.filter(name="2").update(status_changed_date=taken_over)
+    assert [renew_claim(image) for image in batch] == [True, False, True]
+    first = EasyImage.objects.get(name="1")
+    assert first.status_changed_date == batch[0].status_changed_date
+
+
+@pytest.mark.django_db
+def test_stale_building_requeued():
+    stale = EasyImage.objects.create(
+        args={},
+        name="stale",
+        status=ImageStatus.BUILDING,
+        status_changed_date=timezone.now() - timedelta(hours=1),
+    )
+    EasyImage.objects.create(
+        args={},
+        name="building",
+        status=ImageStatus.BUILDING,
+        status_changed_date=timezone.now(),
+    )
+    assert list(EasyImage.objects.queue()) == [stale]
+    with override_settings(EASY_IMAGES={"BUILD_TIMEOUT": None}):
+        assert not EasyImage.objects.queue().exists()
@@ -1,10 +1,24 @@
 import pytest
-from django.db.models import F, FileField, Value
+from django.db.models import FileField
 from django.db.models.fields.files import FieldFile
-from django.db.models.functions import Concat
+from django.test import override_settings
 
-from easy_images.core import Img
-from easy_images.models import EasyImage
+from easy_images.cache import image_cache
+from easy_images.core import Img, transparent_gif
+from easy_images.models import EasyImage, ImageStatus, SourceImage
+
+
+def fake_build():
+    """
+    Mark every version as built, with an image named from its mimetype and width.
+    """
+    for image in EasyImage.objects.all():
+        width = image.args["width"]
+        EasyImage.objects.filter(pk=image.pk).update(
+            image=f"{image.args['mimetype']}{width}.image",
+            width=width,
+            height=int(width / image.args["ratio"]),
+        )
 
 
 @pytest.mark.django_db
@@ -12,13 +26,9 @@ def test_as_html():
     generator = Img(width=100)
     source = FieldFile(instance=EasyImage(), field=FileField(), name="test.jpg")
     assert generator(source).as_html() == '<img src="/test.jpg" alt="">'
-    EasyImage.objects.update(
-        image=Concat(F("args__mimetype"), F("args__width"), Value(".image")),
-        width=800,
-        height=600,
-    )
+    fake_build()
     assert generator(source).as_html() == (
-        '<img src="/image/jpeg100.image" srcset="/image/avif100.image, /image/avif200.image 2x" alt="">'
+        '<img src="/image/jpeg100.image" srcset="/image/avif100.image, /image/avif200.image 2x" width="100" height="56" alt="">'
     )
 
 
@@ -27,13 +37,225 @@ def test_sizes():
     generator = Img(width=200, sizes={800: 100})
     source = FieldFile(instance=EasyImage(), field=FileField(), name="test.jpg")
     assert generator(source).as_html() == '<img src="/test.jpg" alt="">'
-    EasyImage.objects.update(
-        image=Concat(F("args__mimetype"), F("args__width"), Value(".image")),
-        width=800,
-        height=600,
-    )
+    fake_build()
     assert generator(source).as_html() == (
         '<img src="/image/jpeg200.image"'
         ' srcset="/image/avif100.image 100w, /image/avif200.image 200w, /image/avif400.image 400w"'
-        ' sizes="(max-width: 800px) 100px, 200px" alt="">'
+        ' sizes="(max-width: 800px) 100px, 200px" width="200" height="112" alt="">'
+    )
+
+
+@pytest.mark.django_db
+def test_upscale_off():
+    source = FieldFile(instance=EasyImage(), field=FileField(), name="small.jpg")
+    SourceImage.objects.create(
+        id=SourceImage.objects.key(name="small.jpg", storage="default"),
+        storage="default",
+        name="small.jpg",
+        width=300,
+        height=200,
+        format="jpeg",
+    )
+    # The 2x version is larger than the source, so a 1.5x version is used instead.
+    generator = Img(width=200, upscale=False)
+    generator(source)
+    fake_build()
+    assert generator(source).as_html() == (
+        '<img src="/image/jpeg200.image"'
+        ' srcset="/image/avif200.image, /image/avif300.image 1.5x" width="200" height="112" alt="">'
+    )
+    generator = Img(width=200, sizes={800: 100}, upscale=False)
+    generator(source)
+    fake_build()
+    assert generator(source).as_html() == (
+        '<img src="/image/jpeg200.image"'
+        ' srcset="/image/avif100.image 100w, /image/avif200.image 200w, /image/avif300.image 300w"'
+        ' sizes="(max-width: 800px) 100px, 200px" width="200" height="112" alt="">'
+    )
+    # Versions the builder skipped are left out.
+    EasyImage.objects.filter(option_set__args__width=300).update(
+        image="", status=ImageStatus.SKIPPED
+    )
+    assert generator(source).as_html() == (
+        '<img src="/image/jpeg200.image"'
+        ' srcset="/image/avif100.image 100w, /image/avif200.image 200w"'
+        ' sizes="(max-width: 800px) 100px, 200px" width="200" height="112" alt="">'
+    )
+
+
+@pytest.mark.django_db
+def test_dimensions():
+    source = FieldFile(instance=EasyImage(), field=FileField(), name="test.jpg")
+    # Versions that aren't cropped are only sized once built.
+    generator = Img(width=100, crop=False, densities=[])
+    assert generator(source).as_html() == '<img src="/test.jpg" alt="">'
+    EasyImage.objects.update(image="built.jpg", width=100, height=75)
+    assert generator(source).as_html() == (
+        '<img src="/built.jpg" srcset="/built.jpg" width="100" height="75" alt="">'
+    )
+    # Explicit dimensions are kept.
+    generator = Img(width=100, densities=[], img_attrs={"width": "50"})
+    assert generator(source).as_html() == '<img width="50" src="/test.jpg" alt="">'
+
+
+@pytest.mark.django_db
+def test_dimensions_of_original():
+    source = FieldFile(instance=EasyImage(), field=FileField(), name="portrait.jpg")
+    generator = Img(width=100, densities=[])
+    # The original file isn't the size of the cropped version, so it's only sized
+    # once its aspect ratio is known.
+    assert generator(source).as_html() == '<img src="/portrait.jpg" alt="">'
+    record = SourceImage.objects.create(
+        id=SourceImage.objects.key(name="portrait.jpg", storage="default"),
+        storage="default",
+        name="portrait.jpg",
+        width=300,
+        height=400,
+        format="jpeg",
+    )
+    assert generator(source).as_html() == (
+        '<img src="/portrait.jpg" width="100" height="133" alt="">'
+    )
+    # Browsers rotate the original by its EXIF orientation.
+    SourceImage.objects.filter(pk=record.pk).update(orientation=6)
+    assert generator(source).as_html() == (
+        '<img src="/portrait.jpg" width="100" height="75" alt="">'
+    )
+    # An on demand URL is for the cropped version itself.
+    with override_settings(EASY_IMAGES={"ON_DEMAND": True}):
+        html = generator(source).as_html()
+    assert html.endswith('" width="100" height="56" alt="">')
+
+
+@pytest.mark.django_db
+@override_settings(EASY_IMAGES={"LOADING": "lazy", "DECODING": "async"})
+def test_loading_and_decoding():
+    source = FieldFile(instance=EasyImage(), field=FileField(), name="test.jpg")
+    assert Img(width=100)(source).as_html() == (
+        '<img src="/test.jpg" alt="" loading="lazy" decoding="async">'
+    )
+    assert Img(width=100, loading="eager", decoding=None)(source).as_html() == (
+        '<img src="/test.jpg" alt="" loading="eager">'
+    )
+
+
+@pytest.mark.django_db
+@override_settings(EASY_IMAGES={"URL_TEMPLATE": "https://cdn.example.com/{name}"})
+def test_url_template():
+    generator = Img(width=100, densities=[])
+    source = FieldFile(instance=EasyImage(), field=FileField(), name="test.jpg")
+    generator(source)
+    fake_build()
+    assert generator(source).as_html() == (
+        '<img src="https://cdn.example.com/image/jpeg100.image"'
+        ' srcset="https://cdn.example.com/image/avif100.image" width="100" height="56" alt="">'
+    )
+
+
+@pytest.mark.django_db
+def test_as_picture_html():
+    generator = Img(width=100, formats=["avif", "webp"])
+    source = FieldFile(instance=EasyImage(), field=FileField(), name="test.jpg")
+    bound = generator(source)
+    assert list(bound.sources) == ["image/avif", "image/webp"]
+    assert bound.as_picture_html() == '<picture><img src="/test.jpg" alt=""></picture>'
+    # base jpg, avif 1x & 2x, webp 1x & 2x
+    assert EasyImage.objects.count() == 5
+    fake_build()
+    assert generator(source).as_picture_html() == (
+        "<picture>"
+        '<source type="image/avif" srcset="/image/avif100.image, /image/avif200.image 2x">'
+        '<source type="image/webp" srcset="/image/webp100.image, /image/webp200.image 2x">'
+        '<img src="/image/jpeg100.image" width="100" height="56" alt="">'
+        "</picture>"
+    )
+    # The <img> uses the first format.
+    assert generator(source).as_html() == (
+        '<img src="/image/jpeg100.image" srcset="/image/avif100.image, /image/avif200.image 2x" width="100" height="56" alt="">'
+    )
+
+
+@pytest.mark.django_db
+def test_placeholder():
+    generator = Img(width=100, densities=[], img_attrs={"style": "width:100%;"})
+    source = FieldFile(instance=EasyImage(), field=FileField(), name="test.jpg")
+    generator(source)
+    EasyImage.objects.filter(option_set__args__mimetype="image/jpeg").update(
+        image="base.jpg", width=100, height=56, placeholder="#c86432"
+    )
+    assert generator(source).as_html() == (
+        '<img style="width:100%;background-color:#c86432" src="/base.jpg"'
+        ' width="100" height="56" alt="">'
+    )
+    # An inline script to remove the placeholder once loaded is opt-in.
+    with override_settings(EASY_IMAGES={"PLACEHOLDER_ONLOAD": True}):
+        assert (
+            generator(source)
+            .as_html()
+            .endswith(' alt="" onload="this.style.background=null">')
+        )
+
+
+@pytest.mark.django_db
+@override_settings(EASY_IMAGES={"PLACEHOLDER": "color"})
+def test_source_placeholder():
+    source = FieldFile(instance=EasyImage(), field=FileField(), name="test.jpg")
+    generator = Img(width=100, densities=[])
+    assert "style" not in generator(source).as_html()
+    # Nothing is built, but another version recorded a placeholder for the source.
+    SourceImage.objects.create(
+        id=SourceImage.objects.key(name="test.jpg", storage="default"),
+        storage="default",
+        name="test.jpg",
+        width=400,
+        height=300,
+        format="jpeg",
+        placeholder="#c86432",
+    )
+    assert generator(source).as_html() == (
+        '<img src="/test.jpg" width="100" height="75" alt=""'
+        ' style="background-color:#c86432">'
+    )
+
+
+@pytest.mark.django_db
+@override_settings(EASY_IMAGES={"FALLBACK": ["closest", "placeholder"]})
+def test_fallback():
+    source = FieldFile(instance=EasyImage(), field=FileField(), name="test.jpg")
+    Img(width=200)(source)
+    Img(width=400)(source)
+    Img(width=600, ratio="square")(source)
+    # Nothing is built yet, so a transparent placeholder is used.
+    assert Img(width=100)(source).base_url() == transparent_gif
+    assert not Img(width=100)(source).as_html().startswith('<img src="/test.jpg"')
+    # Otherwise the closest larger built JPEG of the same shape is used.
+    for image in EasyImage.objects.exclude(option_set__args__width=100):
+        args = image.args
+        extension = args["mimetype"].split("/")[1]
+        EasyImage.objects.filter(pk=image.pk).update(
+            image=f"{args['width']}-{args['ratio']:.2f}.{extension}",
+            width=args["width"],
+            height=int(args["width"] / args["ratio"]),
+        )
+    assert Img(width=100)(source).base_url() == "/200-1.78.jpeg"
+    assert Img(width=300)(source).base_url() == "/400-1.78.jpeg"
+    assert Img(width=500)(source).base_url() == "/400-1.78.jpeg"
+    assert Img(width=500, ratio="square")(source).base_url() == "/600-1.00.jpeg"
+
+
+@pytest.mark.django_db
+@override_settings(EASY_IMAGES={"FALLBACK": "closest", "CACHE_SIZE": 10})
+def test_fallback_cached():
+    image_cache.clear()
+    source = FieldFile(instance=EasyImage(), field=FileField(), name="test.jpg")
+    Img(width=200)(source)
+    EasyImage.objects.filter(option_set__args__mimetype="image/jpeg").update(
+        image="200.jpg", width=200, height=112
     )
+    assert Img(width=100)(source).base_url() == "/200.jpg"
+    # The closest version is remembered for a while, rather than looked up on every
+    # render.
+    EasyImage.objects.update(image="")
+    assert Img(width=100)(source).base_url() == "/200.jpg"
+    image_cache.clear()
+    assert Img(width=100)(source).base_url() == "/test.jpg"
@@ -1,11 +1,26 @@
 import tempfile
 from pathlib import Path
 
+import pytest
 from django.core.files.uploadedfile import (
     SimpleUploadedFile,
 )
+from django.test import override_settings
 
-from easy_images.engine import efficient_load
+import pyvips
+from easy_images.engine import (
+    SourceTooLarge,
+    check_source,
+    efficient_load,
+    encoder_options,
+    page_height,
+    placeholder,
+    scale_image,
+    search_quality,
+    source_info,
+    vips_options,
+    vips_to_django,
+)
 from easy_images.options import ParsedOptions
 from pyvips import Image
 
@@ -46,8 +61,133 @@ def test_efficient_load():
         assert (e_image.width, e_image.height) == (1000, 1000)
 
 
+def animation(frames=4, width=200, height=100) -> bytes:
+    pages = [
+        (Image.black(width, height) + [i * 60, 0, 0]).cast("uchar")
+        for i in range(frames)
+    ]
+    strip = Image.arrayjoin(pages, across=1).copy(interpretation="srgb")
+    strip.set_type(pyvips.GValue.gint_type, "page-height", height)
+    return strip.write_to_buffer(".gif")
+
+
+def test_efficient_load_animation():
+    file = SimpleUploadedFile("test.gif", animation())
+    e_image = efficient_load(file, [ParsedOptions(width=50, ratio="video")])
+    assert (e_image.width, e_image.height) == (200, 400)
+    assert page_height(e_image) == 100
+
+
+def test_efficient_load_animation_budget():
+    file = SimpleUploadedFile("test.gif", animation())
+    with override_settings(EASY_IMAGES={"ANIMATION_MAX_FRAMES": 3}):
+        e_image = efficient_load(file, [ParsedOptions(width=50, ratio="video")])
+    assert (e_image.width, e_image.height) == (200, 100)
+    with override_settings(EASY_IMAGES={"ANIMATION_MAX_PIXELS": 200 * 100 * 3}):
+        e_image = efficient_load(file, [ParsedOptions(width=50, ratio="video")])
+    assert (e_image.width, e_image.height) == (200, 100)
+
+
+def test_check_source():
+    image = source_info(Image.new_from_buffer(animation(frames=3), ""))
+    check_source(image, 1000)
+    with override_settings(EASY_IMAGES={"MAX_SOURCE_BYTES": 999}), pytest.raises(
+        SourceTooLarge
+    ):
+        check_source(image, 1000)
+    with override_settings(EASY_IMAGES={"MAX_SOURCE_PIXELS": 200 * 99}), pytest.raises(
+        SourceTooLarge
+    ):
+        check_source(image)
+    with override_settings(EASY_IMAGES={"MAX_SOURCE_FRAMES": 2}), pytest.raises(
+        SourceTooLarge
+    ):
+        check_source(image)
+    with override_settings(EASY_IMAGES={"MAX_SOURCE_FRAMES": None}):
+        check_source(image)
+
+
+def test_scale_animation():
+    image = Image.new_from_buffer(animation(), "", n=-1)
+    scaled = scale_image(image, (50, 50), crop=True)
+    assert (scaled.width, scaled.height) == (50, 200)
+    assert page_height(scaled) == 50
+    # Each frame is cropped separately.
+    reds = [scaled.crop(0, i * 50, 50, 50)[0].avg() for i in range(4)]
+    assert reds == sorted(set(reds))
+    scaled = scale_image(image, (100, 20))
+    assert (scaled.width, scaled.height) == (100, 200)
+    assert page_height(scaled) == 50
+
+
 def test_efficient_load_from_memory():
     image = Image.black(1000, 1000)
     file = SimpleUploadedFile("test.jpg", image.write_to_buffer(".jpg[Q=90]"))
     e_image = efficient_load(file, [ParsedOptions(width=100, ratio="video")])
     assert (e_image.width, e_image.height) == (500, 500)
+
+
+@override_settings(
+    EASY_IMAGES={
+        "ENCODER": {"avif": {"effort": 4, "strip": True}},
+        "PROFILES": {"fast": {"avif": {"effort": 0}}},
+    }
+)
+def test_encoder_options():
+    assert encoder_options("image/avif") == {"effort": 4, "strip": True}
+    assert encoder_options("image/avif", "fast") == {"effort": 0, "strip": True}
+    assert encoder_options("image/jpeg", "fast") == {}
+    with pytest.raises(ValueError):
+        encoder_options("image/avif", "unknown")
+
+
+def test_vips_to_django_save_options():
+    image = Image.black(100, 100)
+    plain = vips_to_django(image, "test.jpg")
+    interlaced = vips_to_django(image, "test.jpg", interlace=True)
+    assert plain.read() != interlaced.read()
+
+
+def test_search_quality():
+    bands = [Image.perlin(300, 200, cell_size=size) for size in (16, 32, 64)]
+    image = ((bands[0].bandjoin(bands[1:]) + 1) * 127.5).cast("uchar")
+    sizes = {q: len(image.write_to_buffer(".jpg", Q=q)) for q in (30, 60, 90)}
+    quality, buffer = search_quality(image, ".jpg", sizes[60])
+    assert 60 <= quality < 90
+    assert len(buffer) <= sizes[60]
+    assert buffer == image.write_to_buffer(".jpg", Q=quality)
+    # Falls back to the lowest quality if nothing fits.
+    quality, buffer = search_quality(image, ".jpg", 100)
+    assert quality == 30
+    assert len(buffer) == sizes[30]
+
+
+def test_placeholder():
+    image = (Image.black(400, 300) + [200, 100, 50]).cast("uchar")
+    image = image.copy(interpretation="srgb")
+    assert placeholder(image, "color") == "#c86432"
+    lqip = placeholder(image, "lqip")
+    assert lqip.startswith("data:image/webp;base64,")
+    assert len(lqip) < 1000
+    assert placeholder(Image.black(10, 10), "color") == "#000000"
+
+
+@override_settings(
+    EASY_IMAGES={
+        "VIPS": {"cache_max": 10, "concurrency": 2, "build": {"concurrency": 0}}
+    }
+)
+def test_vips_options():
+    assert vips_options() == {"cache_max": 10, "concurrency": 2}
+    assert vips_options("build") == {"cache_max": 10, "concurrency": 0}
+
+
+@override_settings(EASY_IMAGES={"VIPS": {"cache_max": 42}})
+def test_vips_configured_on_first_load(monkeypatch):
+    monkeypatch.setattr("easy_images.engine._vips_configured", False)
+    cache_max = pyvips.cache_get_max()
+    try:
+        efficient_load(SimpleUploadedFile("test.gif", animation()), None)
+        assert pyvips.cache_get_max() == 42
+    finally:
+        pyvips.cache_set_max(cache_max)
@@ -0,0 +1,98 @@
+import random
+
+import pytest
+
+from easy_images.engine import _resize, scale_image
+from easy_images.geometry import scale_geometry, scale_geometry_batch
+from pyvips import Image
+
+
+def random_cases(count: int, seed: int = 1):
+    """
+    Random sources, targets and crop options (always as fractions, the way
+    ``ParsedOptions`` parses them).
+    """
+    rng = random.Random(seed)
+    for _ in range(count):
+        source = (rng.randint(1, 3000), rng.randint(1, 3000))
+        target = (rng.randint(1, 1500), rng.randint(1, 1500))
+        crop = rng.choice([None, (0.5, 0.5), (0, 0), (1, 1), (rng.random(), 0.25)])
+        focal_window = None
+        if rng.random() < 0.4:
+            left, right = sorted(rng.random() for _ in range(2))
+            top, bottom = sorted(rng.random() for _ in range(2))
+            focal_window = (left, top, right, bottom)
+        yield source, target, crop, focal_window
+
+
+def test_matches_scale_image():
+    for source, target, crop, focal_window in random_cases(500):
+        geometry = scale_geometry(source, target, crop=crop, focal_window=focal_window)
+        # The crop box is always within the resized window (so every engine can crop
+        # it without padding).
+        left, top, width, height = geometry.box
+        assert left >= 0 and left + width <= geometry.resized[0]
+        assert top >= 0 and top + height <= geometry.resized[1]
+        img = Image.black(*source)
+        scaled = scale_image(img, target, crop=crop, focal_window=focal_window)
+        # libvips resizes the window to exactly the predicted size.
+        window = img.extract_area(*geometry.window)
+        resized = _resize(window, geometry.scale)
+        assert (resized.width, resized.height) == geometry.resized
+        assert (scaled.width, scaled.height) == geometry.size
+
+
+def test_tall_target_in_focal_window():
+    # The window is scaled to cover the target by both of its dimensions.
+    geometry = scale_geometry(
+        (1000, 1000), (100, 300), crop=True, focal_window=(0, 0, 0.5, 0.5)
+    )
+    assert geometry.window == (0, 0, 500, 500)
+    assert geometry.resized == (300, 300)
+    assert geometry.size == (100, 300)
+
+
+@pytest.mark.parametrize(
+    "crop, box",
+    [
+        (True, (100, 0, 200, 100)),
+        ((0, 0), (0, 0, 200, 100)),
+        ((1, 1), (200, 0, 200, 100)),
+        (None, (0, 0, 400, 100)),
+    ],
+)
+def test_crop_box(crop, box):
+    geometry = scale_geometry((800, 200), (200, 100), crop=crop)
+    assert geometry.scale == 0.5
+    assert geometry.resized == (400, 100)
+    assert geometry.box == box
+
+
+def test_focal_window():
+    geometry = scale_geometry(
+        (1000, 1000), (100, 100), crop=True, focal_window=(0.5, 0.5, 1, 1)
+    )
+    assert geometry.window == (500, 500, 500, 500)
+    assert geometry.resized == (100, 100)
+    assert geometry.box == (0, 0, 100, 100)
+
+
+def test_batch():
+    np = pytest.importorskip("numpy")
+    cases = list(random_cases(2000, seed=2))
+    nan = float("nan")
+    batch = scale_geometry_batch(
+        np.array([case[0] for case in cases]),
+        np.array([case[1] for case in cases]),
+        np.array([case[2] or (nan, nan) for case in cases]),
+        np.array([case[3] or (nan,) * 4 for case in cases]),
+    )
+    for i, (source, target, crop, focal_window) in enumerate(cases):
+        geometry = scale_geometry(source, target, crop=crop, focal_window=focal_window)
+        assert tuple(batch.window[i]) == geometry.window
+        assert batch.scale[i] == geometry.scale
+        assert tuple(batch.resized[i]) == geometry.resized
+        assert tuple(batch.box[i]) == geometry.box
+    # Without crops or focal windows.
+    batch = scale_geometry_batch(np.array([[800, 200]]), np.array([[200, 100]]))
+    assert batch.box.tolist() == [[0, 0, 400, 100]]
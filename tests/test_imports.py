@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import subprocess
+import sys
+from pathlib import Path
+
+# Start Django and import every easy images module a web process might use.
+startup = """
+import django
+django.setup()
+import easy_images.core
+import easy_images.middleware
+import easy_images.models
+import easy_images.templatetags.easy_images
+import easy_images.urls
+import easy_images.views
+import sys
+assert "pyvips" not in sys.modules
+"""
+
+
+def imported_modules(code: str) -> set[str]:
+    """
+    Run some code in a new interpreter, returning the name of every module it
+    imported (from the ``-X importtime`` output).
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        check=True,
+        cwd=Path(__file__).parent.parent,
+        env={"DJANGO_SETTINGS_MODULE": "tests.settings", "PATH": ""},
+        text=True,
+    )
+    modules = set()
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:"):
+            modules.add(line.split("|")[-1].strip())
+    return modules
+
+
+def test_startup_does_not_import_pyvips():
+    modules = imported_modules(startup)
+    assert "easy_images.core" in modules
+    assert "pyvips" not in modules
+    assert "_libvips" not in modules
+
+
+def test_pillow_engine_does_not_import_pyvips():
+    modules = imported_modules(
+        startup
+        + """
+import easy_images.pillow_engine
+assert "pyvips" not in sys.modules
+"""
+    )
+    assert "easy_images.pillow_engine" in modules
@@ -1,15 +1,30 @@
+from datetime import timedelta
 from io import BytesIO
+from unittest import mock
+from uuid import uuid4
 
 import pytest
+from django.core.files.storage import FileSystemStorage
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db.models import FileField
+from django.db.models.fields.files import FieldFile
+from django.test import override_settings
+from django.utils import timezone
 
+from easy_images import engine
 from easy_images.core import Img
+from easy_images.management.process_queue import process_queue
 from easy_images.models import (
     EasyImage,
     ImageStatus,
+    OptionSet,
+    SourceImage,
     get_storage_name,
     pick_image_storage,
 )
+from easy_images.options import ParsedOptions
+from easy_images.signals import image_build_finished
+from pyvips import GValue
 from pyvips.vimage import Image
 from tests.easy_images_tests.models import Profile
 
@@ -44,6 +59,23 @@ def test_build_no_source():
     assert image.error_count == 1
 
 
+@pytest.mark.django_db
+@override_settings(EASY_IMAGES={"MAX_SOURCE_PIXELS": 500 * 500})
+def test_build_source_too_large():
+    storage = pick_image_storage()
+    name = storage.save(
+        "too_large.jpg", BytesIO(Image.black(1000, 1000).write_to_buffer(".jpg"))
+    )
+    image = EasyImage.objects.create(
+        args={"width": 100}, name=name, storage=get_storage_name(storage)
+    )
+    assert not image.build()
+    assert image.status == ImageStatus.SOURCE_TOO_LARGE
+    assert image.error_count == 0
+    # Sources that are too large aren't retried.
+    assert process_queue(retry=5) == 0
+
+
 @pytest.mark.django_db
 def test_build_from_filefield():
     image = Image.black(1000, 1000)
@@ -52,7 +84,7 @@ def test_build_from_filefield():
 
     thumb = thumbnail(profile.image)
     assert thumb.base_url() == "/profile-images/test.png"
-    assert thumb.as_html() == '<img src="/profile-images/test.png" alt="">'
+    assert thumb.as_html() == ('<img src="/profile-images/test.png" alt="">')
 
 
 @pytest.mark.django_db
@@ -63,4 +95,368 @@ def test_build_from_filefield_with_build():
 
     thumb = thumbnail(profile.image, build="src")
     assert thumb.base_url().endswith(".jpg")
-    assert thumb.as_html() == f'<img src="{thumb.base_url()}" alt="">'
+    assert thumb.as_html() == (
+        f'<img src="{thumb.base_url()}" width="200" height="112" alt="">'
+    )
+
+
+@pytest.mark.django_db
+def test_build_finished_signal():
+    storage = pick_image_storage()
+    name = storage.save(
+        "signal.jpg", BytesIO(Image.black(500, 500).write_to_buffer(".jpg"))
+    )
+    image = EasyImage.objects.create(
+        args={"width": 100, "ratio": 1}, name=name, storage=get_storage_name(storage)
+    )
+    handler = mock.MagicMock()
+    image_build_finished.connect(handler)
+    try:
+        assert image.build()
+    finally:
+        image_build_finished.disconnect(handler)
+    kwargs = handler.call_args.kwargs
+    assert kwargs["instance"] == image
+    assert set(kwargs["timings"]) == {"fetch", "load", "scale", "encode", "save"}
+    assert kwargs["source_bytes"] == storage.size(name)
+    assert kwargs["output_bytes"] == image.image.size
+    assert kwargs["loader"].startswith("jpegload")
+    assert image.build_timings is None
+
+
+@pytest.mark.django_db
+@override_settings(EASY_IMAGES={"RECORD_BUILD_TIMINGS": True})
+def test_build_timings_by_stage():
+    storage = pick_image_storage()
+    # A PNG source, which can't be shrunk while it's decoded.
+    name = storage.save(
+        "timed.png", BytesIO(Image.gaussnoise(2000, 2000).write_to_buffer(".png"))
+    )
+    image = EasyImage.objects.create(
+        args={"width": 100, "ratio": 1}, name=name, storage=get_storage_name(storage)
+    )
+    with mock.patch.object(
+        Image, "copy_memory", autospec=True, side_effect=Image.copy_memory
+    ) as copy_memory:
+        assert image.build()
+    # The source is decoded in the load stage and scaled in the scale stage, rather
+    # than when the lazy image is encoded.
+    assert copy_memory.call_count == 2
+    timings = image.build_timings
+    assert timings["encode"] < timings["load"]
+
+
+@pytest.mark.django_db
+@override_settings(EASY_IMAGES={"RECORD_BUILD_TIMINGS": True})
+def test_build_records_timings():
+    image = EasyImage.objects.create(
+        args={"width": 100},
+        name="notafile.jpg",
+        storage=get_storage_name(pick_image_storage()),
+    )
+    image.build()
+    image.refresh_from_db()
+    assert image.status == ImageStatus.SOURCE_ERROR
+    assert set(image.build_timings) == {"fetch"}
+
+
+@pytest.mark.django_db
+@override_settings(EASY_IMAGES={"DEDUPLICATE": True})
+def test_build_shares_duplicate_source():
+    storage = pick_image_storage()
+    content = Image.black(500, 500).write_to_buffer(".jpg")
+    images = [
+        EasyImage.objects.create(
+            args={"width": 100, "ratio": 1},
+            name=storage.save(name, BytesIO(content)),
+            storage=get_storage_name(storage),
+        )
+        for name in ("copy1.jpg", "copy2.jpg")
+    ]
+    assert images[0].build()
+    # The shared image's dimensions are copied rather than read from storage.
+    with mock.patch.object(
+        FileSystemStorage, "open", wraps=storage.open
+    ) as storage_open:
+        assert images[1].build()
+    assert [call.args[0] for call in storage_open.call_args_list] == ["copy2.jpg"]
+    assert images[1].status == ImageStatus.BUILT
+    assert images[1].image.name == images[0].image.name
+    assert images[1].content_hash == images[0].content_hash
+    assert (images[1].width, images[1].height) == (100, 100)
+
+
+@pytest.mark.django_db
+@override_settings(EASY_IMAGES={"DEDUPLICATE": True})
+def test_inline_build_shares_duplicate_source():
+    content = Image.black(1000, 1000).write_to_buffer(".png")
+    first = Profile.objects.create(
+        name="First", image=SimpleUploadedFile("first.png", content)
+    )
+    second = Profile.objects.create(
+        name="Second", image=SimpleUploadedFile("second.png", content)
+    )
+    assert thumbnail(first.image, build="src").base_url().endswith(".jpg")
+    second_thumb = thumbnail(second.image, build="src")
+    assert second_thumb.base_url() == thumbnail(first.image).base_url()
+
+
+@pytest.mark.django_db
+@override_settings(EASY_IMAGES={"STORE_URLS": True})
+def test_build_stores_url():
+    image = Image.black(1000, 1000)
+    file = SimpleUploadedFile("test.png", image.write_to_buffer(".png"))
+    profile = Profile.objects.create(name="Test", image=file)
+    thumbnail(profile.image, build="src")
+    base = EasyImage.objects.get(option_set__args__mimetype="image/jpeg")
+    assert base.image_url == base.image.url
+    with mock.patch.object(
+        FileSystemStorage, "url", side_effect=AssertionError("storage.url called")
+    ):
+        assert thumbnail(profile.image).base_url() == base.image_url
+
+
+@pytest.mark.django_db
+def test_build_encoder_profile():
+    image = Image.black(1000, 1000)
+    file = SimpleUploadedFile("test.jpg", image.write_to_buffer(".jpg"))
+    profile = Profile.objects.create(name="Test", image=file)
+    with mock.patch(
+        "easy_images.engine.vips_to_django", wraps=engine.vips_to_django
+    ) as vips_to_django:
+        thumbnail(profile.image, build="src")
+        with override_settings(EASY_IMAGES={"INLINE_PROFILE": "fast"}):
+            Img(width=150)(profile.image, build="src")
+        Img(width=100, profile="small")(profile.image, build="src")
+    # No profile is used by default.
+    assert vips_to_django.call_args_list[0].kwargs == {"quality": 80}
+    assert vips_to_django.call_args_list[1].kwargs == {
+        "quality": 80,
+        "optimize_coding": False,
+    }
+    assert vips_to_django.call_args_list[2].kwargs["trellis_quant"] is True
+
+
+@pytest.mark.django_db
+def test_build_auto_quality():
+    storage = pick_image_storage()
+    name = storage.save(
+        "auto.jpg", BytesIO(Image.black(500, 500).write_to_buffer(".jpg"))
+    )
+    image = EasyImage.objects.create(
+        args={"width": 100, "quality": "auto", "max_bytes": 2000, "profile": "small"},
+        name=name,
+        storage=get_storage_name(storage),
+    )
+    assert image.build()
+    assert 30 <= image.quality <= 95
+    assert image.image.size <= 2000
+
+
+@pytest.mark.django_db
+@override_settings(EASY_IMAGES={"PLACEHOLDER": "lqip"})
+def test_build_placeholder():
+    image = Image.black(1000, 1000)
+    file = SimpleUploadedFile("test.jpg", image.write_to_buffer(".jpg"))
+    profile = Profile.objects.create(name="Test", image=file)
+    thumb = thumbnail(profile.image, build="src")
+    assert thumb.base.placeholder.startswith("data:image/webp;base64,")
+    assert "background-image:url(data:image/webp;base64," in thumb.as_html()
+    # The placeholder is also recorded for the source, for versions not built yet.
+    assert SourceImage.objects.for_file(profile.image).placeholder == (
+        thumb.base.placeholder
+    )
+    # Versions that aren't scaled don't make placeholders.
+    unscaled = EasyImage.objects.create(
+        args={"width": 100}, name=profile.image.name, storage="default"
+    )
+    assert unscaled.build()
+    assert unscaled.placeholder == ""
+
+
+@pytest.mark.django_db
+def test_build_animation():
+    frames = [Image.black(200, 100) + i * 50 for i in range(3)]
+    strip = Image.arrayjoin(frames, across=1).cast("uchar").copy()
+    strip.set_type(GValue.gint_type, "page-height", 100)
+    storage = pick_image_storage()
+    name = storage.save("animated.gif", BytesIO(strip.write_to_buffer(".gif")))
+    webp = EasyImage.objects.create(
+        args={"width": 100, "ratio": 2, "mimetype": "image/webp"},
+        name=name,
+        storage=get_storage_name(storage),
+    )
+    assert webp.build()
+    assert (webp.width, webp.height) == (100, 50)
+    built = Image.new_from_buffer(webp.image.read(), "", n=-1)
+    assert built.get("n-pages") == 3
+    assert built.height == 150
+    jpeg = EasyImage.objects.create(
+        args={"width": 100, "ratio": 2},
+        name=name,
+        storage=get_storage_name(storage),
+    )
+    assert jpeg.build()
+    assert (jpeg.width, jpeg.height) == (100, 50)
+    assert Image.new_from_buffer(jpeg.image.read(), "").height == 50
+
+
+@pytest.mark.django_db
+def test_fallback_build():
+    image = Image.black(1000, 1000)
+    file = SimpleUploadedFile("test.jpg", image.write_to_buffer(".jpg"))
+    profile = Profile.objects.create(name="Test", image=file)
+    with override_settings(EASY_IMAGES={"FALLBACK": "build"}):
+        thumb = thumbnail(profile.image)
+        assert thumb.base_url().endswith(".jpg")
+        assert thumb.base_url() != profile.image.url
+    with override_settings(
+        EASY_IMAGES={"FALLBACK": "build", "FALLBACK_BUILD_MAX_BYTES": 10}
+    ):
+        thumb = Img(width=100)(profile.image)
+        assert thumb.base_url() == profile.image.url
+
+
+@pytest.mark.django_db
+def test_queue_uses_index():
+    for queryset in [
+        EasyImage.objects.queue(),
+        EasyImage.objects.queue(retry=2),
+        EasyImage.objects.filter(image=""),
+    ]:
+        assert "easy_images_queue" in queryset.explain()
+    # Each status of the queue is walked in order by seeking through the index,
+    # rather than scanning it and sorting the rows.
+    after = timezone.now()
+    queues = EasyImage.objects.queue_by_status(retry=2)
+    for queryset in queues + EasyImage.objects.queue_by_status(force=True):
+        plan = (
+            queryset.filter(created__gte=after)
+            .exclude(created=after, id__lte=uuid4())
+            .order_by("created", "id")
+            .explain()
+        )
+        assert "SEARCH" in plan
+        assert "easy_images_queue" in plan
+        assert "TEMP B-TREE" not in plan
+
+
+@pytest.mark.django_db
+def test_option_sets_shared():
+    first = EasyImage.objects.create(args={"width": 100}, name="1.jpg")
+    second = EasyImage.objects.create(args={"width": 100}, name="2.jpg")
+    other = EasyImage.objects.create(
+        args={"width": 100, "profile": "fast"}, name="3.jpg"
+    )
+    assert first.option_set_id == second.option_set_id
+    assert other.option_set_id != first.option_set_id
+    assert OptionSet.objects.count() == 2
+    assert EasyImage.objects.get(pk=other.pk).args == {"width": 100, "profile": "fast"}
+
+
+@pytest.mark.django_db
+def test_option_sets_created_once(
+    django_capture_on_commit_callbacks, django_assert_num_queries, monkeypatch
+):
+    # The test's transaction is rolled back, so don't keep its option sets.
+    monkeypatch.setattr("easy_images.models.committed_option_sets", set())
+    with django_capture_on_commit_callbacks(execute=True):
+        EasyImage.objects.create(args={"width": 101}, name="1.jpg")
+    # Once committed, an option set isn't looked up again for new images.
+    with django_assert_num_queries(1):
+        EasyImage.objects.create(args={"width": 101}, name="2.jpg")
+
+
+@pytest.mark.django_db
+def test_build_records_source():
+    storage = pick_image_storage()
+    name = storage.save(
+        "probed.jpg", BytesIO(Image.black(400, 300).write_to_buffer(".jpg"))
+    )
+    storage_name = get_storage_name(storage)
+    first = EasyImage.objects.create(
+        args={"width": 100}, name=name, storage=storage_name
+    )
+    assert first.build()
+    source = SourceImage.objects.get()
+    assert (source.width, source.height) == (400, 300)
+    assert (source.format, source.frames) == ("jpeg", 1)
+    assert source.size == storage.size(name)
+    assert source.mtime
+    # Later builds of the same source use the recorded details.
+    second = EasyImage.objects.create(
+        args={"width": 50}, name=name, storage=storage_name
+    )
+    with mock.patch("easy_images.engine.probe") as probe:
+        assert second.build()
+    probe.assert_not_called()
+    # A source replaced with one of the same size is only noticed (and probed again)
+    # once its details are older than SOURCE_RECHECK, going by its modified time.
+    day_ago = timezone.now() - timedelta(days=1, seconds=1)
+    SourceImage.objects.update(
+        mtime=source.mtime - timedelta(seconds=1), placeholder="#000000"
+    )
+
+    def rebuild(image):
+        EasyImage.objects.filter(pk=image.pk).update(image="")
+        image.refresh_from_db()
+        return image.build(force=True)
+
+    with mock.patch("easy_images.engine.probe", wraps=engine.probe) as probe:
+        assert rebuild(first)
+        probe.assert_not_called()
+        SourceImage.objects.update(probed=day_ago)
+        assert rebuild(first)
+        assert probe.call_count == 1
+        source = SourceImage.objects.get()
+        assert source.mtime == storage.get_modified_time(name)
+        assert source.placeholder == ""
+        # An unchanged (or unknown) modified time keeps the details and placeholder.
+        SourceImage.objects.update(probed=day_ago, placeholder="#000000")
+        assert rebuild(second)
+        with mock.patch("easy_images.models.modified_time", return_value=None):
+            SourceImage.objects.update(probed=day_ago)
+            assert rebuild(first)
+        assert probe.call_count == 1
+        assert SourceImage.objects.get().placeholder == "#000000"
+        # A changed size is always noticed.
+        SourceImage.objects.update(size=1)
+        assert rebuild(second)
+        assert probe.call_count == 2
+        assert SourceImage.objects.get().placeholder == ""
+
+
+@pytest.mark.django_db
+def test_build_skips_upscale():
+    storage = pick_image_storage()
+    name = storage.save(
+        "small.jpg", BytesIO(Image.black(100, 100).write_to_buffer(".jpg"))
+    )
+    image = EasyImage.objects.create(
+        args=ParsedOptions(width=200, ratio=1, upscale=False).to_dict(),
+        name=name,
+        storage=get_storage_name(storage),
+    )
+    assert not image.build()
+    assert image.status == ImageStatus.SKIPPED
+    assert not image.image
+    # Skipped versions aren't queued again.
+    assert process_queue(retry=5) == 0
+    # Unless an Img that allows upscaling asks for the same version.
+    file = FieldFile(instance=EasyImage(), field=FileField(storage=storage), name=name)
+    requeued, created = EasyImage.objects.from_file(
+        file, ParsedOptions(width=200, ratio=1)
+    )
+    assert created
+    assert requeued.pk == image.pk
+    assert requeued.status == ImageStatus.QUEUED
+    assert "upscale" not in requeued.args
+    requeued.delete()
+    # Upscaling is on by default.
+    image = EasyImage.objects.create(
+        args=ParsedOptions(width=200, ratio=1).to_dict(),
+        name=name,
+        storage=get_storage_name(storage),
+    )
+    assert image.build()
+    assert (image.width, image.height) == (200, 200)
@@ -50,3 +50,28 @@ def test_hash():
         ParsedOptions(quality=80).hash().hexdigest()
         == "cce6431a80fe3a84c7ea9f6c5293cbce4ed8848349bb0f2182eb6bb0d7a19f78"
     )
+
+
+def test_profile_hashed():
+    options = ParsedOptions(quality=80, profile="small")
+    assert options.profile == "small"
+    assert options.to_dict()["profile"] == "small"
+    assert "profile" not in ParsedOptions(quality=80).to_dict()
+    # Versions with different profiles are encoded differently, so aren't shared.
+    assert options.hash().hexdigest() != ParsedOptions(quality=80).hash().hexdigest()
+
+
+def test_upscale_not_hashed():
+    # Turning off upscaling doesn't rename existing versions.
+    options = ParsedOptions(width=100, ratio="video")
+    no_upscale = ParsedOptions(width=100, ratio="video", upscale=False)
+    assert no_upscale.to_dict()["upscale"] is False
+    assert no_upscale.hash().hexdigest() == options.hash().hexdigest()
+
+
+def test_auto_quality():
+    options = ParsedOptions(quality="auto", max_bytes="20000")
+    assert (options.quality, options.max_bytes) == ("auto", 20000)
+    assert options.to_dict()["max_bytes"] == 20000
+    with pytest.raises(ValueError):
+        ParsedOptions(quality="auto")
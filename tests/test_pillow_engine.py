@@ -0,0 +1,116 @@
+from io import BytesIO
+
+import pytest
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from PIL import Image as PILImage
+
+from easy_images.engine import get_engine, scale_image
+from easy_images.models import EasyImage, get_storage_name, pick_image_storage
+from easy_images.options import ParsedOptions
+from easy_images.pillow_engine import PillowEngine
+from pyvips import Image
+
+engine = PillowEngine()
+
+
+def jpeg(width: int, height: int, color=(200, 100, 50)) -> bytes:
+    buffer = BytesIO()
+    PILImage.new("RGB", (width, height), color).save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def test_load_reduces_jpeg():
+    file = SimpleUploadedFile("test.jpg", jpeg(1000, 1000))
+    img = engine.load(file, [ParsedOptions(width=100, ratio="video")])
+    assert img.size == (500, 500)
+    img = engine.load(file, [ParsedOptions(width=400, ratio="video")])
+    assert img.size == (1000, 1000)
+
+
+def test_load_palette_gif():
+    # Alternating black and white columns, which should average out to grey rather
+    # than keeping one of them (as nearest neighbour resizing would).
+    source = PILImage.new("P", (100, 100))
+    source.putpalette([0, 0, 0, 255, 255, 255])
+    for x in range(1, 100, 2):
+        source.paste(1, (x, 0, x + 1, 100))
+    buffer = BytesIO()
+    source.save(buffer, "GIF")
+    img = engine.load(SimpleUploadedFile("test.gif", buffer.getvalue()), None)
+    assert img.mode == "RGB"
+    red, _, _ = engine.scale(img, (10, 10)).getpixel((5, 5))
+    assert 100 < red < 155
+
+
+def test_load_16_bit_png():
+    buffer = BytesIO()
+    PILImage.new("I;16", (100, 100), 20000).save(buffer, "PNG")
+    img = engine.load(SimpleUploadedFile("test.png", buffer.getvalue()), None)
+    assert img.mode == "RGB"
+    assert img.getpixel((0, 0)) == (78, 78, 78)
+    encoded = PILImage.open(engine.encode(img, "test.jpg"))
+    assert all(abs(value - 78) <= 2 for value in encoded.getpixel((0, 0)))
+
+
+def test_probe():
+    info = engine.probe(SimpleUploadedFile("test.jpg", jpeg(300, 200)))
+    assert (info.width, info.height, info.format, info.frames) == (300, 200, "jpeg", 1)
+
+
+@pytest.mark.parametrize(
+    "target, options",
+    [
+        ((100, 56), {"crop": True}),
+        ((100, 56), {"crop": (0, 1)}),
+        ((100, 100), {}),
+        ((150, 40), {"crop": True, "focal_window": (0.2, 0.2, 0.8, 0.8)}),
+        ((300, 250), {"crop": True, "focal_window": (0.2, 0.2, 0.8, 0.8)}),
+        ((10, 10), {"crop": True, "focal_window": (0.2, 0.2, 0.8, 0.8)}),
+        ((50, 150), {"crop": (0, 0), "focal_window": (0, 0, 0.5, 0.5)}),
+    ],
+)
+def test_scale_matches_vips(target, options):
+    scaled = engine.scale(PILImage.new("RGB", (400, 300)), target, **options)
+    vips_scaled = scale_image(Image.black(400, 300), target, **options)
+    assert scaled.size == (vips_scaled.width, vips_scaled.height)
+
+
+def test_encode():
+    img = PILImage.new("RGBA", (100, 50), (200, 100, 50, 255))
+    for name, image_format in [
+        ("test.jpg", "JPEG"),
+        ("test.webp", "WEBP"),
+        ("test.avif", "AVIF"),
+    ]:
+        file = engine.encode(img, name, quality=60, effort=4)
+        encoded = PILImage.open(file)
+        assert (encoded.format, encoded.size) == (image_format, (100, 50))
+    quality, file = engine.encode_to_fit(img, "test.jpg", 100_000)
+    assert quality >= 90
+    assert file.size <= 100_000
+
+
+def test_placeholder():
+    img = PILImage.new("RGB", (400, 300), (200, 100, 50))
+    assert engine.placeholder(img, "color") == "#c86432"
+    assert engine.placeholder(img, "lqip").startswith("data:image/webp;base64,")
+
+
+@pytest.mark.django_db
+@override_settings(EASY_IMAGES={"ENGINE": "easy_images.pillow_engine.PillowEngine"})
+def test_build():
+    assert isinstance(get_engine(), PillowEngine)
+    storage = pick_image_storage()
+    name = storage.save("pillow.jpg", BytesIO(jpeg(1000, 800)))
+    image = EasyImage.objects.create(
+        args=ParsedOptions(
+            width=200, ratio=2, crop=True, mimetype="image/webp"
+        ).to_dict(),
+        name=name,
+        storage=get_storage_name(storage),
+    )
+    assert image.build()
+    assert (image.width, image.height) == (200, 100)
+    built = PILImage.open(image.image)
+    assert (built.format, built.size) == ("WEBP", (200, 100))
@@ -0,0 +1,205 @@
+from datetime import timedelta
+from io import StringIO
+from uuid import uuid4
+
+import pytest
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db.models import FileField
+from django.db.models.fields.files import FieldFile
+from django.utils import timezone
+
+from easy_images.management.prune import iter_filenames, sweep_orphans
+from easy_images.models import (
+    ArchivedImage,
+    EasyImage,
+    ImageStatus,
+    SourceImage,
+    get_storage_name,
+    pick_image_storage,
+)
+from easy_images.options import ParsedOptions
+
+storage_name = get_storage_name(default_storage)
+
+
+def version(name: str, image: str = "", **kwargs) -> EasyImage:
+    if image:
+        kwargs.update(status=ImageStatus.BUILT, width=10, height=10)
+    return EasyImage.objects.create(
+        args=kwargs.pop("args", {"width": 10}),
+        name=name,
+        storage=storage_name,
+        image=image,
+        status_changed_date=kwargs.pop("status_changed_date", timezone.now()),
+        **kwargs,
+    )
+
+
+@pytest.mark.django_db
+def test_prune_missing_sources():
+    image_storage = pick_image_storage()
+    source = default_storage.save("prune/source.jpg", ContentFile(b"source"))
+    shared = image_storage.save("img/thumbs/shared.jpg", ContentFile(b"thumb"))
+    only = image_storage.save("img/thumbs/only.jpg", ContentFile(b"thumb"))
+    kept = version(source, shared)
+    version("prune/gone.jpg", shared)
+    version("prune/gone.jpg", only, args={"width": 20})
+    version("prune/missing/gone.jpg")
+    for name in (source, "prune/gone.jpg"):
+        SourceImage.objects.create(
+            id=SourceImage.objects.key(name=name, storage=storage_name),
+            storage=storage_name,
+            name=name,
+            width=10,
+            height=10,
+            format="jpeg",
+        )
+    test_output = StringIO()
+    # Pages of one source at a time, deleting as it goes.
+    call_command("prune_img_versions", stdout=test_output, batch_size=1)
+    assert test_output.getvalue() == "Deleted 3 <img> versions of missing sources\n"
+    assert list(EasyImage.objects.values_list("pk", flat=True)) == [kept.pk]
+    assert image_storage.exists(shared)
+    assert not image_storage.exists(only)
+    assert list(SourceImage.objects.values_list("name", flat=True)) == [source]
+
+
+@pytest.mark.django_db
+def test_prune_unlisted_directories(monkeypatch):
+    def listdir(path):
+        raise PermissionError(path)
+
+    monkeypatch.setattr(default_storage, "listdir", listdir)
+    version("prune/locked/source.jpg")
+    EasyImage.objects.create(
+        args={"width": 10}, name="source.jpg", storage="removed-storage"
+    )
+    test_output, test_errors = StringIO(), StringIO()
+    call_command("prune_img_versions", stdout=test_output, stderr=test_errors)
+    # Sources in directories that can't be listed aren't treated as missing.
+    assert test_output.getvalue() == "Deleted 0 <img> versions of missing sources\n"
+    assert EasyImage.objects.count() == 2
+    assert test_errors.getvalue() == (
+        "Skipped prune/locked in the default storage, which couldn't be listed\n"
+        "Skipped . in the removed-storage storage, which couldn't be listed\n"
+    )
+
+
+@pytest.mark.django_db
+def test_prune_errors():
+    source = default_storage.save("prune/errors.jpg", ContentFile(b"source"))
+    old = timezone.now() - timedelta(days=10)
+    version(source, status=ImageStatus.SOURCE_ERROR, status_changed_date=old)
+    recent = version(source, status=ImageStatus.BUILD_ERROR, args={"width": 20})
+    queued = version(source, status_changed_date=old, args={"width": 30})
+    test_output = StringIO()
+    call_command("prune_img_versions", stdout=test_output, errors=7)
+    assert "Deleted 1 <img> versions with errors" in test_output.getvalue()
+    assert set(EasyImage.objects.values_list("pk", flat=True)) == {
+        recent.pk,
+        queued.pk,
+    }
+
+
+@pytest.mark.django_db
+def test_archive():
+    name = default_storage.save("prune/archive.jpg", ContentFile(b"source"))
+    file = FieldFile(instance=EasyImage(), field=FileField(), name=name)
+    options = ParsedOptions(width=10)
+    image_storage = pick_image_storage()
+    archived = image_storage.save("img/thumbs/archived.jpg", ContentFile(b"thumb"))
+    recent = image_storage.save("img/thumbs/recent.jpg", ContentFile(b"thumb"))
+    old = timezone.now() - timedelta(days=100)
+    built = version(
+        name,
+        archived,
+        args=options.to_dict(),
+        status_changed_date=old,
+        placeholder="#c86432",
+        image_url="/media/archived.jpg",
+        quality=80,
+    )
+    version(name, recent, args={"width": 20})
+    # Built long ago, but still being used.
+    used = version(
+        name, recent, args={"width": 30}, status_changed_date=old, last_used=old
+    )
+    EasyImage.objects.from_file(file, ParsedOptions(width=30))
+    used.refresh_from_db()
+    assert used.last_used > old
+    test_output = StringIO()
+    call_command("prune_img_versions", stdout=test_output, archive=90)
+    assert "Archived 1 <img> versions" in test_output.getvalue()
+    assert not EasyImage.objects.filter(pk=built.pk).exists()
+    assert ArchivedImage.objects.get().pk == built.pk
+    assert EasyImage.objects.filter(pk=used.pk).exists()
+
+    # The archived version is restored when it is next requested.
+    restored, created = EasyImage.objects.from_file(file, options)
+    assert not created
+    assert restored.pk == built.pk
+    assert restored.status == ImageStatus.BUILT
+    assert restored.image.name == archived
+    assert (restored.width, restored.height) == (10, 10)
+    assert restored.placeholder == "#c86432"
+    assert restored.image_url == "/media/archived.jpg"
+    assert restored.quality == 80
+    assert restored.last_used
+    assert not ArchivedImage.objects.exists()
+
+
+@pytest.mark.django_db
+def test_sweep_orphans():
+    image_storage = pick_image_storage()
+    for name in image_storage.listdir("img/thumbs")[1]:
+        image_storage.delete(f"img/thumbs/{name}")
+    used = image_storage.save("img/thumbs/used.jpg", ContentFile(b"thumb"))
+    archived = image_storage.save("img/thumbs/archived.jpg", ContentFile(b"thumb"))
+    orphan = image_storage.save("img/thumbs/orphan.jpg", ContentFile(b"thumb"))
+    version("sweep.jpg", used)
+    ArchivedImage.objects.create(
+        id=uuid4(), storage="default", name="a", image=archived
+    )
+    test_output = StringIO()
+    call_command("sweep_img_orphans", stdout=test_output)
+    # The orphan is too new to be swept.
+    assert test_output.getvalue() == "Deleted 0 orphaned <img> files\n"
+    test_output = StringIO()
+    call_command(
+        "sweep_img_orphans", stdout=test_output, min_age=0, batch_size=1, dry_run=True
+    )
+    assert test_output.getvalue() == f"{orphan}\nFound 1 orphaned <img> files\n"
+    assert image_storage.exists(orphan)
+    # Orphans are yielded as they're found rather than collected.
+    orphans = sweep_orphans(min_age=timedelta(0), dry_run=True)
+    assert next(orphans) == orphan
+    assert list(orphans) == []
+    call_command("sweep_img_orphans", stdout=StringIO(), min_age=0)
+    assert not image_storage.exists(orphan)
+    assert image_storage.exists(used)
+    assert image_storage.exists(archived)
+
+
+def test_iter_filenames(monkeypatch):
+    image_storage = pick_image_storage()
+    name = image_storage.save("img/listed/file.jpg", ContentFile(b"thumb"))
+    assert list(iter_filenames(image_storage, "img/listed")) == ["file.jpg"]
+    assert list(iter_filenames(image_storage, "img/missing")) == []
+
+    # Storages without local paths are listed in full.
+    def path(name):
+        raise NotImplementedError
+
+    def listdir(path):
+        if path != "img/listed":
+            raise FileNotFoundError(path)
+        return ["subdirectory"], ["remote.jpg"]
+
+    monkeypatch.setattr(image_storage, "path", path)
+    monkeypatch.setattr(image_storage, "listdir", listdir)
+    assert list(iter_filenames(image_storage, "img/listed")) == ["remote.jpg"]
+    assert list(iter_filenames(image_storage, "img/missing")) == []
+    monkeypatch.undo()
+    image_storage.delete(name)
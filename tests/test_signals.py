@@ -2,10 +2,11 @@ from unittest.mock import MagicMock
 
 import pytest
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
 
 import pyvips
 from easy_images import Img
-from easy_images.models import EasyImage
+from easy_images.models import EasyImage, SourceImage
 from easy_images.signals import queued_img
 from tests.easy_images_tests.models import Profile
 
@@ -63,3 +64,19 @@ def test_queued_img_signal():
     )
     # .queue is triggered, which triggers the queued_img signal
     assert handler.called
+
+
+@pytest.mark.django_db
+def test_probe_on_save():
+    content = pyvips.Image.black(200, 100).write_to_buffer(".png")
+    with override_settings(EASY_IMAGES={"PROBE_ON_SAVE": True}):
+        profile = Profile.objects.create(
+            name="Test", image=SimpleUploadedFile(name="probe.png", content=content)
+        )
+        # Files that aren't images are skipped.
+        Profile.objects.create(
+            name="Test", image=SimpleUploadedFile(name="probe.txt", content=b"text")
+        )
+    source = SourceImage.objects.get(name__startswith="profile-images/probe")
+    assert (source.width, source.height, source.format) == (200, 100, "png")
+    assert Img(width=100)(profile.image).source == source
@@ -0,0 +1,78 @@
+import pytest
+from django.db.models import FileField
+from django.db.models.fields.files import FieldFile
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+
+from easy_images.core import Img
+from easy_images.middleware import RenderStatsMiddleware
+from easy_images.models import EasyImage, ImageStatus
+from easy_images.stats import BuildStats, percentile, track_renders
+
+
+def test_percentile():
+    values = [0.4, 0.1, 0.3, 0.2]
+    assert percentile(values, 50) == 0.2
+    assert percentile(values, 90) == 0.4
+    assert percentile(values, 0) == 0.1
+    assert percentile([], 50) == 0
+
+
+def test_build_stats():
+    stats = BuildStats()
+    stats.record(
+        instance=EasyImage(status=ImageStatus.BUILT),
+        timings={"fetch": 0.1, "encode": 0.2},
+        source_bytes=1000,
+        output_bytes=100,
+        loader="jpegload",
+    )
+    stats.record(
+        instance=EasyImage(status=ImageStatus.SOURCE_ERROR),
+        timings={"fetch": 0.3},
+        source_bytes=None,
+    )
+    data = stats.as_dict()
+    assert (data["built"], data["errors"]) == (1, 1)
+    assert (data["source_bytes"], data["output_bytes"]) == (1000, 100)
+    assert data["loaders"] == {"jpegload": 1}
+    assert list(data["stages"]) == ["fetch", "encode"]
+    assert data["stages"]["fetch"]["p50"] == 0.1
+    assert data["stages"]["fetch"]["p90"] == 0.3
+    assert len(stats.summary()) == 3
+
+
+@pytest.mark.django_db
+def test_track_renders():
+    source = FieldFile(instance=EasyImage(), field=FileField(), name="test.jpg")
+    thumb = Img(width=100)
+    with track_renders() as stats:
+        thumb(source).as_html()
+        thumb(source).as_html()
+    assert stats.as_dict() == {
+        "bound_imgs": 2,
+        "lookups": 6,
+        "created": 3,
+        "hits": 0,
+        "misses": 6,
+        "inline_builds": 0,
+        "inline_build_time": 0,
+        "fallbacks": 2,
+    }
+    # Not tracked outside of the context.
+    thumb(source)
+    assert stats.bound_imgs == 2
+
+
+@pytest.mark.django_db
+@override_settings(DEBUG=True)
+def test_render_stats_middleware():
+    source = FieldFile(instance=EasyImage(), field=FileField(), name="test.jpg")
+
+    def view(request):
+        return HttpResponse(Img(width=100)(source).as_html())
+
+    response = RenderStatsMiddleware(view)(RequestFactory().get("/"))
+    assert response[RenderStatsMiddleware.header].startswith(
+        "bound_imgs=1, lookups=3, created=3,"
+    )
@@ -0,0 +1,42 @@
+import pytest
+from django.db.models import FileField
+from django.db.models.fields.files import FieldFile
+from django.template import Context, Template
+
+from easy_images.core import Img
+from easy_images.models import EasyImage
+
+
+@pytest.mark.django_db
+def test_img():
+    source = FieldFile(instance=EasyImage(), field=FileField(), name="test.jpg")
+    output = Template(
+        '{% load easy_images %}{% img source width="md" alt="Test" img_class="x" %}'
+    ).render(Context({"source": source}))
+    assert output == '<img class="x" src="/test.jpg" alt="Test">'
+    assert EasyImage.objects.count() == 3
+
+
+@pytest.mark.django_db
+def test_picture():
+    source = FieldFile(instance=EasyImage(), field=FileField(), name="test.jpg")
+    output = Template(
+        '{% load easy_images %}{% picture source thumb formats="avif,webp" alt="" %}'
+    ).render(Context({"source": source, "thumb": Img(width=100, densities=[])}))
+    assert output == '<picture><img src="/test.jpg" alt=""></picture>'
+    # base jpg, avif, webp
+    assert EasyImage.objects.count() == 3
+
+
+@pytest.mark.django_db
+def test_img_upscale():
+    source = FieldFile(instance=EasyImage(), field=FileField(), name="test.jpg")
+    template = Template(
+        "{% load easy_images %}{% img source width=100 upscale=upscale alt='' %}"
+    )
+    template.render(Context({"source": source, "upscale": False}))
+    template.render(Context({"source": source, "upscale": True}))
+    # The upscale option isn't part of a version's identity, so the versions are
+    # shared (keeping the options of the Img that created them).
+    upscale = [image.args.get("upscale") for image in EasyImage.objects.all()]
+    assert upscale == [False] * 3
@@ -0,0 +1,137 @@
+import re
+from datetime import timedelta
+
+import pytest
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import FileField
+from django.db.models.fields.files import FieldFile
+from django.test import override_settings
+from django.utils import timezone
+
+from easy_images import views
+from easy_images.core import Img
+from easy_images.models import EasyImage, ImageStatus
+from easy_images.views import build_lock
+from pyvips import Image
+
+
+@pytest.fixture
+def source():
+    content = Image.black(1000, 1000).write_to_buffer(".jpg")
+    name = default_storage.save("on-demand.jpg", ContentFile(content))
+    return FieldFile(instance=EasyImage(), field=FileField(), name=name)
+
+
+@pytest.mark.django_db
+@override_settings(EASY_IMAGES={"ON_DEMAND": True})
+def test_on_demand(client, source):
+    html = Img(width=100)(source).as_html()
+    urls = re.findall(r"/img/[0-9a-f-]+/", html)
+    # base jpg, avif, avif 2x
+    assert len(urls) == 3
+    assert EasyImage.objects.filter(image="").count() == 3
+
+    response = client.get(urls[0])
+    assert response.status_code == 200
+    assert response["Content-Type"] == "image/jpeg"
+    assert response["Cache-Control"] == "public, max-age=31536000, immutable"
+    assert b"".join(response.streaming_content).startswith(b"\xff\xd8")
+    assert EasyImage.objects.filter(image="").count() == 2
+
+    response = client.get(urls[0], headers={"If-None-Match": response["ETag"]})
+    assert response.status_code == 304
+
+
+@pytest.mark.django_db
+def test_on_demand_source_error(client):
+    easy_image = EasyImage.objects.create(
+        args={"width": 100}, name="missing.jpg", storage="default"
+    )
+    response = client.get(easy_image.get_on_demand_url())
+    assert response.status_code == 404
+    easy_image.refresh_from_db()
+    assert easy_image.status == ImageStatus.SOURCE_ERROR
+
+
+@pytest.mark.django_db
+@override_settings(EASY_IMAGES={"MAX_SOURCE_PIXELS": 1000})
+def test_on_demand_source_too_large(client, source):
+    easy_image = EasyImage.objects.create(
+        args={"width": 100}, name=source.name, storage="default"
+    )
+    # The original isn't redirected to, since it's too large to build.
+    response = client.get(easy_image.get_on_demand_url())
+    assert response.status_code == 404
+    easy_image.refresh_from_db()
+    assert easy_image.status == ImageStatus.SOURCE_TOO_LARGE
+
+
+@pytest.mark.django_db
+def test_on_demand_fallback(client, source):
+    easy_image = EasyImage.objects.create(
+        args={"width": 100},
+        name=source.name,
+        storage="default",
+        status=ImageStatus.BUILDING,
+        status_changed_date=timezone.now(),
+    )
+    url = easy_image.get_on_demand_url()
+    with override_settings(EASY_IMAGES={"ON_DEMAND_WAIT": 0}):
+        assert client.get(url).status_code == 302
+    # Only redirect to the original if the FALLBACK setting would use it.
+    with override_settings(
+        EASY_IMAGES={"ON_DEMAND_WAIT": 0, "FALLBACK": ["closest", "placeholder"]}
+    ):
+        response = client.get(url)
+        assert response.status_code == 503
+        EasyImage.objects.filter(pk=easy_image.pk).update(
+            status=ImageStatus.BUILD_ERROR
+        )
+        assert client.get(url).status_code == 404
+
+
+@pytest.mark.django_db
+def test_not_found(client):
+    response = client.get("/img/00000000-0000-0000-0000-000000000000/")
+    assert response.status_code == 404
+
+
+@pytest.mark.django_db
+def test_on_demand_waits_outside_lock(client, source, monkeypatch):
+    easy_image = EasyImage.objects.create(
+        args={"width": 100},
+        name=source.name,
+        storage="default",
+        status=ImageStatus.BUILDING,
+        status_changed_date=timezone.now(),
+    )
+    locked = []
+
+    def sleep(seconds):
+        locked.append(build_lock(easy_image.pk).locked())
+        EasyImage.objects.filter(pk=easy_image.pk).update(
+            status=ImageStatus.BUILD_ERROR
+        )
+
+    monkeypatch.setattr(views.time, "sleep", sleep)
+    response = client.get(easy_image.get_on_demand_url())
+    assert response.status_code == 302
+    # The image was being built elsewhere, so was waited for without the lock held.
+    assert locked == [False]
+
+
+@pytest.mark.django_db
+def test_on_demand_stale_building(client, source):
+    easy_image = EasyImage.objects.create(
+        args={"width": 100},
+        name=source.name,
+        storage="default",
+        status=ImageStatus.BUILDING,
+        status_changed_date=timezone.now() - timedelta(hours=1),
+    )
+    # Whatever was building the image stopped long ago, so it's built now.
+    response = client.get(easy_image.get_on_demand_url())
+    assert response.status_code == 200
+    easy_image.refresh_from_db()
+    assert easy_image.status == ImageStatus.BUILT
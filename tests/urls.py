@@ -0,0 +1,5 @@
+from django.urls import include, path
+
+urlpatterns = [
+    path("img/", include("easy_images.urls")),
+]